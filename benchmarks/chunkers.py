@@ -0,0 +1,112 @@
+"""
+    Benchmark of the chunkers over synthetic texts
+
+    Run from the root of the repository :
+
+    .. code-block:: bash
+
+        python -m benchmarks.chunkers --sizes 10000 100000 1000000
+
+    For each size, a three levels text (book, poem, line) is generated and each chunker is timed (Throughput in
+    references per second) then run again under tracemalloc to measure its peak memory.
+"""
+import argparse
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from MyCapytain.common.reference import Citation
+
+from flask_nemo.common import join_or_single
+from flask_nemo.chunker import level_grouper, line_chunker, size_grouper
+
+
+def legacy_level_grouper(text, getreffs, level=None, groupby=20):
+    """ Implementation of level_grouper up to Nemo 2.0.0, kept for comparison """
+    if level is None or level > len(text.citation):
+        level = len(text.citation)
+
+    references = [str(ref) for ref in getreffs(level=level)]
+    _refs = OrderedDict()
+
+    for key in references:
+        k = ".".join(key.split(".")[:level-1])
+        if k not in _refs:
+            _refs[k] = []
+        _refs[k].append(key)
+        del k
+
+    return [
+        (
+            join_or_single(ref[0], ref[-1]),
+            join_or_single(ref[0], ref[-1])
+        )
+        for sublist in _refs.values()
+        for ref in [
+            sublist[i:i+groupby]
+            for i in range(0, len(sublist), groupby)
+        ]
+    ]
+
+
+class SyntheticText(object):
+    """ Text metadata with a book, poem, line citation scheme """
+    def __init__(self, size):
+        self.id = "urn:cts:benchLit:bench.synthetic{}".format(size)
+        self.citation = Citation(name="book", child=Citation(name="poem", child=Citation(name="line")))
+        self.references = [
+            "{}.{}.{}".format(book, poem, line)
+            for book in range(1, size // 10000 + 2)
+            for poem in range(1, 101)
+            for line in range(1, 101)
+        ][:size]
+
+    def getreffs(self, level):
+        return self.references
+
+
+CHUNKERS = OrderedDict([
+    ("legacy_level_grouper", lambda text, getreffs: legacy_level_grouper(text, getreffs, groupby=20)),
+    ("level_grouper", lambda text, getreffs: level_grouper(text, getreffs, groupby=20)),
+    ("line_chunker", lambda text, getreffs: line_chunker(text, getreffs, lines=20)),
+    ("size_grouper", lambda text, getreffs: size_grouper(
+        text, getreffs, sizes=lambda text, level: {}, budget=20
+    ))
+])
+
+
+def measure(chunker, text, repeat=3):
+    """ Measure a chunker
+
+    :return: Best throughput (references per second) and peak memory (bytes)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunker(text, text.getreffs)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    chunker(text, text.getreffs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(text.references) / min(timings), peak
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark Nemo chunkers over synthetic texts")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10000, 100000, 1000000],
+                        help="Number of references of the synthetic texts")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs (Best is kept)")
+    args = parser.parse_args(args)
+
+    print("{:<22}{:>10}{:>18}{:>16}".format("chunker", "refs", "refs/s", "peak (KiB)"))
+    for size in args.sizes:
+        text = SyntheticText(size)
+        for name, chunker in CHUNKERS.items():
+            throughput, peak = measure(chunker, text, repeat=args.repeat)
+            print("{:<22}{:>10}{:>18,.0f}{:>16,.0f}".format(name, size, throughput, peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
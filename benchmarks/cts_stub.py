@@ -0,0 +1,237 @@
+"""
+    Stub CTS API serving the fixtures of tests/test_data, so that a Nemo instance backed by an HttpCtsResolver can
+    be benchmarked or load-tested without network access.
+
+    Run from the root of the repository :
+
+    .. code-block:: bash
+
+        python -m benchmarks.cts_stub --port 8080 --latency 0.05 --bandwidth 1000000
+        capitains-nemo cts-api http://127.0.0.1:8080/
+
+    GetCapabilities and GetPrevNextUrn (or GetPrevNext) are answered with their fixture whatever the requested URN.
+    GetValidReff answers with the references of its fixture at the requested level (relative to the requested passage)
+    and within the requested passage. GetPassage and GetPassagePlus answer with their fixture in which the passage, and
+    its previous and next passages, are the requested ones, extracted from the source of the text of the fixtures. Each
+    response is delayed by the injected latency and its body is streamed at the injected bandwidth.
+"""
+import argparse
+import os.path as op
+import random
+import threading
+import time
+from collections import Counter
+
+from lxml import etree, objectify
+from MyCapytain.common.constants import Mimetypes
+from MyCapytain.common.reference import CtsReference
+from MyCapytain.resources.texts.local.capitains.cts import CapitainsCtsText
+from werkzeug.serving import make_server, WSGIRequestHandler
+from werkzeug.wrappers import Request, Response
+
+
+FIXTURES = {
+    "GetCapabilities": "getcapabilities.xml",
+    "GetValidReff": "getvalidreff.xml",
+    "GetPassage": "getpassage.xml",
+    "GetPassagePlus": "getpassageplus.xml",
+    "GetPrevNextUrn": "getprevnext.xml"
+}
+ALIASES = {
+    "getprevnext": "getprevnexturn"
+}
+SOURCE = "nautilus/latinLit/data/phi1294/phi002/phi1294.phi002.perseus-lat2.xml"
+CTS = "http://chs.harvard.edu/xmlns/cts"
+REFF = "{%s}reply/{%s}reff" % (CTS, CTS)
+
+
+class CtsStub(object):
+    """ WSGI application answering CTS requests with fixtures
+
+    :param path: Directory of the fixtures
+    :param latency: Delay before each response, in seconds
+    :param jitter: Maximum random delay added to the latency, in seconds
+    :param bandwidth: Rate at which bodies are sent, in bytes per second (Default: unlimited)
+    :param chunk_size: Size of the chunks in which bodies are sent when the bandwidth is limited, in bytes
+    :param source: TEI file of the text of the fixtures, relative to path, from which passages are extracted
+    """
+    def __init__(self, path="tests/test_data", latency=0, jitter=0, bandwidth=None, chunk_size=8192, source=SOURCE):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+        self.requests = Counter()
+        self.__lock__ = threading.Lock()
+        self.responses = {}
+        for request, filename in FIXTURES.items():
+            with open(op.join(path, filename), "rb") as f:
+                self.responses[request.lower()] = f.read()
+
+        self.references = [
+            urn.text for urn in etree.fromstring(self.responses["getvalidreff"]).find(REFF)
+        ]
+        self.text = self.references[0].rsplit(":", 1)[0]
+        with open(op.join(path, source)) as f:
+            self.source = CapitainsCtsText(resource=f, urn=self.text)
+        # Passage responses are built once per request and URN
+        self.passages = {}
+
+    def passage(self, name, urn=None):
+        """ Build a GetPassage or GetPassagePlus response for a passage of the text of the fixtures
+
+        :param name: Lowercased name of the request
+        :param urn: Requested URN, with its passage
+        :return: Response body or None when the passage is not part of the text
+        """
+        if not urn or urn.count(":") < 4 or urn.rsplit(":", 1)[0] != self.text:
+            return None
+        with self.__lock__:
+            if (name, urn) in self.passages:
+                return self.passages[name, urn]
+            reference = urn.rsplit(":", 1)[1]
+            try:
+                passage = self.source.getTextualNode(CtsReference(reference))
+            except IndexError:
+                self.passages[name, urn] = None
+                return None
+            tei = passage.export(Mimetypes.PYTHON.ETREE)
+            objectify.deannotate(tei, cleanup_namespaces=True)
+
+            document = etree.fromstring(self.responses[name])
+            document.find("{%s}request/{%s}requestUrn" % (CTS, CTS)).text = urn
+            document.find("{%s}request/{%s}psg" % (CTS, CTS)).text = reference
+            document.find("{%s}reply/{%s}urn" % (CTS, CTS)).text = urn
+            container = document.find("{%s}reply/{%s}passage" % (CTS, CTS))
+            for child in list(container):
+                container.remove(child)
+            container.append(tei)
+            for kind, sibling in (("prev", passage.prevId), ("next", passage.nextId)):
+                element = document.find("{%s}reply/{%s}prevnext/{%s}%s/{%s}urn" % (CTS, CTS, CTS, kind, CTS))
+                if element is not None:
+                    element.text = "{}:{}".format(self.text, sibling) if sibling else None
+            self.passages[name, urn] = etree.tostring(document, encoding="utf-8")
+            return self.passages[name, urn]
+
+    def valid_reff(self, urn=None, level=None):
+        """ Build a GetValidReff response from the references of the fixture
+
+        :param urn: Requested URN, with an optional passage
+        :param level: Requested depth, relative to the passage (Default: 1)
+        :return: Response body
+        """
+        passage = urn.split(":")[4] if urn and urn.count(":") >= 4 else None
+        depth = int(level) if level else 1
+        if passage:
+            depth += passage.count(".") + 1
+        references = []
+        for reference in self.references:
+            base, reference = reference.rsplit(":", 1)
+            if passage and not reference.startswith(passage + "."):
+                continue
+            reference = ".".join(reference.split(".")[:depth])
+            if reference != passage and (not references or references[-1] != base + ":" + reference):
+                references.append(base + ":" + reference)
+
+        document = etree.fromstring(self.responses["getvalidreff"])
+        reff = document.find(REFF)
+        for child in list(reff):
+            reff.remove(child)
+        reff.set("level", str(depth))
+        for reference in references:
+            etree.SubElement(reff, "{%s}urn" % CTS).text = reference
+        return etree.tostring(document, encoding="utf-8")
+
+    def body(self, request):
+        """ Retrieve the body answering a request
+
+        :param request: Request
+        :return: Status code and body
+        """
+        name = request.args.get("request", "").lower()
+        name = ALIASES.get(name, name)
+        with self.__lock__:
+            self.requests[name] += 1
+        if name not in self.responses:
+            return 400, (
+                '<CTSError xmlns="{}"><message>Unknown request {}</message><code>1</code></CTSError>'.format(
+                    CTS, request.args.get("request", "")
+                ).encode("utf-8")
+            )
+        if name == "getvalidreff":
+            return 200, self.valid_reff(request.args.get("urn"), request.args.get("level"))
+        if name in ("getpassage", "getpassageplus"):
+            body = self.passage(name, request.args.get("urn"))
+            if body is None:
+                return 400, (
+                    '<CTSError xmlns="{}"><message>Invalid urn {}</message><code>3</code></CTSError>'.format(
+                        CTS, request.args.get("urn", "")
+                    ).encode("utf-8")
+                )
+            return 200, body
+        return 200, self.responses[name]
+
+    def stream(self, body):
+        """ Send a body at the injected bandwidth
+
+        :param body: Body to send
+        """
+        for start in range(0, len(body), self.chunk_size):
+            chunk = body[start:start + self.chunk_size]
+            time.sleep(len(chunk) / self.bandwidth)
+            yield chunk
+
+    def __call__(self, environ, start_response):
+        status, body = self.body(Request(environ))
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.bandwidth:
+            response = Response(self.stream(body), status=status, mimetype="text/xml")
+            response.headers["Content-Length"] = str(len(body))
+        else:
+            response = Response(body, status=status, mimetype="text/xml")
+        return response(environ, start_response)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """ Request handler which does not log requests """
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(app, host="127.0.0.1", port=0):
+    """ Serve a WSGI application in a background thread
+
+    :return: Server, whose port attribute is the port it listens on
+    """
+    server = make_server(host, port, app, threaded=True, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Stub CTS API serving the fixtures of the tests")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind to")
+    parser.add_argument("--port", type=int, default=8080, help="Port to bind to")
+    parser.add_argument("--path", type=str, default="tests/test_data", help="Directory of the fixtures")
+    parser.add_argument("--source", type=str, default=SOURCE,
+                        help="TEI file of the text of the fixtures, relative to the directory of the fixtures")
+    parser.add_argument("--latency", type=float, default=0, help="Delay before each response, in seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="Maximum random delay added to the latency")
+    parser.add_argument("--bandwidth", type=int, default=None, help="Bandwidth in bytes per second")
+    args = parser.parse_args(args)
+
+    stub = CtsStub(args.path, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth, source=args.source)
+    server = make_server(args.host, args.port, stub, threaded=True, request_handler=QuietRequestHandler)
+    print("Stub CTS API on http://{}:{}/".format(args.host, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Requests: {}".format(" ".join("{}={}".format(k, v) for k, v in sorted(stub.requests.items()))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+    Benchmark of the routes of Nemo over the corpus of the tests
+
+    Run from the root of the repository :
+
+    .. code-block:: bash
+
+        python -m benchmarks.routes --output results.json
+        python -m benchmarks.routes --output new.json --compare results.json
+
+    Nemo is booted on the local corpus of tests/test_data (local setup) and on a stub CTS API serving the fixtures
+    of tests/test_data (api setup). Each route is requested through the test client of the application, after a
+    few warm-up requests, and its latency percentiles and throughput are reported. The chunkers are timed over the
+    references of the benchmarked text.
+
+    Results are written as JSON and can be compared to a previous run : routes whose median latency grew by more
+    than --threshold percent are reported as regressions and the command exits with status 1.
+"""
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, url_for
+from MyCapytain.common.reference import URN
+from MyCapytain.resolvers.cts.api import HttpCtsResolver
+from MyCapytain.resolvers.cts.local import CtsCapitainsLocalResolver
+from MyCapytain.retrievers.cts5 import HttpCtsRetriever
+
+from flask_nemo import Nemo
+from flask_nemo.plugins.annotations_api import AnnotationsApiPlugin
+from flask_nemo.query.interface import SimpleQuery
+from flask_nemo.query.resolve import Resolver, LocalRetriever
+
+from benchmarks.chunkers import CHUNKERS
+from benchmarks.cts_stub import CtsStub, serve
+
+
+TEXT = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+SETUPS = ["local", "api"]
+
+
+def make_nemo(setup, address=None):
+    """ Boot a Nemo instance. The local setup has the annotations API : SimpleQuery expands the targets of \
+    annotations with references objects that HttpCtsResolver does not return
+
+    :param setup: local or api
+    :param address: Address of the CTS API (api setup)
+    :return: Application, Nemo instance and query interface of the annotations (None for the api setup)
+    """
+    logger = logging.getLogger("benchmarks")
+    logger.propagate = False
+    if setup == "local":
+        resolver = CtsCapitainsLocalResolver(["tests/test_data/interface/latinLit"], logger=logger)
+    else:
+        resolver = HttpCtsResolver(HttpCtsRetriever(address))
+    query = SimpleQuery(
+        [
+            (URN(TEXT + ":6.1"), "interface/treebanks/treebank1.xml", "dc:treebank"),
+            (URN(TEXT + ":1.5"), "interface/treebanks/treebank2.xml", "dc:treebank")
+        ],
+        Resolver(LocalRetriever(path="./tests/test_data/"))
+    )
+    app = Flask("Nemo")
+    nemo = Nemo(
+        app=app,
+        name="nemo",
+        base_url="",
+        resolver=resolver,
+        plugins=[AnnotationsApiPlugin(name="annotations", queryinterface=query)] if setup == "local" else None
+    )
+    if setup == "local":
+        query.process(nemo)
+        return app, nemo, query
+    return app, nemo, None
+
+
+def scenarios(app, nemo, query):
+    """ URLs of the benchmarked routes
+
+    :return: Dictionary of URLs per route name
+    """
+    with app.test_request_context():
+        nemo.get_inventory()
+        urls = OrderedDict([
+            ("r_collections", url_for("nemo.r_collections")),
+            ("r_collection", url_for("nemo.r_collection", objectId="urn:cts:latinLit:phi1294")),
+            ("r_references", url_for("nemo.r_references", objectId=TEXT)),
+            ("r_first_passage", url_for("nemo.r_first_passage", objectId=TEXT)),
+            ("r_passage", url_for("nemo.r_passage", objectId=TEXT, subreference="1.pr.1-1.pr.20"))
+        ])
+        if query is not None:
+            annotation = query.annotations[0]
+            urls["r_annotations"] = url_for("nemo.r_annotations", target=TEXT + ":6")
+            urls["r_annotation"] = url_for("nemo.r_annotation", sha=annotation.sha)
+            urls["r_annotation_body"] = url_for("nemo.r_annotation_body", sha=annotation.sha)
+        return urls
+
+
+def percentile(samples, rank):
+    """ Nearest-rank percentile of sorted samples """
+    return samples[min(len(samples) - 1, max(0, int(round(rank / 100 * len(samples))) - 1))]
+
+
+def summarize(samples, elapsed, errors=0):
+    """ Summarize timings (in seconds)
+
+    :return: Dictionary with count, errors, mean, p50, p90, p99, max (in milliseconds) and throughput (per second)
+    """
+    samples = sorted(samples)
+    summary = OrderedDict([("count", len(samples)), ("errors", errors)])
+    summary["mean"] = sum(samples) / len(samples) * 1000
+    for rank in (50, 90, 99):
+        summary["p{}".format(rank)] = percentile(samples, rank) * 1000
+    summary["max"] = samples[-1] * 1000
+    summary["throughput"] = len(samples) / elapsed
+    return summary
+
+
+def measure_route(app, url, requests=100, warmup=5, concurrency=1):
+    """ Time requests of a URL
+
+    :return: Summary of the timings
+    """
+    client = app.test_client()
+    for _ in range(warmup):
+        client.get(url).close()
+
+    def timed(_):
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        response.close()
+        return time.perf_counter() - start, response.status_code >= 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    return summarize([duration for duration, _ in timings], elapsed, sum(error for _, error in timings))
+
+
+def measure_chunkers(nemo, repeat=20):
+    """ Time the chunkers over the references of the benchmarked text
+
+    :return: Summary of the timings per chunker
+    """
+    text = nemo.get_collection(TEXT)
+    references = [str(reff) for reff in nemo.resolver.getReffs(TEXT, level=len(text.citation))]
+    results = OrderedDict()
+    for name, chunker in CHUNKERS.items():
+        samples = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            sample = time.perf_counter()
+            chunker(text, lambda level: references)
+            samples.append(time.perf_counter() - sample)
+        results["chunker:" + name] = summarize(samples, time.perf_counter() - start)
+    return results
+
+
+def metadata():
+    """ Describe the environment of a run """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return OrderedDict([
+        ("date", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("commit", commit),
+        ("python", platform.python_version()),
+        ("platform", platform.platform())
+    ])
+
+
+def run(setups=SETUPS, routes=None, requests=100, warmup=5, concurrency=1, repeat=20, latency=0, bandwidth=None):
+    """ Run the benchmarks
+
+    :param latency: Latency injected in the responses of the stub CTS API, in seconds
+    :param bandwidth: Bandwidth of the stub CTS API, in bytes per second
+
+    :return: Results per setup, then per route or chunker
+    """
+    results = OrderedDict()
+    for setup in setups:
+        server = None
+        if setup == "api":
+            server = serve(CtsStub(latency=latency, bandwidth=bandwidth))
+        try:
+            app, nemo, query = make_nemo(setup, "http://127.0.0.1:{}/".format(server.port) if server else None)
+            results[setup] = OrderedDict()
+            for name, url in scenarios(app, nemo, query).items():
+                if routes and name not in routes:
+                    continue
+                results[setup][name] = measure_route(app, url, requests, warmup, concurrency)
+            if not routes or "chunkers" in routes:
+                results[setup].update(measure_chunkers(nemo, repeat))
+        finally:
+            if server is not None:
+                server.shutdown()
+    return results
+
+
+def compare(baseline, current, threshold=10):
+    """ Compare the median latencies of two runs
+
+    :return: Rows of setup, name, baseline and current median latencies, relative change in percent and \
+    regression flag
+    """
+    rows = []
+    for setup, benchmarks in current.items():
+        for name, summary in benchmarks.items():
+            if name not in baseline.get(setup, {}):
+                continue
+            before, after = baseline[setup][name]["p50"], summary["p50"]
+            change = (after - before) / before * 100 if before else 0
+            rows.append((setup, name, before, after, change, change > threshold))
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark Nemo routes over the corpus of the tests")
+    parser.add_argument("--setups", nargs="*", choices=SETUPS, default=SETUPS,
+                        help="Resolvers to benchmark : local corpus or stub CTS API")
+    parser.add_argument("--routes", nargs="*", default=None,
+                        help="Routes to benchmark (eg. r_passage chunkers). Default: every route")
+    parser.add_argument("--requests", type=int, default=100, help="Number of timed requests per route")
+    parser.add_argument("--warmup", type=int, default=5, help="Number of untimed requests per route")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent requests")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of timed runs per chunker")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Latency of the stub CTS API (api setup), in seconds")
+    parser.add_argument("--bandwidth", type=int, default=None,
+                        help="Bandwidth of the stub CTS API (api setup), in bytes per second")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON file of results")
+    parser.add_argument("--compare", type=str, default=None, help="Path of the JSON file of a previous run")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="Increase of the median latency, in percent, reported as a regression")
+    args = parser.parse_args(args)
+
+    results = run(
+        args.setups, args.routes, args.requests, args.warmup, args.concurrency, args.repeat,
+        latency=args.latency, bandwidth=args.bandwidth
+    )
+
+    print("{:<8}{:<30}{:>10}{:>10}{:>10}{:>10}{:>12}{:>8}".format(
+        "setup", "benchmark", "mean", "p50", "p90", "p99", "per second", "errors"
+    ))
+    for setup, benchmarks in results.items():
+        for name, summary in benchmarks.items():
+            print("{:<8}{:<30}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}{:>8}".format(
+                setup, name, summary["mean"], summary["p50"], summary["p90"], summary["p99"],
+                summary["throughput"], summary["errors"]
+            ))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "parameters": vars(args), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print("Compared to {} ({})".format(args.compare, baseline["metadata"].get("commit")))
+        print("{:<8}{:<30}{:>12}{:>12}{:>10}".format("setup", "benchmark", "before p50", "after p50", "change"))
+        regressions = 0
+        for setup, name, before, after, change, regression in compare(baseline["results"], results, args.threshold):
+            regressions += regression
+            print("{:<8}{:<30}{:>12.2f}{:>12.2f}{:>+9.1f}%{}".format(
+                setup, name, before, after, change, " REGRESSION" if regression else ""
+            ))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
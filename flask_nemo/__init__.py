@@ -7,6 +7,8 @@
 """
 
 from urllib.parse import quote
+from io import BytesIO
+from functools import wraps
 from operator import itemgetter
 from warnings import warn
 from collections import OrderedDict
@@ -15,24 +17,35 @@ from copy import deepcopy as copy
 from pkg_resources import resource_filename
 
 from lxml import etree
-from flask import render_template, Blueprint, abort, Markup, send_from_directory, Flask, url_for, redirect, request
+from flask import render_template, Blueprint, abort, Markup, send_from_directory, Flask, url_for, redirect, request, \
+    make_response, Response, has_request_context
 
 import jinja2
 import inspect
+import mimetypes
+import os
 import os.path as op
+import types
 
 from MyCapytain.common.constants import Mimetypes
+from MyCapytain.resolvers.cts.local import CtsCapitainsLocalResolver
 from MyCapytain.resources.prototypes.metadata import ResourceCollection
 from MyCapytain.resources.prototypes.cts.inventory import CtsWorkMetadata, CtsEditionMetadata
-from MyCapytain.errors import UnknownCollection
+from MyCapytain.errors import UnknownCollection, UnknownObjectError, InvalidURN
 
 import flask_nemo._data
 import flask_nemo.filters
-from flask_nemo.errors import ValueWarning
+from flask_nemo.errors import ValueWarning, TransformError
 from flask_nemo.chunker import level_grouper as __level_grouper__
 from flask_nemo.plugins.default import Breadcrumb
-from flask_nemo.common import resource_qualifier, ASSETS_STRUCTURE
-from flask_nemo.jinjaext import FakeCacheExtension
+from flask_nemo.common import resource_qualifier, ASSETS_STRUCTURE, truncate_hierarchy, hierarchy_branch, \
+    callable_fingerprint, stable_identifier
+from flask_nemo.store import file_checksum
+from flask_nemo.transform import TransformPool
+from flask_nemo.jinjaext import FakeCacheExtension, FragmentCacheExtension, FrozenTemplateLoader
+from flask_nemo.cache import LRUCache, ResponseCache, SingleFlight
+from flask_nemo.assets import Bundle
+from flask_nemo.inventory import InventoryIndex
 
 
 class Nemo(object):
@@ -75,12 +88,54 @@ class Nemo(object):
     :type original_breadcrumb: bool
     :param default_lang: Default lang to fall back to
     :type default_lang: str
+    :param reference_store: Persistent store of references and chunker output
+    :type reference_store: flask_nemo.store.ReferenceStore
+    :param references_depth: Number of citation levels rendered on the references page. Deeper levels are loaded \
+    on demand through the r_references_subtree route (Default : all levels are rendered)
+    :type references_depth: int
+    :param production: Resolve templates once at startup and disable template reloading (Default: False)
+    :type production: bool
+    :param bytecode_cache: Directory (or Jinja bytecode cache instance) used to persist compiled templates \
+    across restarts and workers
+    :type bytecode_cache: str|jinja2.BytecodeCache
+    :param fragment_cache: In-process cache of template fragments used when no Flask-Caching instance is given. \
+    True creates an LRUCache whose fragments expire after FRAGMENT_TIMEOUT seconds when the route has no \
+    time-to-live (Default: None, fragments are not cached)
+    :type fragment_cache: bool|flask_nemo.cache.LRUCache
+    :param cache_timeouts: Time-to-live of cached template fragments in seconds, per route function name \
+    (eg. r_passage), with a "default" key for other routes. 0 means no expiration with Flask-Caching and the \
+    default time-to-live of the fragment cache otherwise (Default: {"default": 0})
+    :type cache_timeouts: {str: int}
+    :param response_cache: Cache of complete responses, stored with their gzip and brotli compressed variants. \
+    True creates a default ResponseCache (Default: None, responses are not cached)
+    :type response_cache: bool|flask_nemo.cache.ResponseCache
+    :param bundle_assets: Concatenate local css and js assets into content-hashed bundles at startup, served with \
+    immutable caching headers (Default: False)
+    :type bundle_assets: bool
+    :param bundle_minifiers: Minifier function per type of asset used when bundling (Default: \
+    flask_nemo.assets.minify_css for css, scripts are not minified)
+    :type bundle_minifiers: {str: function(str) -> str}
+    :param passage_store: Persistent store of transformed passages
+    :type passage_store: flask_nemo.store.PassageStore
+    :param transform_pool: Pool of worker processes applying XSL stylesheets. True creates a pool for the \
+    stylesheets of the transform parameter (Default: None, stylesheets are applied in the serving thread)
+    :type transform_pool: bool|flask_nemo.transform.TransformPool
+    :param profiler: Profiler of single requests, triggered by a token (Default: None, views are not wrapped)
+    :type profiler: flask_nemo.profiler.RequestProfiler
+    :param negative_cache: Cache of unknown collections and passage references, whose errors are raised again \
+    without reaching the inventory nor the resolver. True creates a LRUCache of 10000 entries kept for 60 seconds \
+    (Default: None, unknown identifiers are looked up at each request)
+    :type negative_cache: bool|flask_nemo.cache.LRUCache
+    :param single_flight: Coalescing of concurrent computations of the same memoized entry, when a cache is set. \
+    True creates a SingleFlight coalescing threads of the process (Default: None, each cache miss is computed)
+    :type single_flight: bool|flask_nemo.cache.SingleFlight
 
     :ivar assets: Dictionary of assets loaded individually
     :ivar plugins: List of loaded plugins
     :ivar resolver: Resolver
     :ivar cached: List of cached functions
     :ivar cache: Cache Instance
+    :ivar reference_store: Persistent store of references and chunker output
 
     .. warning:: Until a C libxslt error is fixed ( https://bugzilla.gnome.org/show_bug.cgi?id=620102 ), \
     it is not possible to use strip spaces in the xslt given to this application. See :ref:`lxml.strip-spaces`
@@ -92,7 +147,8 @@ class Nemo(object):
         ("/collections/<objectId>", "r_collection", ["GET"]),
         ("/text/<objectId>/references", "r_references", ["GET"]),
         ("/text/<objectId>/passage/<subreference>", "r_passage", ["GET"]),
-        ("/text/<objectId>/passage", "r_first_passage", ["GET"])
+        ("/text/<objectId>/passage", "r_first_passage", ["GET"]),
+        ("/text/<objectId>/subtree/<subreference>", "r_references_subtree", ["GET"])
     ]
     SEMANTIC_ROUTES = [
         "r_collection", "r_references", "r_passage"
@@ -109,15 +165,52 @@ class Nemo(object):
 
     CACHED = [
         # Routes
-        "r_index", "r_collection", "r_collections", "r_references", "r_passage", "r_first_passage", "r_assets",
+        "r_index", "r_collection", "r_collections", "r_references", "r_references_subtree", "r_passage",
+        "r_first_passage", "r_assets",
         # Controllers
-        "get_inventory", "get_collection", "get_reffs", "get_passage", "get_siblings",
+        "get_inventory", "get_collection", "get_reffs", "get_hierarchy", "get_passage", "get_siblings",
         # Translater
         "semantic", "make_coins", "expose_ancestors_or_children", "make_members", "transform",
         # Business logic
         # "view_maker", "route", #"render",
     ]
 
+    """ Tag of the cached entries computed for no collection in particular
+    """
+    INVENTORY_TAG = "inventory"
+
+    """ Tag of the cached entries listing the members of a collection, invalidated when one of its descendants \
+    changes
+    """
+    MEMBERS_TAG = "members|{}"
+
+    """ Maximum number of hierarchies of references kept in process when neither a cache nor a reference store \
+    is set
+    """
+    HIERARCHY_ENTRIES = 100
+
+    """ Time-to-live, in seconds, of fragments of the in-process fragment cache for routes without time-to-live
+    """
+    FRAGMENT_TIMEOUT = 300
+
+    """ Errors remembered by the negative cache
+    """
+    UNKNOWN_ERRORS = (UnknownCollection, UnknownObjectError, InvalidURN)
+
+    """ Functions raising an IndexError when a reference is not found in a text by the local resolver, as \
+    (module, function name). IndexErrors raised elsewhere are bugs and are not remembered by the negative cache
+    """
+    UNKNOWN_REFERENCE_FRAMES = {("MyCapytain.common.utils.xml", "performXpath")}
+
+    """ Locales recognized in request headers and their equivalent lang code
+    """
+    LOCALES = OrderedDict([
+        ("de", "ger"),
+        ("fr", "fre"),
+        ("en", "eng"),
+        ("la", "lat")
+    ])
+
     """ Assets dictionary model
     """
     ASSETS = copy(ASSETS_STRUCTURE)
@@ -131,7 +224,11 @@ class Nemo(object):
                  urls=None, transform=None, chunker=None,
                  css=None, js=None, templates=None, statics=None,
                  prevent_plugin_clearing_assets=False,
-                 original_breadcrumb=True, default_lang="eng"):
+                 original_breadcrumb=True, default_lang="eng",
+                 reference_store=None, references_depth=None,
+                 production=False, bytecode_cache=None, fragment_cache=None, cache_timeouts=None,
+                 response_cache=None, bundle_assets=False, bundle_minifiers=None, passage_store=None,
+                 transform_pool=None, profiler=None, single_flight=None, negative_cache=None):
 
         self.name = __name__
         if name:
@@ -151,6 +248,42 @@ class Nemo(object):
             self.app = None
 
         self.cache = cache
+        self.reference_store = reference_store
+        self.references_depth = references_depth
+        self.production = production
+        if isinstance(bytecode_cache, str):
+            os.makedirs(bytecode_cache, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache)
+        self.bytecode_cache = bytecode_cache
+        if fragment_cache is True:
+            fragment_cache = LRUCache(default_timeout=type(self).FRAGMENT_TIMEOUT)
+        elif fragment_cache is False:
+            fragment_cache = None
+        self.fragment_cache = fragment_cache
+        self.cache_timeouts = {"default": 0}
+        if isinstance(cache_timeouts, dict):
+            self.cache_timeouts.update(cache_timeouts)
+        if response_cache is True:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache or None
+        self.bundle_assets = bundle_assets
+        self.bundle_minifiers = bundle_minifiers
+        self.bundles = dict()
+        self.passage_store = passage_store
+        self.profiler = profiler
+        if single_flight is True:
+            single_flight = SingleFlight()
+        self.single_flight = single_flight or None
+        if negative_cache is True:
+            negative_cache = LRUCache(max_size=4 * 1024 * 1024, max_entries=10000, default_timeout=60)
+        elif negative_cache is False:
+            negative_cache = None
+        self.negative_cache = negative_cache
+        self.__generations__ = dict()
+        # Without a cache nor a store, hierarchies are kept in process : chunkers do not change while running
+        self.__hierarchies__ = None
+        if cache is None and reference_store is None:
+            self.__hierarchies__ = LRUCache(max_entries=type(self).HIERARCHY_ENTRIES)
         self.cached = list()
         for func in self.CACHED:
             self.cached.append((getattr(self, func), self))
@@ -192,6 +325,7 @@ class Nemo(object):
 
         # Reusing self._inventory across requests
         self._inventory = None
+        self._inventory_index = None
         self._transform = {
             "default": None
         }
@@ -203,6 +337,12 @@ class Nemo(object):
         if isinstance(transform, dict):
             self._transform.update(transform)
 
+        if transform_pool is True:
+            transform_pool = TransformPool(
+                sorted(set([func for func in self._transform.values() if isinstance(func, str)]))
+            )
+        self.transform_pool = transform_pool or None
+
         self.chunker = {
             "default": type(self).default_chunker
         }
@@ -271,6 +411,26 @@ class Nemo(object):
         """
         return self.get_inventory()
 
+    @property
+    def inventory_index(self):
+        """ Index of the collections of the inventory, built on first access
+
+        :rtype: InventoryIndex
+        """
+        if self._inventory_index is None:
+            self._inventory_index = InventoryIndex(
+                self.get_inventory(),
+                langs=[self.__default_lang__] + list(type(self).LOCALES.values())
+            )
+        return self._inventory_index
+
+    def preload(self):
+        """ Retrieve the inventory and build its index ahead of the first request, typically before forking \
+        workers so that they share them
+        """
+        self.get_inventory()
+        self.inventory_index
+
     def init_app(self, app=None):
         """ Initiate the application
 
@@ -290,22 +450,13 @@ class Nemo(object):
 
         :rtype: str
         """
-        best_match = request.accept_languages.best_match(['de', 'fr', 'en', 'la'])
+        best_match = request.accept_languages.best_match(list(type(self).LOCALES.keys()))
         if best_match is None:
             if len(request.accept_languages) > 0:
                 best_match = request.accept_languages[0][0][:2]
             else:
                 return self.__default_lang__
-        lang = self.__default_lang__
-        if best_match == "de":
-            lang = "ger"
-        elif best_match == "fr":
-            lang = "fre"
-        elif best_match == "en":
-            lang = "eng"
-        elif best_match == "la":
-            lang = "lat"
-        return lang
+        return type(self).LOCALES.get(best_match, self.__default_lang__)
 
     def transform(self, work, xml, objectId, subreference=None):
         """ Transform input according to potentially registered XSLT
@@ -319,8 +470,8 @@ class Nemo(object):
 
         :param work: Work object containing metadata about the xml
         :type work: MyCapytains.resources.inventory.Text
-        :param xml: XML to transform
-        :type xml: etree._Element
+        :param xml: XML to transform, in the form given by Nemo.export_passage
+        :type xml: etree._Element|str|io.BytesIO
         :param objectId: Object Identifier
         :type objectId: str
         :param subreference: Subreference
@@ -336,6 +487,13 @@ class Nemo(object):
 
         # If we have a string, it means we get a XSL filepath
         if isinstance(func, str):
+            if self.transform_pool is not None and func in self.transform_pool:
+                try:
+                    return self.transform_pool.transform(func, xml)
+                except TransformError:
+                    abort(503)
+            if isinstance(xml, str):
+                xml = etree.fromstring(xml)
             with open(func) as f:
                 xslt = etree.XSLT(etree.parse(f))
             return etree.tostring(
@@ -349,8 +507,113 @@ class Nemo(object):
             return func(work, xml, objectId, subreference)
         # If we have None, it means we just give back the xml
         elif func is None:
+            if isinstance(xml, str):
+                return xml
             return etree.tostring(xml, encoding=str)
 
+    def transform_input(self, objectId):
+        """ Find the input the transformation of a text accepts : functions declare it through \
+        flask_nemo.transform.transform_input, stylesheets applied in the serving thread require a tree, \
+        stylesheets applied by the transform pool and the absence of transformation require a string
+
+        :param objectId: Object Identifier
+        :type objectId: str
+        :return: One of string, etree or stream
+        :rtype: str
+        """
+        func = self._transform.get(str(objectId), self._transform["default"])
+        if func is None:
+            return "string"
+        elif isinstance(func, str):
+            if self.transform_pool is not None and func in self.transform_pool:
+                return "string"
+            return "etree"
+        return getattr(func, "transform_input", "etree")
+
+    def export_passage(self, passage, objectId):
+        """ Export a passage in the form its transformation accepts
+
+        :param passage: Passage retrieved from the resolver
+        :type passage: InteractiveTextualNode
+        :param objectId: Object Identifier
+        :type objectId: str
+        :return: Serialized XML, lxml tree or binary file-like object
+        :rtype: str|etree._Element|io.BytesIO
+        """
+        kind = self.transform_input(objectId)
+        if kind == "etree":
+            return passage.export(Mimetypes.PYTHON.ETREE)
+        xml = passage.export(Mimetypes.XML.TEI)
+        if kind == "stream":
+            return BytesIO(xml.encode("utf-8"))
+        return xml
+
+    def transform_fingerprint(self, objectId):
+        """ Compute a fingerprint of the transformation applied to the passages of a text, which changes with \
+        the content of XSL stylesheets and with the code of transformation functions
+
+        :param objectId: Object Identifier
+        :type objectId: str
+        :return: Fingerprint
+        :rtype: str
+        """
+        func = self._transform.get(str(objectId), self._transform["default"])
+        if isinstance(func, str):
+            return "xsl:" + str(file_checksum(func))
+        elif isinstance(func, Callable):
+            return "function:" + callable_fingerprint(func)
+        return "none"
+
+    def chunker_fingerprint(self, objectId):
+        """ Compute a fingerprint of the chunking of the references of a text, which changes with the code of the \
+        chunker of the text and with the one of Nemo.chunk, when a subclass overrides it
+
+        :param objectId: Object Identifier
+        :type objectId: str
+        :return: Fingerprint
+        :rtype: str
+        """
+        return callable_fingerprint(self.chunker.get(str(objectId), self.chunker["default"])) + \
+            callable_fingerprint(type(self).chunk)[:8]
+
+    def passage_fingerprint(self, objectId):
+        """ Compute the fingerprint under which the passages of a text are stored : passages are stored with their \
+        transformation and with their siblings, which depend on the chunker
+
+        :param objectId: Object Identifier
+        :type objectId: str
+        :return: Fingerprint
+        :rtype: str
+        """
+        return "{}|chunker:{}".format(self.transform_fingerprint(objectId), self.chunker_fingerprint(objectId))
+
+    def get_transformed_passage(self, text, subreference):
+        """ Retrieve a passage and its transformation, from the passage store when one is set
+
+        :param text: Text metadata object
+        :type text: MyCapytain.resources.prototypes.cts.inventory.CtsTextMetadata
+        :param subreference: Subreference of the passage
+        :type subreference: str
+        :return: Passage (or its stored equivalent) and its transformation
+        :rtype: (InteractiveTextualNode, str)
+        """
+        objectId = str(text.id)
+        if self.passage_store is None:
+            passage = self.get_passage(objectId=objectId, subreference=subreference)
+            return passage, self.transform(passage, self.export_passage(passage, objectId), objectId)
+
+        fingerprint = self.passage_fingerprint(objectId)
+        stored = self.passage_store.get(text, subreference, fingerprint)
+        if stored is None:
+            passage = self.get_passage(objectId=objectId, subreference=subreference)
+            stored = self.passage_store.put(
+                text, subreference, fingerprint, passage,
+                html=self.transform(passage, self.export_passage(passage, objectId), objectId),
+                siblings=self.get_siblings(objectId, subreference, passage),
+                langs=[self.__default_lang__] + list(type(self).LOCALES.values())
+            )
+        return stored, stored.html
+
     def get_inventory(self):
         """ Request the api endpoint to retrieve information about the inventory
 
@@ -371,7 +634,51 @@ class Nemo(object):
         :return: Requested collection
         :rtype: Collection
         """
-        return self.inventory[objectId]
+        return self.negatively_cached(
+            "collection|{}".format(objectId), lambda: self.inventory_index.collection(objectId)
+        )
+
+    def negatively_cached(self, key, func):
+        """ Run a lookup, remembering in the negative cache that its key is unknown when it raises an error \
+        meaning so (See :meth:`unknown`). Remembered keys raise the same error again until they expire.
+
+        :param key: Key of the lookup
+        :type key: str
+        :param func: Function looking the key up
+        :type func: function
+        :return: Result of func
+        """
+        if self.negative_cache is None:
+            return func()
+        unknown = self.negative_cache.get(key)
+        if unknown is not None:
+            error, args = unknown
+            raise error(*args)
+        try:
+            return func()
+        except Exception as E:
+            if self.unknown(E):
+                # Errors are stored without their traceback, which would keep the frames of the lookup alive
+                self.negative_cache.set(key, (type(E), E.args))
+            raise
+
+    def unknown(self, error):
+        """ Check whether an error means that an identifier or a reference is unknown : errors of UNKNOWN_ERRORS \
+        and IndexErrors raised by a function of UNKNOWN_REFERENCE_FRAMES
+
+        :param error: Error raised by a lookup
+        :type error: Exception
+        :rtype: bool
+        """
+        if isinstance(error, type(self).UNKNOWN_ERRORS):
+            return True
+        if not isinstance(error, IndexError) or error.__traceback__ is None:
+            return False
+        traceback = error.__traceback__
+        while traceback.tb_next is not None:
+            traceback = traceback.tb_next
+        frame = traceback.tb_frame
+        return (frame.f_globals.get("__name__"), frame.f_code.co_name) in type(self).UNKNOWN_REFERENCE_FRAMES
 
     def get_reffs(self, objectId, subreference=None, collection=None, export_collection=False):
         """ Retrieve and transform a list of references.
@@ -379,6 +686,8 @@ class Nemo(object):
         Returns the inventory collection object with its metadata and a callback function taking a level parameter \
         and returning a list of strings.
 
+        .. note:: When a reference store is set, the output of the chunker is read from it and computed only once
+
         :param objectId: Collection Identifier
         :type objectId: str
         :param subreference: Subreference from which to retrieve children
@@ -394,17 +703,61 @@ class Nemo(object):
             text = collection
         else:
             text = self.get_collection(objectId)
-        reffs = self.chunk(
-            text,
-            lambda level: self.resolver.getReffs(objectId, level=level, subreference=subreference)
-        )
+        getreffs = lambda level: self.resolver.getReffs(objectId, level=level, subreference=subreference)
+        if self.reference_store is not None and subreference is None:
+            reffs = self.reference_store.chunks(
+                text, self.chunk, getreffs, fingerprint=self.chunker_fingerprint(text.id)
+            )
+        else:
+            reffs = self.chunk(text, getreffs)
         if export_collection is True:
             return text, reffs
         return reffs
 
+    def get_hierarchy(self, objectId, collection=None):
+        """ Retrieve the hierarchy of the chunked references of a text, where keys represent the levels of the \
+        citation scheme and final values passage references.
+
+        .. note:: The hierarchy is built once per text and chunker : it is memoized by the cache and, when a \
+        reference store is set, stored alongside the chunked references. Without both, the last HIERARCHY_ENTRIES \
+        hierarchies are kept in process.
+
+        .. warning:: Hierarchies are shared across requests and should not be modified
+
+        :param objectId: Collection Identifier
+        :type objectId: str
+        :param collection: Collection object bearing metadata
+        :type collection: Collection
+        :return: Nested dictionary of references
+        :rtype: OrderedDict
+        """
+        if collection is not None:
+            text = collection
+        else:
+            text = self.get_collection(objectId)
+        if self.reference_store is not None:
+            return self.reference_store.hierarchy(
+                text, self.chunk, lambda level: self.resolver.getReffs(objectId, level=level),
+                fingerprint=self.chunker_fingerprint(text.id)
+            )
+        if self.__hierarchies__ is not None:
+            hierarchy = self.__hierarchies__.get(str(text.id))
+            if hierarchy is not None:
+                return hierarchy
+        hierarchy = flask_nemo.filters.f_hierarchical_passages(
+            self.get_reffs(objectId, collection=collection),
+            text.citation
+        )
+        if self.__hierarchies__ is not None:
+            self.__hierarchies__.set(str(text.id), hierarchy)
+        return hierarchy
+
     def get_passage(self, objectId, subreference):
         """ Retrieve the passage identified by the parameters
 
+        .. note:: When Nemo has a negative cache, unknown references are remembered and not requested again to \
+        the resolver until they expire
+
         :param objectId: Collection Identifier
         :type objectId: str
         :param subreference: Subreference of the passage
@@ -412,10 +765,9 @@ class Nemo(object):
         :return: An object bearing metadata and its text
         :rtype: InteractiveTextualNode
         """
-        passage = self.resolver.getTextualNode(
-            textId=objectId,
-            subreference=subreference,
-            metadata=True
+        passage = self.negatively_cached(
+            "passage|{}|{}".format(objectId, subreference),
+            lambda: self.resolver.getTextualNode(textId=objectId, subreference=subreference, metadata=True)
         )
         return passage
 
@@ -454,6 +806,8 @@ class Nemo(object):
         :param parent: Current collection parent
         :return: SEO/URL Friendly string
         """
+        if collection.id in self.inventory_index:
+            return self.inventory_index.semantic(collection.id)
         if parent is not None:
             collections = parent.parents[::-1] + [parent, collection]
         else:
@@ -496,6 +850,8 @@ class Nemo(object):
         :param lang: Language to express data in
         :return:
         """
+        if member.id in self.inventory_index:
+            return self.inventory_index.view(member.id, lang)
         x = {
             "id": member.id,
             "label": str(member.get_label(lang)),
@@ -516,6 +872,8 @@ class Nemo(object):
         :param lang: Language to express data in
         :return: List of basic objects
         """
+        if collection.id in self.inventory_index:
+            return self.inventory_index.members(collection.id, lang)
         objects = sorted([
                 self.expose_ancestors_or_children(member, collection, lang=lang)
                 for member in collection.members
@@ -532,6 +890,8 @@ class Nemo(object):
         :param lang: Language to express data in
         :return: List of basic objects
         """
+        if collection.id in self.inventory_index:
+            return self.inventory_index.parents(collection.id, lang)
         return [
             {
                 "id": member.id,
@@ -560,7 +920,7 @@ class Nemo(object):
         :return: Collections information and template
         :rtype: {str: Any}
         """
-        collection = self.resolver.getMetadata()
+        collection = self.inventory_index.inventory
         return {
             "template": "main::collection.html",
             "current_label": collection.get_label(lang),
@@ -579,16 +939,11 @@ class Nemo(object):
         :return: Template and collections contained in given collection
         :rtype: {str: Any}
         """
-        collection = self.resolver.getMetadata(objectId)
+        collection = self.get_collection(objectId)
         return {
             "template": "main::collection.html",
             "collections": {
-                "current": {
-                    "label": str(collection.get_label(lang)),
-                    "id": collection.id,
-                    "model": str(collection.model),
-                    "type": str(collection.type),
-                },
+                "current": self.inventory_index.view(collection.id, lang),
                 "members": self.make_members(collection, lang=lang),
                 "parents": self.make_parents(collection, lang=lang)
             },
@@ -604,6 +959,9 @@ class Nemo(object):
         :return: Template and required information about text with its references
         """
         collection, reffs = self.get_reffs(objectId=objectId, export_collection=True)
+        hierarchy = self.get_hierarchy(objectId=objectId)
+        if self.references_depth:
+            hierarchy = truncate_hierarchy(hierarchy, self.references_depth)
         return {
             "template": "main::references.html",
             "objectId": objectId,
@@ -617,9 +975,30 @@ class Nemo(object):
                 },
                 "parents": self.make_parents(collection, lang=lang)
             },
-            "reffs": reffs
+            "reffs": reffs,
+            "hierarchy": hierarchy
         }
 
+    def r_references_subtree(self, objectId, subreference):
+        """ Fragment of the references page for a single branch of the citation hierarchy. Used to load lazily \
+        the levels which are not rendered by r_references when references_depth is set
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param subreference: Reference of the branch (*eg.* "1.2")
+        :type subreference: str
+        :return: HTML Fragment listing the references of the branch
+        :rtype: str
+        """
+        collection = self.get_collection(objectId)
+        try:
+            branch = hierarchy_branch(self.get_hierarchy(objectId=objectId), collection.citation, subreference)
+        except KeyError:
+            abort(404)
+        if self.references_depth:
+            branch = truncate_hierarchy(branch, self.references_depth, subreference)
+        return render_template("main::references_subtree.html", objectId=objectId, reffs=branch)
+
     def r_first_passage(self, objectId):
         """ Provides a redirect to the first passage of given objectId
 
@@ -651,8 +1030,7 @@ class Nemo(object):
             if len(editions) == 0:
                 raise UnknownCollection("This work has no default edition")
             return redirect(url_for(".r_passage", objectId=str(editions[0].id), subreference=subreference))
-        text = self.get_passage(objectId=objectId, subreference=subreference)
-        passage = self.transform(text, text.export(Mimetypes.PYTHON.ETREE), objectId)
+        text, passage = self.get_transformed_passage(collection, subreference)
         prev, next = self.get_siblings(objectId, subreference, text)
         return {
             "template": "main::text.html",
@@ -685,12 +1063,47 @@ class Nemo(object):
         :return: Response
         """
         if filetype in self.assets and asset in self.assets[filetype] and self.assets[filetype][asset]:
+            if self.response_cache is not None:
+                return self.cached_asset(filetype, asset)
             return send_from_directory(
                 directory=self.assets[filetype][asset],
                 filename=asset
             )
         abort(404)
 
+    def cached_asset(self, filetype, asset):
+        """ Serve an asset from the response cache, reading and compressing it on the first request
+
+        :param filetype: Asset Type
+        :param asset: Filename of an asset
+        :return: Response
+        """
+        key = "asset|{}|{}".format(filetype, asset)
+        entry = self.response_cache.get(key)
+        if entry is None:
+            with open(op.join(self.assets[filetype][asset], asset), "rb") as f:
+                response = Response(f.read(), mimetype=mimetypes.guess_type(asset)[0] or "application/octet-stream")
+            entry = self.response_cache.store(key, response)
+        return self.response_cache.respond(entry, request.accept_encodings)
+
+    def r_bundle(self, bundle):
+        """ Route for asset bundles. Bundle names change with their content, responses are thus cached forever
+
+        :param bundle: Name of the bundle
+        :return: Response
+        """
+        for candidate in [link for links in self.bundles.values() if links for link in links]:
+            if isinstance(candidate, Bundle) and candidate.name == bundle:
+                response = Response(candidate.content, mimetype=candidate.mimetype)
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+                if self.response_cache is None:
+                    return response
+                entry = self.response_cache.get("bundle|" + bundle)
+                if entry is None:
+                    entry = self.response_cache.store("bundle|" + bundle, response)
+                return self.response_cache.respond(entry, request.accept_encodings)
+        abort(404)
+
     def register_assets(self):
         """ Merge and register assets, both as routes and dictionary
 
@@ -703,6 +1116,15 @@ class Nemo(object):
             endpoint="secondary_assets",
             methods=["GET"]
         )
+        if self.bundle_assets:
+            self.bundles = Bundle.build(self.assets, self.bundle_minifiers)
+            self.blueprint.add_url_rule(
+                # Bundles are served next to secondary assets so that relative urls in stylesheets still resolve
+                "{0}.secondary/bundle/<bundle>".format(self.static_url_path),
+                view_func=self.r_bundle,
+                endpoint="bundled_assets",
+                methods=["GET"]
+            )
 
     def create_blueprint(self):
         """ Create blueprint and register rules
@@ -711,6 +1133,8 @@ class Nemo(object):
         :rtype: flask.Blueprint
         """
         self.register_plugins()
+        if self.profiler is not None:
+            self.profiler.attach(self)
 
         self.blueprint = Blueprint(
             self.name,
@@ -749,17 +1173,231 @@ class Nemo(object):
             self.__template_loader__[namespace].append(
                 jinja2.FileSystemLoader(op.abspath(directory))
             )
-        self.blueprint.jinja_loader = jinja2.PrefixLoader(
-            {namespace: jinja2.ChoiceLoader(paths) for namespace, paths in self.__template_loader__.items()},
-            "::"
-        )
+        if self.production:
+            self.blueprint.jinja_loader = FrozenTemplateLoader(
+                {
+                    namespace: [loader.searchpath[0] for loader in loaders]
+                    for namespace, loaders in self.__template_loader__.items()
+                },
+                "::"
+            )
+        else:
+            self.blueprint.jinja_loader = jinja2.PrefixLoader(
+                {namespace: jinja2.ChoiceLoader(paths) for namespace, paths in self.__template_loader__.items()},
+                "::"
+            )
 
         if self.cache is not None:
             for func, instance in self.cached:
-                setattr(instance, func.__name__, self.cache.memoize()(func))
+                setattr(instance, func.__name__, self.memoize(func))
 
         return self.blueprint
 
+    def memoize(self, func):
+        """ Memoize a function with the cache, tagging its entries with the tags of the object it is called for \
+        (See :meth:`tags`) : the generations of these tags are part of the key of each entry, so that entries of \
+        an invalidated tag are not read anymore and expire or get evicted by the cache backend.
+
+        The object is read from the objectId or collection parameter of the function. Functions without such a \
+        parameter are tagged with the inventory. When Nemo has a single flight, concurrent calls with the same \
+        parameters wait for the first one instead of computing the entry again : calls are told apart with \
+        :func:`flask_nemo.common.stable_identifier`, so that they are coalesced across threads and processes.
+
+        :param func: Function to memoize
+        :type func: function
+        :return: Memoized function
+        :rtype: function
+        """
+        signature = inspect.signature(func)
+        parameter = next((name for name in ("objectId", "collection") if name in signature.parameters), None)
+
+        def versioned(instance, generations, *args, **kwargs):
+            return func(*args, **kwargs)
+        versioned.__module__, versioned.__qualname__ = func.__module__, func.__qualname__
+        memoized = self.cache.memoize()(types.MethodType(versioned, getattr(func, "__self__", self)))
+
+        @wraps(func)
+        def tagged(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            objectId = bound.arguments.get(parameter)
+            if parameter == "collection":
+                objectId = getattr(objectId, "id", None)
+            generations = self.generations(self.tags(objectId))
+            if self.single_flight is None:
+                return memoized(generations, *bound.args, **bound.kwargs)
+            key = "{}|{}.{}|{}|{}".format(
+                self.name, func.__module__, func.__qualname__, generations, "|".join(
+                    "{}={}".format(name, stable_identifier(value)) for name, value in bound.arguments.items()
+                )
+            )
+            return self.single_flight.do(key, lambda: memoized(generations, *bound.args, **bound.kwargs))
+        return tagged
+
+    def tags(self, objectId=None):
+        """ Retrieve the tags of the cached entries computed for an object : its identifier, the identifiers of \
+        its ancestors, as their metadata is part of its pages, and the members tag of the object, as the labels of \
+        its members are listed on its page. Entries computed for no object are tagged with the inventory.
+
+        Invalidating the tag of a collection evicts the entries of the collection and of its descendants. \
+        Invalidating its members tag evicts the entries of the collection only.
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :return: Tags
+        :rtype: [str]
+        """
+        if objectId is None:
+            return [type(self).INVENTORY_TAG]
+        objectId = str(objectId)
+        if objectId not in self.inventory_index:
+            return [objectId]
+        return [objectId] + self.inventory_index.ancestors(objectId) + [type(self).MEMBERS_TAG.format(objectId)]
+
+    def generations(self, tags):
+        """ Retrieve the generations of tags, increased each time a tag is invalidated. Generations are kept in \
+        the cache when there is one, so that they are shared by the processes sharing the cache. They are read \
+        once per request : memoized functions and fragments of the same request reuse them.
+
+        :param tags: Tags
+        :type tags: [str]
+        :return: Generation of each tag
+        :rtype: (int)
+        """
+        if self.cache is None:
+            return tuple(self.__generations__.get(tag, 0) for tag in tags)
+        known = dict()
+        if has_request_context():
+            known = request.environ.setdefault("nemo.generations", dict()).setdefault(self.name, dict())
+        missing = [tag for tag in tags if tag not in known]
+        if missing:
+            known.update(zip(missing, (
+                generation or 0
+                for generation in self.cache.get_many(*["nemo|tag|{}".format(tag) for tag in missing])
+            )))
+        return tuple(known[tag] for tag in tags)
+
+    def generation(self, tag):
+        """ Retrieve the generation of a tag
+
+        :param tag: Tag
+        :type tag: str
+        :rtype: int
+        """
+        return self.generations([str(tag)])[0]
+
+    def invalidate_tags(self, tags):
+        """ Invalidate every cached entry tagged with one of the tags : memoized functions, template fragments and \
+        cached pages. Entries of other tags are kept.
+
+        :param tags: Tags to invalidate
+        :type tags: [str]
+        """
+        tags = [str(tag) for tag in tags]
+        for tag, generation in zip(tags, self.generations(tags)):
+            if self.cache is not None:
+                self.cache.set("nemo|tag|{}".format(tag), generation + 1, timeout=0)
+                if has_request_context():
+                    request.environ["nemo.generations"][self.name][tag] = generation + 1
+            else:
+                self.__generations__[tag] = generation + 1
+
+    def cache_suffix(self, objectId=None):
+        """ Build the part of cache keys of fragments and pages depending on the generations of the tags of an object
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :rtype: str
+        """
+        return "generations=" + ".".join(str(generation) for generation in self.generations(self.tags(objectId)))
+
+    def invalidate(self, objectIds, reload=True):
+        """ Invalidate the memoized references, passages and transformations, the stored chunks and passages and \
+        the cached pages of texts, typically after their files changed, without flushing the caches of other texts.
+
+        The tags of the objects are invalidated (See :meth:`tags`), with the members tags of their ancestors, \
+        which list them, and the inventory tag when texts are reloaded. Identifiers of collections are expanded to \
+        their texts for stores and reloading. The negative cache is cleared, as reloaded texts may have new \
+        references or identifiers.
+
+        :param objectIds: Identifiers of the texts
+        :type objectIds: [str]
+        :param reload: Reload the metadata of the texts beforehand, when the resolver is a local one
+        :type reload: bool
+        :return: Invalidated tags
+        :rtype: [str]
+        """
+        index = self.inventory_index
+        tags, texts = [], []
+        for objectId in objectIds:
+            if objectId in index:
+                tags.extend([
+                    tag for tag in [objectId] + [
+                        type(self).MEMBERS_TAG.format(ancestor) for ancestor in index.ancestors(objectId)
+                    ] if tag not in tags
+                ])
+                texts.extend([text for text in index.resources(objectId) if text not in texts])
+        if reload and self.reload(texts):
+            tags.append(type(self).INVENTORY_TAG)
+
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+        for objectId in texts:
+            if self.reference_store is not None:
+                self.reference_store.invalidate(objectId)
+            if self.passage_store is not None:
+                self.passage_store.invalidate(objectId)
+            if self.__hierarchies__ is not None:
+                self.__hierarchies__.delete(str(objectId))
+        self.invalidate_tags(tags)
+        return tags
+
+    def reload(self, objectIds):
+        """ Reload texts of a local resolver : the metadata of their work is parsed again from its __cts__.xml file \
+        and the citation scheme of each text from its own file, then the index of the inventory is rebuilt. Other \
+        texts of these works keep their citation scheme, other works are not parsed again.
+
+        .. note:: Texts added to or removed from the __cts__.xml file of a reloaded work are added to or removed from \
+        the inventory. New works and textgroups require a restart.
+
+        .. warning:: Works are parsed with the parsing methods of CtsCapitainsLocalResolver, which are not part \
+        of its public API : resolvers which do not provide them are not reloaded.
+
+        :param objectIds: Identifiers of the texts
+        :type objectIds: [str]
+        :return: Whether the resolver supports reloading
+        :rtype: bool
+        """
+        if not isinstance(self.resolver, CtsCapitainsLocalResolver) or not all(
+            hasattr(self.resolver, method) for method in ("_parse_work", "_parse_text")
+        ):
+            return False
+        works = OrderedDict()
+        for objectId in objectIds:
+            text = self.inventory_index.collection(objectId)
+            works.setdefault(op.dirname(text.path), (text.parent, set()))[1].add(text.id)
+
+        for directory, (work, reloaded) in works.items():
+            # Metadata lives in a graph shared by every collection : statements about the work and its texts are \
+            # removed before parsing, otherwise former labels would remain next to the new ones
+            graph = work.graph
+            for collection in [work] + work.members:
+                graph.remove((collection.asNode(), None, None))
+            # The textgroup already knows the work : the parsed work replaces it instead of being added to it
+            textgroup = work.parent
+            parsed, _, _ = self.resolver._parse_work(op.join(directory, "__cts__.xml"), textgroup)
+            textgroup.children[work.id] = parsed
+            for objectId, text in list(parsed.texts.items()):
+                if objectId in reloaded or objectId not in work.texts:
+                    if not self.resolver._parse_text(text, directory):
+                        del parsed.texts[objectId]
+                else:
+                    text.path, text.citation = work.texts[objectId].path, work.texts[objectId].citation
+        if not isinstance(getattr(type(self.resolver), "texts", None), property):
+            # Resolvers storing their list of texts instead of reading it from the inventory
+            self.resolver.texts = list(self.resolver.inventory.readableDescendants)
+        self.inventory_index.walk()
+        return True
+
     def view_maker(self, name, instance=None):
         """ Create a view
 
@@ -781,7 +1419,37 @@ class Nemo(object):
             if "semantic" in kwargs:
                 del kwargs["semantic"]
             return self.route(getattr(instance, name), **kwargs)
-        return route
+
+        view = route
+        if self.response_cache is not None:
+            view = self.cached_view(route)
+        if self.profiler is not None:
+            view = self.profiler.view(view, route)
+        return view
+
+    def cached_view(self, view):
+        """ Wrap a view so that its successful responses are served from the response cache
+
+        :param view: View function
+        :type view: function
+        :return: View function using the response cache
+        :rtype: function
+        """
+        def cached(**kwargs):
+            key = "|".join(
+                ["response", request.endpoint, self.get_locale(), request.query_string.decode()] +
+                ["{}={}".format(key, kwargs[key]) for key in sorted(kwargs)] +
+                [self.cache_suffix(kwargs.get("objectId"))]
+            )
+            entry = self.response_cache.get(key)
+            if entry is None:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+                        or "Set-Cookie" in response.headers:
+                    return response
+                entry = self.response_cache.store(key, response, timeout=self.cache_timeout(request.endpoint))
+            return self.response_cache.respond(entry, request.accept_encodings)
+        return cached
 
     def main_collections(self, lang=None):
         """ Retrieve main parent collections of a repository
@@ -789,16 +1457,7 @@ class Nemo(object):
         :param lang: Language to retrieve information in
         :return: Sorted collections representations
         """
-        return sorted([
-            {
-                "id": member.id,
-                "label": str(member.get_label(lang=lang)),
-                "model": str(member.model),
-                "type": str(member.type),
-                "size": member.size
-            }
-            for member in self.resolver.getMetadata().members
-        ], key=itemgetter("label"))
+        return self.inventory_index.members(self.inventory_index.inventory.id, lang, labelled=False)
 
     def make_cache_keys(self, endpoint, kwargs):
         """ This function is built to provide cache keys for templates
@@ -809,13 +1468,51 @@ class Nemo(object):
         :rtype: tuple(str)
         """
         keys = sorted(kwargs.keys())
-        i18n_cache_key = endpoint+"|"+"|".join([kwargs[k] for k in keys])
+        suffix = "|" + self.cache_suffix(kwargs.get("objectId"))
+        i18n_cache_key = endpoint+"|"+"|".join([kwargs[k] for k in keys]) + suffix
         if "lang" in keys:
-            cache_key = endpoint+"|" + "|".join([kwargs[k] for k in keys if k != "lang"])
+            cache_key = endpoint+"|" + "|".join([kwargs[k] for k in keys if k != "lang"]) + suffix
         else:
             cache_key = i18n_cache_key
         return i18n_cache_key, cache_key
 
+    def cache_timeout(self, endpoint):
+        """ Retrieve the time-to-live of the template fragments of an endpoint
+
+        :param endpoint: Endpoint, with or without its blueprint prefix
+        :type endpoint: str
+        :return: Time-to-live in seconds
+        :rtype: int
+        """
+        name = endpoint.split(".")[-1] if endpoint else "default"
+        if name.endswith("_semantic"):
+            name = name[:-len("_semantic")]
+        return self.cache_timeouts.get(name, self.cache_timeouts["default"])
+
+    def cache_statistics(self):
+        """ Retrieve hit and miss counters of the in-process caches, counters of the single flight and the ones of \
+        the local cache of the CTS API and of its circuit breaker, when the resolver uses a \
+        flask_nemo.retrievers.CachedHttpCtsRetriever
+
+        :return: Dictionary of cache names and their statistics
+        :rtype: {str: dict}
+        """
+        statistics = dict()
+        if self.fragment_cache is not None:
+            statistics["fragments"] = self.fragment_cache.statistics()
+        if self.response_cache is not None:
+            statistics["responses"] = self.response_cache.statistics()
+        if self.single_flight is not None:
+            statistics["flights"] = self.single_flight.statistics()
+        if self.negative_cache is not None:
+            statistics["unknown"] = self.negative_cache.statistics()
+        retriever = getattr(self.resolver, "endpoint", None)
+        if hasattr(retriever, "statistics"):
+            statistics["cts"] = retriever.statistics()
+        if getattr(retriever, "breaker", None) is not None:
+            statistics["breaker"] = retriever.breaker.statistics()
+        return statistics
+
     def render(self, template, **kwargs):
         """ Render a route template and adds information to this route.
 
@@ -830,9 +1527,10 @@ class Nemo(object):
         kwargs["cache_key"] = "%s" % kwargs["url"].values()
         kwargs["lang"] = self.get_locale()
         kwargs["assets"] = self.assets
+        kwargs["bundles"] = self.bundles
         kwargs["main_collections"] = self.main_collections(kwargs["lang"])
-        kwargs["cache_active"] = self.cache is not None
-        kwargs["cache_time"] = 0
+        kwargs["cache_active"] = self.cache is not None or self.fragment_cache is not None
+        kwargs["cache_time"] = self.cache_timeout(request.endpoint)
         kwargs["cache_key"], kwargs["cache_key_i18n"] = self.make_cache_keys(request.endpoint, kwargs["url"])
         kwargs["template"] = template
 
@@ -870,10 +1568,19 @@ class Nemo(object):
             if not self.blueprint:
                 self.blueprint = self.create_blueprint()
             self.app.register_blueprint(self.blueprint)
+            if self.production:
+                self.app.config["TEMPLATES_AUTO_RELOAD"] = False
+                self.app.jinja_env.auto_reload = False
+            if self.bytecode_cache is not None:
+                self.app.jinja_env.bytecode_cache = self.bytecode_cache
             if self.cache is None:
-                # We register a fake cache extension.
+                # We register a cache extension, either backed by the in-process fragment cache or a fake one.
                 setattr(self.app.jinja_env, "_fake_cache_extension", self)
-                self.app.jinja_env.add_extension(FakeCacheExtension)
+                if self.fragment_cache is not None:
+                    self.app.jinja_env.add_extension(FragmentCacheExtension)
+                    self.app.jinja_env.nemo_fragment_cache = self.fragment_cache
+                else:
+                    self.app.jinja_env.add_extension(FakeCacheExtension)
             return self.blueprint
         return None
 
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+    Asset bundles
+    ====
+
+    Concatenation of the local CSS and JS assets of Nemo and its plugins into content-hashed bundles, built once \
+    at startup and served with immutable caching headers
+"""
+
+import re
+import os.path as op
+from hashlib import sha1
+
+
+_CSS_COMMENTS = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACES = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+
+
+def minify_css(source):
+    """ Minify a stylesheet : comments, line breaks and spaces around braces, semicolons, commas and child \
+    combinators are removed
+
+    .. note:: Strings and urls containing comment markers or significant spaces are not supported
+
+    :param source: Stylesheet
+    :type source: str
+    :return: Minified stylesheet
+    :rtype: str
+    """
+    source = _CSS_COMMENTS.sub("", source)
+    source = _CSS_SPACES.sub(" ", source)
+    source = _CSS_PUNCTUATION.sub(r"\1", source)
+    return source.replace(";}", "}").strip()
+
+
+def minify_js(source):
+    """ Minify a script : only leading and trailing spaces of lines and empty lines are removed, as anything \
+    further requires a javascript parser. Scripts are not minified by default : this function is opt-in through \
+    Nemo(bundle_minifiers={"js": minify_js}), as is any dedicated minifier.
+
+    .. warning:: Strings spanning multiple lines, such as template literals or strings continued with a trailing \
+        backslash, lose their leading and trailing spaces, which changes their value
+
+    :param source: Script
+    :type source: str
+    :return: Minified script
+    :rtype: str
+    """
+    return "\n".join([line.strip() for line in source.splitlines() if line.strip()])
+
+
+class Bundle(object):
+    """ Concatenation of local assets of a type, named after the hash of its content
+
+    :param filetype: Type of assets (css or js)
+    :type filetype: str
+    :param files: List of paths of the files to concatenate, in order
+    :type files: [str]
+    :param minifier: Function applied to each file
+    :type minifier: function(str) -> str
+
+    :ivar name: Name of the bundle, such as nemo.0123456789ab.css
+    :ivar content: Content of the bundle
+    :ivar files: Paths of the bundled files
+    """
+    MIMETYPES = {
+        "css": "text/css",
+        "js": "application/javascript"
+    }
+    SEPARATORS = {
+        "css": "\n",
+        "js": "\n;\n"
+    }
+
+    def __init__(self, filetype, files, minifier=None):
+        self.filetype = filetype
+        self.files = files
+        parts = []
+        for path in files:
+            with open(path, encoding="utf-8") as f:
+                source = f.read()
+            if minifier is not None:
+                source = minifier(source)
+            parts.append(source)
+        self.content = type(self).SEPARATORS.get(filetype, "\n").join(parts).encode("utf-8")
+        self.name = "nemo.{}.{}".format(sha1(self.content).hexdigest()[:12], filetype)
+
+    @property
+    def mimetype(self):
+        return type(self).MIMETYPES.get(self.filetype, "application/octet-stream")
+
+    @staticmethod
+    def build(assets, minifiers=None):
+        """ Build the bundles of the local css and js assets of a Nemo instance. Consecutive local assets are \
+        bundled together while remote assets are kept in between, so that assets are loaded in their original order.
+
+        :param assets: Dictionary of assets (First level : type, second level : filename and directory)
+        :type assets: dict
+        :param minifiers: Minifier function per type of asset (Default: minify_css, scripts are not minified)
+        :type minifiers: {str: function(str) -> str}
+        :return: Ordered list of bundles and addresses of remote assets per type of asset, None for types without \
+        local assets
+        :rtype: {str: [Bundle|str]}
+        """
+        if minifiers is None:
+            minifiers = {"css": minify_css}
+        bundles = dict()
+        for filetype in ("css", "js"):
+            links, files = [], []
+            for filename, directory in assets[filetype].items():
+                if directory:
+                    files.append(op.join(directory, filename))
+                    continue
+                if files:
+                    links.append(Bundle(filetype, files, minifiers.get(filetype)))
+                    files = []
+                links.append(filename)
+            if files:
+                links.append(Bundle(filetype, files, minifiers.get(filetype)))
+            bundles[filetype] = links if any(isinstance(link, Bundle) for link in links) else None
+        return bundles
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+    In-process caches
+    ====
+
+    Memory-bounded caches which do not require any external service
+"""
+
+import os
+import os.path as op
+import copy
+import sys
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from time import monotonic, sleep
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LRUCache(object):
+    """ Thread-safe least-recently-used cache bounded both in number of entries and in approximate memory size, \
+    with an optional time-to-live per entry.
+
+    The size of an entry is estimated with :code:`sys.getsizeof` on its value, which is accurate for strings, \
+    the only values stored by Nemo in this cache.
+
+    :param max_size: Maximum approximate size of stored values, in bytes
+    :type max_size: int
+    :param max_entries: Maximum number of entries
+    :type max_entries: int
+    :param default_timeout: Time-to-live of entries in seconds when none is given to set(). 0 means no expiration
+    :type default_timeout: int
+    """
+    def __init__(self, max_size=32 * 1024 * 1024, max_entries=10000, default_timeout=0):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self.__entries__ = OrderedDict()
+        self.__lock__ = threading.Lock()
+        self.__size__ = 0
+        self.__stats__ = dict(hits=0, misses=0, sets=0, evictions=0, expirations=0)
+
+    def get(self, key, default=None):
+        """ Retrieve a value from the cache
+
+        :param key: Key of the value
+        :type key: str
+        :param default: Value returned when the key is unknown or expired
+        :return: Cached value or default
+        """
+        with self.__lock__:
+            entry = self.__entries__.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= monotonic():
+                self._remove(key)
+                self.__stats__["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.__stats__["misses"] += 1
+                return default
+            self.__entries__.move_to_end(key)
+            self.__stats__["hits"] += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None, size=None):
+        """ Store a value in the cache, evicting least recently used values if bounds are exceeded
+
+        :param key: Key of the value
+        :type key: str
+        :param value: Value to store
+        :param timeout: Time-to-live in seconds. 0 means no expiration (Default: default_timeout)
+        :type timeout: int
+        :param size: Size of the value in bytes, for values sys.getsizeof does not measure (Default: estimated)
+        :type size: int
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        if size is None:
+            size = sys.getsizeof(value)
+        if size > self.max_size:
+            return
+        expires = monotonic() + timeout if timeout else None
+        with self.__lock__:
+            if key in self.__entries__:
+                self._remove(key)
+            self.__entries__[key] = (expires, value, size)
+            self.__size__ += size
+            self.__stats__["sets"] += 1
+            while self.__size__ > self.max_size or len(self.__entries__) > self.max_entries:
+                self._remove(next(iter(self.__entries__)))
+                self.__stats__["evictions"] += 1
+
+    def delete(self, key):
+        """ Remove a value from the cache
+
+        :param key: Key of the value
+        :type key: str
+        :return: Whether the key was in the cache
+        :rtype: bool
+        """
+        with self.__lock__:
+            if key in self.__entries__:
+                self._remove(key)
+                return True
+            return False
+
+    def clear(self):
+        """ Remove every value from the cache
+        """
+        with self.__lock__:
+            self.__entries__.clear()
+            self.__size__ = 0
+
+    def statistics(self):
+        """ Retrieve counters of the cache
+
+        :return: Dictionary with hits, misses, sets, evictions, expirations, entries, size and max_size keys
+        :rtype: dict
+        """
+        with self.__lock__:
+            stats = dict(self.__stats__)
+            stats.update(entries=len(self.__entries__), size=self.__size__, max_size=self.max_size)
+        return stats
+
+    def __contains__(self, key):
+        with self.__lock__:
+            return key in self.__entries__
+
+    def __len__(self):
+        return len(self.__entries__)
+
+    def _remove(self, key):
+        """ Remove an entry and update the size of the cache. Requires the lock to be held
+
+        :param key: Key of the entry
+        """
+        self.__size__ -= self.__entries__.pop(key)[2]
+
+
+class ResponseCache(object):
+    """ Cache of complete responses storing, next to the identity body, variants compressed once with gzip and \
+    brotli (when the brotli package is installed). The variant sent to a client is chosen from its Accept-Encoding \
+    header.
+
+    :param cache: Cache in which entries are stored (Default: new LRUCache of 64MB)
+    :type cache: LRUCache
+    :param encodings: Encodings to precompute, by order of preference
+    :type encodings: [str]
+    :param min_size: Bodies smaller than this number of bytes are not compressed
+    :type min_size: int
+    :param level: Compression level, from 1 to 9
+    :type level: int
+    """
+    ENCODINGS = ["br", "gzip"]
+    EXCLUDED_HEADERS = {"content-length", "content-encoding", "vary"}
+
+    def __init__(self, cache=None, encodings=None, min_size=1024, level=6):
+        if cache is None:
+            cache = LRUCache(max_size=64 * 1024 * 1024)
+        self.cache = cache
+        self.encodings = [
+            encoding for encoding in encodings or type(self).ENCODINGS
+            if encoding != "br" or brotli is not None
+        ]
+        self.min_size = min_size
+        self.level = level
+        self.__served__ = {encoding: 0 for encoding in self.encodings + ["identity"]}
+        self.__lock__ = threading.Lock()
+
+    def compress(self, body, encoding):
+        """ Compress a body
+
+        :param body: Body to compress
+        :type body: bytes
+        :param encoding: Encoding to use (gzip or br)
+        :type encoding: str
+        :return: Compressed body
+        :rtype: bytes
+        """
+        if encoding == "br":
+            return brotli.compress(body, quality=self.level)
+        return gzip.compress(body, compresslevel=self.level)
+
+    def store(self, key, response, timeout=None):
+        """ Store a response and its compressed variants
+
+        :param key: Key of the response
+        :type key: str
+        :param response: Response to store
+        :type response: flask.Response
+        :param timeout: Time-to-live in seconds
+        :type timeout: int
+        :return: Stored entry
+        :rtype: dict
+        """
+        body = response.get_data()
+        entry = {
+            "status": response.status_code,
+            "headers": [
+                (name, value) for name, value in response.headers.items()
+                if name.lower() not in type(self).EXCLUDED_HEADERS
+            ],
+            "bodies": {"identity": body}
+        }
+        if len(body) >= self.min_size:
+            for encoding in self.encodings:
+                compressed = self.compress(body, encoding)
+                if len(compressed) < len(body):
+                    entry["bodies"][encoding] = compressed
+        self.cache.set(key, entry, timeout=timeout, size=sum(len(variant) for variant in entry["bodies"].values()))
+        return entry
+
+    def get(self, key):
+        """ Retrieve a stored entry
+
+        :param key: Key of the response
+        :type key: str
+        :return: Entry or None
+        :rtype: dict
+        """
+        return self.cache.get(key)
+
+    def negotiate(self, entry, accept_encodings):
+        """ Pick the variant of an entry best matching the client preferences
+
+        :param entry: Stored entry
+        :type entry: dict
+        :param accept_encodings: Accept-Encoding header of the request
+        :type accept_encodings: werkzeug.datastructures.Accept
+        :return: Encoding of the chosen variant
+        :rtype: str
+        """
+        available = [encoding for encoding in self.encodings if encoding in entry["bodies"]]
+        if available and accept_encodings:
+            best = accept_encodings.best_match(available)
+            if best is not None:
+                return best
+        return "identity"
+
+    def respond(self, entry, accept_encodings):
+        """ Build the response of an entry for a client
+
+        :param entry: Stored entry
+        :type entry: dict
+        :param accept_encodings: Accept-Encoding header of the request
+        :type accept_encodings: werkzeug.datastructures.Accept
+        :return: Response
+        :rtype: flask.Response
+        """
+        encoding = self.negotiate(entry, accept_encodings)
+        response = Response(entry["bodies"][encoding], status=entry["status"], headers=entry["headers"])
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        if len(entry["bodies"]) > 1:
+            response.vary.add("Accept-Encoding")
+        with self.__lock__:
+            self.__served__[encoding] += 1
+        return response
+
+    def clear(self):
+        """ Remove every stored response
+        """
+        self.cache.clear()
+
+    def statistics(self):
+        """ Retrieve counters of the cache, including the number of responses served per encoding
+
+        :rtype: dict
+        """
+        statistics = self.cache.statistics()
+        with self.__lock__:
+            statistics["served"] = dict(self.__served__)
+        return statistics
+
+
+class Flight(object):
+    """ Computation in progress for a key, awaited by concurrent callers """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalescing of concurrent computations of the same key : the first caller (the leader) computes the value \
+    while concurrent callers with the same key wait for its result, or for its exception, instead of computing it \
+    again.
+
+    Across processes, a lock file per key can be taken around the computation (POSIX only) : leaders of other \
+    processes wait for it to be released, then compute again, which is expected to hit the cache shared by the \
+    processes (eg. a memoized function with a Flask-Caching backend shared by the workers).
+
+    :param directory: Directory of the lock files shared by processes (Default: coalescing within the process only)
+    :type directory: str
+    :param timeout: Maximum time waited for a computation in progress, in seconds, after which the caller \
+    computes the value itself
+    :type timeout: float
+    :param interval: Time between two attempts to take a lock file, in seconds
+    :type interval: float
+    :param stripes: Number of lock files, shared by keys with the same hash modulo this number
+    :type stripes: int
+    """
+    def __init__(self, directory=None, timeout=30, interval=0.01, stripes=256):
+        if directory is not None and fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+        else:
+            directory = None
+        self.directory = directory
+        self.timeout = timeout
+        self.interval = interval
+        self.stripes = stripes
+        self.__flights__ = dict()
+        self.__lock__ = threading.Lock()
+        self.__stats__ = dict(leaders=0, followers=0, timeouts=0, locked=0)
+
+    def do(self, key, func):
+        """ Compute the value of a key, or wait for the computation in progress for it
+
+        :param key: Key of the computation
+        :type key: str
+        :param func: Function computing the value
+        :type func: function
+        :return: Value
+        """
+        with self.__lock__:
+            flight = self.__flights__.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights__[key] = Flight()
+            self.__stats__["leaders" if leader else "followers"] += 1
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                with self.__lock__:
+                    self.__stats__["timeouts"] += 1
+                return func()
+            if flight.error is not None:
+                raise self.follower_error(flight.error) from flight.error
+            return flight.result
+
+        try:
+            if self.directory is None:
+                flight.result = func()
+            else:
+                with self.locked(key):
+                    flight.result = func()
+            return flight.result
+        except Exception as E:
+            flight.error = E
+            raise
+        finally:
+            with self.__lock__:
+                del self.__flights__[key]
+            flight.done.set()
+
+    @staticmethod
+    def follower_error(error):
+        """ Copy the error of a leader for one of its followers : raising the same instance in every follower would \
+        append the frames of each of them to its shared traceback
+
+        :param error: Error raised by the leader
+        :type error: Exception
+        :return: Copy of the error, without traceback, or the error itself when it cannot be copied
+        :rtype: Exception
+        """
+        try:
+            return copy.copy(error).with_traceback(None)
+        except Exception:
+            return error
+
+    def locked(self, key):
+        """ Take the lock file of a key, waiting at most for the timeout
+
+        :param key: Key of the computation
+        :type key: str
+        :return: Context manager releasing the lock
+        """
+        stripe = int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % self.stripes
+        return LockFile(
+            op.join(self.directory, "{}.lock".format(stripe)),
+            self.timeout, self.interval, self.__stats__
+        )
+
+    def statistics(self):
+        """ Retrieve the number of leaders (computations), followers (callers served by the computation of a \
+        leader), timeouts and computations delayed by a lock file of another process
+
+        :rtype: dict
+        """
+        with self.__lock__:
+            return dict(self.__stats__)
+
+
+class LockFile(object):
+    """ Exclusive lock on a file, shared by processes
+
+    :param path: Path of the lock file
+    :type path: str
+    :param timeout: Maximum time waited for the lock, in seconds, after which the lock is not taken
+    :type timeout: float
+    :param interval: Time between two attempts, in seconds
+    :type interval: float
+    :param statistics: Counters, whose locked key is increased when the lock was held by another process
+    :type statistics: dict
+    """
+    def __init__(self, path, timeout, interval, statistics=None):
+        self.path = path
+        self.timeout = timeout
+        self.interval = interval
+        self.statistics = statistics
+        self.__file__ = None
+
+    def __enter__(self):
+        self.__file__ = open(self.path, "a")
+        deadline, waited = monotonic() + self.timeout, False
+        while True:
+            try:
+                fcntl.flock(self.__file__, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if not waited and self.statistics is not None:
+                    self.statistics["locked"] += 1
+                waited = True
+                if monotonic() >= deadline:
+                    break
+                sleep(self.interval)
+        return self
+
+    def __exit__(self, *args):
+        try:
+            fcntl.flock(self.__file__, fcntl.LOCK_UN)
+        finally:
+            self.__file__.close()
@@ -1,5 +1,13 @@
 from collections import OrderedDict
+import json
+import os.path as op
+import threading
+
+from MyCapytain.common.constants import Mimetypes
+from MyCapytain.common.reference import CtsReference
+
 from flask_nemo.common import join_or_single
+from flask_nemo.store import source_checksum
 
 
 def default_chunker(text, getreffs):
@@ -78,6 +86,9 @@ def level_chunker(text, getreffs, level=1):
 def level_grouper(text, getreffs, level=None, groupby=20):
     """ Alternative to level_chunker: groups levels together at the latest level
 
+    .. note:: References are grouped in a single streaming pass over the boundaries of their parents, without \
+    splitting them : they are expected in document order, where references sharing a parent are consecutive.
+
     :param text: Text object
     :param getreffs: GetValidReff query callback
     :param level: Level of citation to retrieve
@@ -87,24 +98,175 @@ def level_grouper(text, getreffs, level=None, groupby=20):
     if level is None or level > len(text.citation):
         level = len(text.citation)
 
-    references = [str(ref) for ref in getreffs(level=level)]
-    _refs = OrderedDict()
-
-    for key in references:
-        k = ".".join(key.split(".")[:level-1])
-        if k not in _refs:
-            _refs[k] = []
-        _refs[k].append(key)
-        del k
-
-    return [
-        (
-            join_or_single(ref[0], ref[-1]),
-            join_or_single(ref[0], ref[-1])
+    chunks = []
+    start, previous, parent, parent_end, count = None, None, None, None, 0
+    for reference in getreffs(level=level):
+        reference = str(reference)
+        # The parent of a reference is everything before its last separator
+        end = reference.rfind(".") if level > 1 else -1
+        if start is not None and (count == groupby or end != parent_end or not reference.startswith(parent)):
+            chunk = join_or_single(start, previous)
+            chunks.append((chunk, chunk))
+            start = None
+        if start is None:
+            start, parent, parent_end, count = reference, reference[:end] if end > 0 else "", end, 0
+        previous = reference
+        count += 1
+
+    if start is not None:
+        chunk = join_or_single(start, previous)
+        chunks.append((chunk, chunk))
+    return chunks
+
+
+class PassageSizes(object):
+    """ Size statistics of each reference of the texts of a corpus, used by :code:`size_grouper`.
+
+    Statistics are collected once per text and level, the first time they are requested or through \
+    :code:`PassageSizes.collect()`, and can be saved to and loaded from a JSON file. Statistics are saved with the \
+    checksum of the source of each text and are collected again when the source changes. Texts which do not expose \
+    their source (such as texts retrieved through a CTS API) are not checked.
+
+    :param resolver: Resolver used to retrieve texts
+    :type resolver: MyCapytain.resolvers.prototypes.Resolver
+    :param unit: Unit of size : "characters" or "tokens" (Whitespace separated words)
+    :type unit: str
+    :param path: JSON file in which statistics are saved and from which they are loaded
+    :type path: str
+
+    :Example:
+
+    .. code-block:: python
+
+        sizes = PassageSizes(resolver, path="/var/cache/nemo/sizes.json")
+        nemo = Nemo(
+            resolver=resolver,
+            chunker={"default": lambda text, getreffs: size_grouper(text, getreffs, sizes=sizes, budget=5000)}
         )
-        for sublist in _refs.values()
-        for ref in [
-            sublist[i:i+groupby]
-            for i in range(0, len(sublist), groupby)
-        ]
-    ]
+    """
+    UNITS = {
+        "characters": len,
+        "tokens": lambda string: len(string.split())
+    }
+
+    def __init__(self, resolver, unit="characters", path=None):
+        if unit not in type(self).UNITS:
+            raise ValueError("Unknown unit {}".format(unit))
+        self.resolver = resolver
+        self.unit = unit
+        self.path = path
+        self.__sizes__ = dict()
+        self.__checksums__ = dict()
+        self.__lock__ = threading.Lock()
+        if path and op.isfile(path):
+            with open(path) as f:
+                stored = json.load(f, object_pairs_hook=OrderedDict)
+            if stored.get("unit") == unit:
+                self.__sizes__ = stored["sizes"]
+                # Files saved without checksums are only trusted for texts which do not expose their source
+                self.__checksums__ = stored.get("checksums", {objectId: None for objectId in self.__sizes__})
+
+    @property
+    def fingerprint(self):
+        """ Stable representation of the statistics, used in the fingerprint of chunkers using them. Statistics \
+        depend on the source of each text, which stores check on their own as well
+
+        :rtype: str
+        """
+        return "unit={}".format(self.unit)
+
+    def __call__(self, text, level):
+        """ Retrieve the size of each reference of a text at a given level
+
+        :param text: Text metadata object
+        :param level: Citation level
+        :type level: int
+        :return: Dictionary of references and their size
+        :rtype: {str: int}
+        """
+        objectId, level = str(text.id), str(level)
+        checksum = source_checksum(text)
+        if self.__checksums__.get(objectId) != checksum:
+            with self.__lock__:
+                self.__sizes__.pop(objectId, None)
+                self.__checksums__[objectId] = checksum
+        if level not in self.__sizes__.get(objectId, {}):
+            sizes = self.measure(objectId, int(level))
+            with self.__lock__:
+                self.__sizes__.setdefault(objectId, OrderedDict())[level] = sizes
+        return self.__sizes__[objectId][level]
+
+    def measure(self, objectId, level):
+        """ Compute the size of each reference of a text at a given level
+
+        :param objectId: Text identifier
+        :type objectId: str
+        :param level: Citation level
+        :type level: int
+        :return: Dictionary of references and their size
+        :rtype: OrderedDict
+        """
+        size = type(self).UNITS[self.unit]
+        text = self.resolver.getTextualNode(objectId)
+        return OrderedDict(
+            (str(reff), size(text.getTextualNode(CtsReference(str(reff))).export(Mimetypes.PLAINTEXT)))
+            for reff in self.resolver.getReffs(objectId, level=level)
+        )
+
+    def collect(self, texts=None):
+        """ Collect statistics for the deepest level of every readable text of the corpus and save them
+
+        :param texts: List of text metadata objects to collect statistics for (Default : all readable texts)
+        :type texts: [CtsTextMetadata]
+        """
+        if texts is None:
+            texts = self.resolver.getMetadata().readableDescendants
+        for text in texts:
+            self(text, len(text.citation))
+        self.save()
+
+    def save(self):
+        """ Save statistics to the JSON file given at initiation, if any
+        """
+        if self.path:
+            with self.__lock__, open(self.path, "w") as f:
+                json.dump({"unit": self.unit, "sizes": self.__sizes__, "checksums": self.__checksums__}, f)
+
+
+def size_grouper(text, getreffs, sizes, budget=4000, level=None):
+    """ Alternative to level_grouper : groups consecutive references sharing the same parent until their cumulated \
+    size reaches a budget, so that every passage has a bounded weight whether the text is prose or verse.
+
+    :param text: Text object
+    :param getreffs: GetValidReff query callback
+    :param sizes: Callable returning the size of each reference of a text at a level, such as a PassageSizes instance
+    :type sizes: function(text, level) -> {str: int}
+    :param budget: Maximum cumulated size of a group. A reference bigger than the budget makes a group on its own
+    :type budget: int
+    :param level: Level of citation to retrieve
+    :return: List of grouped urn references with their human readable version
+    :rtype: [(str, str)]
+    """
+    if level is None or level > len(text.citation):
+        level = len(text.citation)
+
+    references = [str(ref) for ref in getreffs(level=level)]
+    known = sizes(text, level)
+    default = sum(known.values()) // len(known) if known else 1
+
+    chunks = []
+    start, previous, parent, total = None, None, None, 0
+    for reference in references:
+        size = known.get(reference, default)
+        reference_parent = reference.rpartition(".")[0]
+        if start is not None and (reference_parent != parent or total + size > budget):
+            chunks.append(join_or_single(start, previous))
+            start = None
+        if start is None:
+            start, parent, total = reference, reference_parent, 0
+        total += size
+        previous = reference
+    if start is not None:
+        chunks.append(join_or_single(start, previous))
+
+    return [(chunk, chunk) for chunk in chunks]
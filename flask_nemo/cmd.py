@@ -1,22 +1,43 @@
 from flask_nemo import Nemo
 from flask_nemo.chunker import level_grouper
+from flask_nemo.crawler import Crawler
 from flask import Flask
 from MyCapytain.resolvers.cts.api import HttpCtsResolver
 from MyCapytain.resolvers.cts.local import CtsCapitainsLocalResolver
 from MyCapytain.retrievers.cts5 import HttpCtsRetriever
+from flask_nemo.retrievers import CachedHttpCtsRetriever
+from flask_nemo.serving import PreforkServer
+from flask_nemo.cache import LRUCache
+from flask_nemo.store import ReferenceStore, PassageStore
+from flask_nemo.watcher import CorpusWatcher
 import argparse
 import sys
 
 
 class Server:
     @staticmethod
-    def runner(method, address, port, host, css, xslt, groupby, debug):
+    def application(method, address, css, xslt, groupby, production=False, template_cache=None,
+                    cts_cache=None, cts_cache_backend="sqlite", cts_cache_ttl=86400, cts_cache_stale_if_error=True,
+                    cts_cache_stale_while_revalidate=0, cts_breaker=False, cts_timeout=None,
+                    reference_store=None, passage_store=None, negative_cache=None):
         resolver = None
         app = Flask(
             __name__
         )
         if method == "cts-api":
-            resolver = HttpCtsResolver(HttpCtsRetriever(address))
+            if cts_cache:
+                resolver = HttpCtsResolver(CachedHttpCtsRetriever(
+                    address,
+                    cache_name=cts_cache,
+                    backend=cts_cache_backend,
+                    expire_after=cts_cache_ttl,
+                    stale_if_error=cts_cache_stale_if_error,
+                    stale_while_revalidate=cts_cache_stale_while_revalidate,
+                    breaker=cts_breaker,
+                    timeout=cts_timeout
+                ))
+            else:
+                resolver = HttpCtsResolver(HttpCtsRetriever(address))
         elif method == "cts-local":
             resolver = CtsCapitainsLocalResolver([address])
         if xslt is not None:
@@ -29,21 +50,105 @@ class Server:
             css=css,
             transform=xslt,
             resolver=resolver,
-            chunker={"default": lambda x, y: level_grouper(x, y, groupby=groupby)}
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=groupby)},
+            production=production,
+            bytecode_cache=template_cache,
+            reference_store=ReferenceStore(reference_store) if reference_store else None,
+            passage_store=PassageStore(passage_store) if passage_store else None,
+            negative_cache=LRUCache(max_entries=10000, default_timeout=negative_cache) if negative_cache else None
+        )
+        return nemo, app
+
+    @staticmethod
+    def print_statistics(nemo):
+        for cache, statistics in nemo.cache_statistics().items():
+            print("Cache {}: {}".format(cache, " ".join(["{}={}".format(k, v) for k, v in statistics.items()])))
+
+    @staticmethod
+    def runner(method, address, port, host, css, xslt, groupby, debug, production=False, template_cache=None,
+               cts_cache=None, cts_cache_backend="sqlite", cts_cache_ttl=86400, cts_cache_stale_if_error=True,
+               cts_cache_stale_while_revalidate=0, cts_breaker=False, cts_timeout=None,
+               workers=None, threads=None, reference_store=None, passage_store=None, watch=None, negative_cache=None):
+        nemo, app = Server.application(
+            method, address, css, xslt, groupby, production=production, template_cache=template_cache,
+            cts_cache=cts_cache, cts_cache_backend=cts_cache_backend, cts_cache_ttl=cts_cache_ttl,
+            cts_cache_stale_if_error=cts_cache_stale_if_error,
+            cts_cache_stale_while_revalidate=cts_cache_stale_while_revalidate, cts_breaker=cts_breaker,
+            cts_timeout=cts_timeout,
+            reference_store=reference_store, passage_store=passage_store, negative_cache=negative_cache
         )
 
         # We run the app
         app.debug = debug
-        app.run(port=port, host=host)
+        start = None
+        if watch and method == "cts-local":
+            watcher = CorpusWatcher(nemo, interval=watch)
+            # Files are recorded now, the thread is started by each worker : changes made in between are caught
+            watcher.check()
+            start = watcher.start
+        if workers or threads:
+            PreforkServer(
+                app, host=host, port=port, workers=workers or 1, threads=threads or 1, preload=nemo.preload,
+                post_fork=start
+            ).serve_forever()
+        else:
+            if start is not None:
+                start()
+            app.run(port=port, host=host)
+        if not workers or workers <= 1:
+            # Counters of forked workers are not shared with this process, whose own counters stay at zero
+            Server.print_statistics(nemo)
         # For test purposes
         return nemo, app
 
     @staticmethod
-    def parser(args):
-        parser = argparse.ArgumentParser(
-            description="""Capitains Nemo UI
-        Currently, can be used with either a CTS API Address or a local CapiTainS repository"""
+    def warmer(method, address, css, xslt, groupby, urns=None, parallelism=4, max_passages=None, passages=True,
+               pages=False, cts_cache=None, cts_cache_backend="sqlite", cts_cache_ttl=86400,
+               cts_cache_stale_if_error=True, cts_cache_stale_while_revalidate=0, cts_breaker=False, cts_timeout=None,
+               reference_store=None, passage_store=None):
+        nemo, app = Server.application(
+            method, address, css, xslt, groupby,
+            cts_cache=cts_cache, cts_cache_backend=cts_cache_backend, cts_cache_ttl=cts_cache_ttl,
+            cts_cache_stale_if_error=cts_cache_stale_if_error,
+            cts_cache_stale_while_revalidate=cts_cache_stale_while_revalidate, cts_breaker=cts_breaker,
+            cts_timeout=cts_timeout,
+            reference_store=reference_store, passage_store=passage_store
         )
+        if urns is not None:
+            with open(urns) as f:
+                urns = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+        def progress(done, total, kind, objectId, subreference, duration, error):
+            print("[{}/{}] {} {}{} {:.3f}s{}".format(
+                done, total, kind, objectId, ":" + subreference if subreference else "", duration,
+                " ERROR {}".format(error) if error is not None else ""
+            ))
+
+        report = Crawler(
+            nemo, parallelism=parallelism, passages=passages, pages=pages, max_passages=max_passages,
+            progress=progress
+        ).run(urns)
+        for urn in report["unknown"]:
+            print("Unknown identifier {}".format(urn))
+        for kind in Crawler.KINDS:
+            statistics = report[kind]
+            print("Warmed {} {} in {:.3f}s (mean={:.3f}s max={:.3f}s errors={})".format(
+                statistics["count"], kind, statistics["time"],
+                statistics["time"] / statistics["count"] if statistics["count"] else 0,
+                statistics["max"], statistics["errors"]
+            ))
+        print("Warmed {} texts in {:.3f}s".format(report["texts"], report["elapsed"]))
+        Server.print_statistics(nemo)
+        # For test purposes
+        return nemo, app, report
+
+    @staticmethod
+    def arguments(parser):
+        """ Add the arguments setting up the application to a parser
+
+        :param parser: Parser of the command line
+        :type parser: argparse.ArgumentParser
+        """
         parser.add_argument('method', type=str, choices=["cts-api", "cts-local"],
                            help='Method to retrieve resource')
         parser.add_argument('address', type=str, default=None,
@@ -51,24 +156,123 @@ class Server:
     - Local CapiTainS repository [ http://capitains.github.io/pages/guidelines ]
     - HTTP CTS Address
     """)
-        parser.add_argument('--port', type=int, default=8000,
-                           help='Port to use for the HTTP Server')
-        parser.add_argument('--host', type=str, default="127.0.0.1",
-                           help='Host to use for the HTTP Server')
         parser.add_argument('--css', type=str, default=None, nargs='*',
                            help='Full path to secondary css file')
         parser.add_argument('--xslt', type=str, default=None,
                            help='Default XSLT to use')
         parser.add_argument('--groupby', type=int, default=25,
                            help='Number of passage to group in the deepest level of the hierarchy')
+        parser.add_argument('--reference-store', type=str, default=None,
+                           help='Directory in which chunked references are stored across restarts')
+        parser.add_argument('--passage-store', type=str, default=None,
+                           help='Path of the SQLite database in which transformed passages are stored')
+        parser.add_argument('--cts-cache', type=str, default=None,
+                           help='Path of the local cache of CTS API responses (cts-api method only)')
+        parser.add_argument('--cts-cache-backend', type=str, default="sqlite", choices=["sqlite", "filesystem"],
+                           help='Storage of the local cache of CTS API responses')
+        parser.add_argument('--cts-cache-ttl', type=int, default=86400,
+                           help='Time-to-live of cached CTS API responses in seconds, -1 for no expiration')
+        parser.add_argument('--no-stale-if-error', dest="cts_cache_stale_if_error", action="store_false",
+                           default=True, help='Do not serve expired CTS API responses when the API fails')
+        parser.add_argument('--cts-cache-stale-while-revalidate', type=int, default=0,
+                           help='Time, in seconds, after expiration during which cached CTS API responses are served '
+                                'while being refreshed in the background (Requires --cts-cache)')
+        parser.add_argument('--cts-breaker', action="store_true", default=False,
+                           help='Stop sending requests to the CTS API while it fails, serving cached responses only '
+                                '(Requires --cts-cache)')
+        parser.add_argument('--cts-timeout', type=float, default=None,
+                           help='Maximum time, in seconds, waited for the CTS API (Requires --cts-cache)')
+
+    @staticmethod
+    def check_arguments(parser, args):
+        """ Reject options which would be ignored by the application
+
+        :param parser: Parser of the command line
+        :type parser: argparse.ArgumentParser
+        :param args: Parsed arguments
+        :type args: dict
+        """
+        if not args["cts_cache"] or args["method"] != "cts-api":
+            ignored = [
+                option for option, value in (
+                    ("--cts-cache-stale-while-revalidate", args["cts_cache_stale_while_revalidate"]),
+                    ("--cts-breaker", args["cts_breaker"]),
+                    ("--cts-timeout", args["cts_timeout"])
+                ) if value
+            ]
+            if ignored:
+                parser.error("{} require the cts-api method and --cts-cache".format(", ".join(ignored)))
+
+    @staticmethod
+    def parser(args):
+        parser = argparse.ArgumentParser(
+            description="""Capitains Nemo UI
+        Currently, can be used with either a CTS API Address or a local CapiTainS repository.
+        Use "warm" as first argument to fill the persistent stores of the application instead of running it"""
+        )
+        Server.arguments(parser)
+        parser.add_argument('--port', type=int, default=8000,
+                           help='Port to use for the HTTP Server')
+        parser.add_argument('--host', type=str, default="127.0.0.1",
+                           help='Host to use for the HTTP Server')
         parser.add_argument('--debug', action="store_true", default=False, help="Set-up the application for debugging")
+        parser.add_argument('--production', action="store_true", default=False,
+                           help='Resolve templates once at startup and disable template reloading')
+        parser.add_argument('--template-cache', type=str, default=None,
+                           help='Directory in which compiled templates are cached across restarts')
+        parser.add_argument('--workers', type=int, default=None,
+                           help='Number of worker processes, forked once the inventory is loaded. '
+                                'Replaces the development server')
+        parser.add_argument('--threads', type=int, default=None,
+                           help='Number of threads per worker process. Replaces the development server')
+        parser.add_argument('--watch', type=float, default=None,
+                           help='Interval, in seconds, at which the files of a local corpus are checked for changes. '
+                                'Changed texts are reloaded and their cached entries invalidated')
+        parser.add_argument('--negative-cache', type=int, default=None,
+                           help='Time, in seconds, during which unknown identifiers and references are remembered '
+                                'and not looked up again')
 
         args = vars(parser.parse_args(args))
+        Server.check_arguments(parser, args)
         print("Running with {}".format(" ".join(["{}={}".format(k, v) for k, v in args.items()])))
         return Server.runner(**args)
 
+    @staticmethod
+    def warm_parser(args):
+        parser = argparse.ArgumentParser(
+            prog="capitains-nemo warm",
+            description="""Capitains Nemo warm-up of persistent stores
+        Retrieves references and transformed passages of every text, or of a list of identifiers, so that the
+        reference store, the passage store and the local cache of CTS API responses are filled before the application
+        is visited. In-memory caches live in the process of the application and are not warmed. Options should match
+        the ones of the application"""
+        )
+        Server.arguments(parser)
+        parser.add_argument('--urns', type=str, default=None,
+                           help='File listing the identifiers to warm, one per line and by order of priority. '
+                                'Collections and works are expanded to their texts (Default: every text)')
+        parser.add_argument('--parallelism', type=int, default=4,
+                           help='Number of concurrent tasks')
+        parser.add_argument('--max-passages', type=int, default=None,
+                           help='Maximum number of passages warmed per text')
+        parser.add_argument('--no-passages', dest="passages", action="store_false", default=True,
+                           help='Only warm references')
+        parser.add_argument('--pages', action="store_true", default=False,
+                           help='Request pages through the application instead of calling Nemo methods. Pages are not '
+                                'kept : only the stores they read from are filled')
+
+        args = vars(parser.parse_args(args))
+        Server.check_arguments(parser, args)
+        if not (args["reference_store"] or args["passage_store"] or args["cts_cache"]):
+            parser.error("warm fills persistent stores only : --reference-store, --passage-store or --cts-cache "
+                         "is required")
+        print("Warming with {}".format(" ".join(["{}={}".format(k, v) for k, v in args.items()])))
+        return Server.warmer(**args)
+
     @staticmethod
     def cmd():
+        if sys.argv[1:2] == ["warm"]:
+            return Server.warm_parser(sys.argv[2:])
         return Server.parser(sys.argv[1:])
 
 if __name__ == "__main__":
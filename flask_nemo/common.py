@@ -1,7 +1,9 @@
 import os.path as op
 from collections import OrderedDict
 import re
-from functools import reduce
+from functools import reduce, partial, lru_cache
+from hashlib import sha1
+from types import CodeType, FunctionType, ModuleType
 
 
 """ Regular expression to match common literature namespace
@@ -63,3 +65,231 @@ def create_hierarchy(hierarchy, level):
     if level not in hierarchy:
         hierarchy[level] = OrderedDict()
     return hierarchy[level]
+
+
+""" Types whose representation is stable across processes and is fed as is to fingerprints
+"""
+STABLE_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+
+@lru_cache(maxsize=256)
+def callable_fingerprint(func):
+    """ Compute a stable fingerprint of a callable, taking into account its code, its constants and the values it
+    closes over or reads from its module, so that the output of chunkers or transformers can be stored across restarts
+
+    .. note:: Plain functions referenced by the callable (such as a chunker wrapped in a lambda) are taken into account.
+        Other objects are represented by their class and, when they have one, by their `fingerprint` string
+        attribute : their representation, which usually contains their memory address, is never used.
+
+    :param func: Function, method, partial or lambda
+    :return: Hexadecimal SHA1 fingerprint
+    :rtype: str
+    """
+    digest = sha1()
+    _feed_callable(digest, func, set())
+    return digest.hexdigest()
+
+
+def _stable_repr(value, depth=0):
+    """ Represent a value with data which does not change from a process to another
+
+    :param value: Value to represent
+    :param depth: Depth of the value in containers
+    :return: Representation or None for values which should not be fed
+    :rtype: str
+    """
+    if isinstance(value, STABLE_TYPES):
+        return repr(value)
+    if isinstance(value, ModuleType):
+        return None
+    if depth < 4 and isinstance(value, (list, tuple, set, frozenset)):
+        items = [_stable_repr(item, depth + 1) for item in value]
+        if isinstance(value, (set, frozenset)):
+            items = sorted(str(item) for item in items)
+        return "{}({})".format(type(value).__name__, ",".join(str(item) for item in items))
+    if depth < 4 and isinstance(value, dict):
+        return "dict({})".format(",".join(sorted(
+            "{}:{}".format(_stable_repr(key, depth + 1), _stable_repr(item, depth + 1)) for key, item in value.items()
+        )))
+    if isinstance(value, type):
+        return "class:{}.{}".format(value.__module__, value.__qualname__)
+    fingerprint = getattr(value, "fingerprint", None)
+    return "object:{}.{}:{}".format(
+        type(value).__module__, type(value).__qualname__, fingerprint if isinstance(fingerprint, str) else ""
+    )
+
+
+def stable_identifier(value):
+    """ Represent a parameter with data which does not change from a process to another : values of STABLE_TYPES \
+    and containers of them are represented as they are, other objects by their class and their `id` attribute \
+    (such as collections and passages) or, when they have none, by their class only.
+
+    .. note:: Objects without identifier (such as XML trees) are not told apart : they should be identified by \
+        other parameters of the same call (such as an objectId and a subreference)
+
+    :param value: Value to represent
+    :return: Representation
+    :rtype: str
+    """
+    if isinstance(value, STABLE_TYPES + (list, tuple, set, frozenset, dict)):
+        return _stable_repr(value)
+    identifier = getattr(value, "id", None)
+    if identifier is not None and not callable(identifier):
+        return "{}.{}:{}".format(type(value).__module__, type(value).__qualname__, identifier)
+    return "{}.{}".format(type(value).__module__, type(value).__qualname__)
+
+
+def _feed_value(digest, value, seen):
+    """ Feed a digest with a value referenced by a callable
+
+    :param digest: Hash object to update
+    :param value: Value closed over or read from the module of the callable
+    :param seen: Identifiers of the callables already represented
+    """
+    if isinstance(value, (FunctionType, partial)):
+        _feed_callable(digest, value, seen)
+        return
+    representation = _stable_repr(value)
+    if representation is not None:
+        digest.update(representation.encode())
+
+
+def _feed_callable(digest, func, seen):
+    """ Feed a digest with the representation of a callable
+
+    :param digest: Hash object to update
+    :param func: Callable to represent
+    :param seen: Identifiers of the callables already represented
+    """
+    if id(func) in seen:
+        return
+    seen.add(id(func))
+
+    if isinstance(func, partial):
+        _feed_callable(digest, func.func, seen)
+        for arg in func.args:
+            _feed_value(digest, arg, seen)
+        for key, value in sorted(func.keywords.items()):
+            digest.update(key.encode())
+            _feed_value(digest, value, seen)
+        return
+    func = getattr(func, "__func__", func)
+    code = getattr(func, "__code__", None)
+    if code is None:
+        digest.update("{}.{}".format(
+            getattr(func, "__module__", None), getattr(func, "__qualname__", type(func).__qualname__)
+        ).encode())
+        return
+
+    _feed_code(digest, code)
+    for value in func.__defaults__ or ():
+        _feed_value(digest, value, seen)
+    for key, value in sorted((func.__kwdefaults__ or {}).items()):
+        digest.update(key.encode())
+        _feed_value(digest, value, seen)
+    for cell in func.__closure__ or ():
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue
+        _feed_value(digest, value, seen)
+    for name in _global_names(code):
+        if name in func.__globals__:
+            digest.update(name.encode())
+            _feed_value(digest, func.__globals__[name], seen)
+
+
+def _feed_code(digest, code):
+    """ Feed a digest with the bytecode and constants of a code object and of the code objects it defines
+
+    :param digest: Hash object to update
+    :param code: Code object
+    :type code: CodeType
+    """
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _feed_code(digest, const)
+        else:
+            digest.update(_stable_repr(const).encode())
+
+
+def _global_names(code):
+    """ List the names read by a code object and the code objects it defines (such as lambdas or comprehensions)
+
+    :param code: Code object
+    :type code: CodeType
+    :rtype: [str]
+    """
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.extend(name for name in _global_names(const) if name not in names)
+    return names
+
+
+class ReferenceSubtree(object):
+    """ Placeholder for a branch of a hierarchy of references which is not rendered but loaded on demand
+
+    :param reference: Reference of the branch (*eg.* "1.2")
+    :type reference: str
+    """
+    def __init__(self, reference):
+        self.reference = reference
+
+    def __eq__(self, other):
+        return isinstance(other, ReferenceSubtree) and self.reference == other.reference
+
+    def __repr__(self):
+        return "<ReferenceSubtree {}>".format(self.reference)
+
+
+def truncate_hierarchy(hierarchy, depth, prefix=None):
+    """ Keep the first levels of a hierarchy of references and replace deeper branches by placeholders
+
+    :param hierarchy: Hierarchy of references such as built by flask_nemo.filters.f_hierarchical_passages
+    :type hierarchy: OrderedDict
+    :param depth: Number of levels of branches to keep
+    :type depth: int
+    :param prefix: Reference of the branch represented by hierarchy
+    :type prefix: str
+    :return: Truncated hierarchy
+    :rtype: OrderedDict
+    """
+    truncated = OrderedDict()
+    for key, value in hierarchy.items():
+        if isinstance(value, str):
+            truncated[key] = value
+            continue
+        reference = key.strip("%").split("|", 1)[-1]
+        if prefix:
+            reference = prefix + "." + reference
+        if depth > 1:
+            truncated[key] = truncate_hierarchy(value, depth - 1, reference)
+        else:
+            truncated[key] = ReferenceSubtree(reference)
+    return truncated
+
+
+def hierarchy_branch(hierarchy, citation, reference):
+    """ Retrieve the branch of a hierarchy of references identified by a reference
+
+    :param hierarchy: Hierarchy of references such as built by flask_nemo.filters.f_hierarchical_passages
+    :type hierarchy: OrderedDict
+    :param citation: Citation scheme of the text
+    :type citation: Citation
+    :param reference: Reference of the branch (*eg.* "1.2")
+    :type reference: str
+    :return: Branch of the hierarchy
+    :rtype: OrderedDict
+    :raises KeyError: When the branch does not exist
+    """
+    levels = [level for level in citation]
+    branch = hierarchy
+    for i, part in enumerate(reference.split(".")):
+        if i >= len(levels):
+            raise KeyError(reference)
+        branch = branch["%{}|{}%".format(levels[i].name, part)]
+        if isinstance(branch, str):
+            raise KeyError(reference)
+    return branch
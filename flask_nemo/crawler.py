@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    Crawler
+    ====
+
+    Warm-up of the caches and stores of a Nemo instance, typically after a deploy : references, passages and \
+    their transformations are computed ahead of the first visitors
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import monotonic
+
+from flask import url_for
+
+
+class Crawler(object):
+    """ Crawler retrieving the references (get_reffs) and the transformed passages (get_passage and transform) \
+    of the texts of an inventory, or of a prioritized list of them, in a pool of threads.
+
+    Texts are warmed in the given order : the passages of a text are queued before the following texts, so that \
+    the first identifiers of a list of top URNs are served warm as soon as possible.
+
+    .. note:: The reference and passage stores and the local cache of CTS API responses are warmed by direct calls. \
+    Flask-Caching memoization is warmed as well, but only benefits the application when the crawler runs in its \
+    process or when the backend is shared by processes (eg. Redis). Template fragments and the response cache are \
+    only filled when pages are requested (pages=True), under the same conditions. The :code:`capitains-nemo warm` \
+    command runs in its own process and thus only warms the persistent stores.
+
+    :param nemo: Nemo instance, registered on its application
+    :type nemo: flask_nemo.Nemo
+    :param parallelism: Number of concurrent tasks
+    :type parallelism: int
+    :param passages: Warm passages after references
+    :type passages: bool
+    :param pages: Request the references and passage pages through the application instead of calling Nemo methods
+    :type pages: bool
+    :param max_passages: Maximum number of passages warmed per text (Default: every chunk)
+    :type max_passages: int
+    :param progress: Function called after each task with the number of done tasks, the number of known tasks, \
+    the kind of task (references or passage), the text identifier, the passage reference, the duration of the task \
+    and the exception it raised, if any
+    :type progress: function
+
+    :Example:
+
+    .. code-block:: python
+
+        report = Crawler(nemo, parallelism=8, max_passages=10).run(["urn:cts:latinLit:phi1294.phi002.perseus-lat2"])
+    """
+    KINDS = ("references", "passage")
+
+    def __init__(self, nemo, parallelism=4, passages=True, pages=False, max_passages=None, progress=None):
+        self.nemo = nemo
+        self.parallelism = max(1, parallelism)
+        self.passages = passages
+        self.pages = pages
+        self.max_passages = max_passages
+        self.progress = progress
+
+    @property
+    def app(self):
+        return self.nemo.app
+
+    def texts(self, urns=None):
+        """ Resolve identifiers to the list of texts to warm. Identifiers of collections or works are expanded \
+        to their texts
+
+        :param urns: Identifiers, by order of priority (Default: every text of the inventory)
+        :type urns: [str]
+        :return: Identifiers of texts, without duplicates, and identifiers unknown to the inventory
+        :rtype: ([str], [str])
+        """
+        index = self.nemo.inventory_index
+        if urns is None:
+            return index.resources(), []
+        texts, unknown, seen = [], [], set()
+        for urn in urns:
+            if urn not in index:
+                unknown.append(urn)
+                continue
+            for text in index.resources(urn):
+                if text not in seen:
+                    seen.add(text)
+                    texts.append(text)
+        return texts, unknown
+
+    def request(self, endpoint, **kwargs):
+        """ Request a page of the application
+
+        :param endpoint: Endpoint of the Nemo blueprint
+        :type endpoint: str
+        :param kwargs: Parameters of the route
+        :raises ValueError: When the page is answered with an error status
+        """
+        with self.app.test_request_context():
+            url = url_for("{}.{}".format(self.nemo.name, endpoint), **kwargs)
+        response = self.app.test_client().get(url)
+        response.close()
+        if response.status_code >= 400:
+            raise ValueError("{} answered with status {}".format(url, response.status_code))
+
+    def warm_references(self, objectId, subreference=None):
+        """ Warm the references and the hierarchy of a text
+
+        :param objectId: Text identifier
+        :type objectId: str
+        :param subreference: Unused
+        :return: Chunked passage references of the text
+        :rtype: [str]
+        """
+        if self.pages:
+            self.request("r_references", objectId=objectId)
+        with self.app.app_context():
+            reffs = [str(reff) for reff, _ in self.nemo.get_reffs(objectId)]
+            if not self.pages:
+                self.nemo.get_hierarchy(objectId)
+        return reffs
+
+    def warm_passage(self, objectId, subreference):
+        """ Warm a transformed passage
+
+        :param objectId: Text identifier
+        :type objectId: str
+        :param subreference: Passage reference
+        :type subreference: str
+        """
+        if self.pages:
+            self.request("r_passage", objectId=objectId, subreference=subreference)
+            return
+        with self.app.app_context():
+            self.nemo.get_transformed_passage(self.nemo.get_collection(objectId), subreference)
+
+    def execute(self, kind, objectId, subreference=None):
+        """ Run and time a task
+
+        :param kind: Kind of task (references or passage)
+        :type kind: str
+        :param objectId: Text identifier
+        :type objectId: str
+        :param subreference: Passage reference
+        :type subreference: str
+        :return: Duration in seconds, result and exception raised
+        :rtype: (float, Any, Exception)
+        """
+        start = monotonic()
+        try:
+            result, error = getattr(self, "warm_" + kind)(objectId, subreference), None
+        except Exception as E:
+            result, error = None, E
+        return monotonic() - start, result, error
+
+    def run(self, urns=None):
+        """ Warm the texts
+
+        :param urns: Identifiers, by order of priority (Default: every text of the inventory)
+        :type urns: [str]
+        :return: Report with texts (Number of warmed texts), unknown (Unknown identifiers), elapsed (Duration \
+        in seconds), errors (List of failed tasks) keys and, per kind of task, a dictionary of count, errors, \
+        time (Sum of durations) and max (Longest duration)
+        :rtype: dict
+        """
+        texts, unknown = self.texts(urns)
+        report = {"texts": len(texts), "unknown": unknown, "errors": [], "elapsed": 0}
+        for kind in type(self).KINDS:
+            report[kind] = dict(count=0, errors=0, time=0, max=0)
+
+        start = monotonic()
+        queue = deque([("references", objectId, None) for objectId in texts])
+        pending, done = dict(), 0
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            while queue or pending:
+                while queue and len(pending) < self.parallelism:
+                    task = queue.popleft()
+                    pending[executor.submit(self.execute, *task)] = task
+                finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    kind, objectId, subreference = task = pending.pop(future)
+                    duration, result, error = future.result()
+                    done += 1
+                    statistics = report[kind]
+                    statistics["count"] += 1
+                    statistics["time"] += duration
+                    statistics["max"] = max(statistics["max"], duration)
+                    if error is not None:
+                        statistics["errors"] += 1
+                        report["errors"].append(task + (str(error), ))
+                    elif kind == "references" and self.passages:
+                        queue.extendleft(reversed([
+                            ("passage", objectId, reff) for reff in result[:self.max_passages]
+                        ]))
+                    if self.progress is not None:
+                        self.progress(
+                            done, done + len(queue) + len(pending), kind, objectId, subreference, duration, error
+                        )
+        report["elapsed"] = monotonic() - start
+        return report
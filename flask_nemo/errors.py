@@ -1,3 +1,26 @@
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+
 class ValueWarning(Warning):
     """ This warning is issued when a value was incorrect and automatically corrected """
-    pass
\ No newline at end of file
+    pass
+
+
+class TransformError(Exception):
+    """ This error is raised when a transformation could not be applied by a transform pool """
+    pass
+
+
+class TransformTimeout(TransformError):
+    """ This error is raised when a transformation takes longer than allowed """
+    pass
+
+
+class TransformInputTooLarge(TransformError):
+    """ This error is raised when the passage given to a transformation is bigger than allowed """
+    pass
+
+
+class CircuitOpenError(RequestsConnectionError):
+    """ This error is raised when a request is not sent to an API because its circuit breaker is open """
+    pass
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+    Inventory index
+    ====
+
+    Views of the collections of an inventory, precomputed in a single walk of the inventory tree so that \
+    collection pages do not traverse nor translate the inventory at each request
+"""
+
+import threading
+from operator import itemgetter
+
+from MyCapytain.resources.prototypes.metadata import ResourceCollection
+from MyCapytain.errors import UnknownCollection
+
+from flask_nemo.filters import f_slugify
+
+
+class InventoryIndex(object):
+    """ Index of the collections of an inventory.
+
+    For each collection, the index stores its label in each language, its model and type, its slug and the list of \
+    its members and parents. Aggregates over the subtree of each collection (number of members, number of texts and \
+    languages of these texts) are computed bottom-up during the same walk. Views (Dictionaries used by templates) \
+    and sorted lists of members are computed once per language. Languages which are not precomputed are computed \
+    the first time they are requested.
+
+    .. warning:: Views and lists returned by the index are shared across requests and should not be modified
+
+    :param inventory: Root collection of the inventory
+    :type inventory: Collection
+    :param langs: Languages to precompute labels in
+    :type langs: [str]
+    """
+    def __init__(self, inventory, langs=None):
+        self.inventory = inventory
+        self.langs = set(langs or [])
+        self.langs.add(None)
+        self.__collections__ = dict()
+        self.__entries__ = dict()
+        self.__views__ = dict()
+        self.__lock__ = threading.Lock()
+        self.walk()
+
+    def walk(self):
+        """ Walk the inventory tree and index every collection
+        """
+        collections, entries, order = dict(), dict(), []
+        stack = [(self.inventory, None)]
+        while stack:
+            collection, parent = stack.pop()
+            collections[collection.id] = collection
+            entries[collection.id] = self.make_entry(collection, entries.get(parent))
+            order.append(collection.id)
+            for member in collection.members:
+                stack.append((member, collection.id))
+
+        # Members are always walked after their parent : the reversed walk order aggregates children first
+        for identifier in reversed(order):
+            self.aggregate(entries[identifier], [entries[member] for member in entries[identifier]["members"]])
+
+        with self.__lock__:
+            self.__collections__, self.__entries__, self.__views__ = collections, entries, dict()
+        for lang in self.langs:
+            self.translate(lang)
+
+    def make_entry(self, collection, parent=None):
+        """ Build the language independent entry of a collection
+
+        :param collection: Collection to index
+        :param parent: Entry of the parent of the collection
+        :type parent: dict
+        :return: Entry
+        :rtype: dict
+        """
+        label = collection.get_label()
+        members = [member.id for member in collection.members]
+        entry = {
+            "id": collection.id,
+            "has_label": bool(label),
+            "is_resource": isinstance(collection, ResourceCollection),
+            "model": str(collection.model),
+            "type": str(collection.type),
+            "size": len(members),
+            "members": members,
+            "parents": [],
+            "slug_labels": [str(label)] if label else []
+        }
+        if parent is not None:
+            entry["parents"] = [parent["id"]] + parent["parents"]
+            entry["slug_labels"] = parent["slug_labels"] + entry["slug_labels"]
+        entry["semantic"] = f_slugify("--".join(entry["slug_labels"]))
+        if entry["is_resource"]:
+            entry["lang"] = str(collection.lang)
+        return entry
+
+    @staticmethod
+    def aggregate(entry, members):
+        """ Compute the aggregates of an entry from the ones of its members
+
+        :param entry: Entry to update
+        :type entry: dict
+        :param members: Entries of the members, with their aggregates already computed
+        :type members: [dict]
+        """
+        texts, languages = int(entry["is_resource"]), set()
+        if entry["is_resource"]:
+            languages.add(entry["lang"])
+        for member in members:
+            texts += member["texts"]
+            languages.update(member["languages"])
+        entry["texts"] = texts
+        entry["languages"] = sorted(languages)
+
+    def translate(self, lang):
+        """ Compute views, sorted members and parents of every collection in a given language
+
+        :param lang: Language to express labels in
+        :type lang: str
+        :return: Dictionary of views, members and parents per collection identifier
+        :rtype: dict
+        """
+        views = dict()
+        for identifier, entry in self.__entries__.items():
+            view = {
+                "id": entry["id"],
+                "label": str(self.__collections__[identifier].get_label(lang)),
+                "is_resource": entry["is_resource"],
+                "model": entry["model"],
+                "type": entry["type"],
+                "size": entry["size"],
+                "texts": entry["texts"],
+                "languages": entry["languages"],
+                "semantic": entry["semantic"]
+            }
+            if entry["is_resource"]:
+                view["lang"] = entry["lang"]
+            views[identifier] = view
+
+        translation = {"views": views, "members": dict(), "children": dict(), "parents": dict()}
+        for identifier, entry in self.__entries__.items():
+            children = sorted(entry["members"], key=lambda member: views[member]["label"])
+            translation["children"][identifier] = [views[member] for member in children]
+            translation["members"][identifier] = [
+                views[member] for member in children if self.__entries__[member]["has_label"]
+            ]
+            translation["parents"][identifier] = [
+                {key: views[parent][key] for key in ("id", "label", "model", "type", "size", "texts", "languages")}
+                for parent in entry["parents"]
+                if self.__entries__[parent]["has_label"]
+            ]
+        with self.__lock__:
+            self.__views__[lang] = translation
+        return translation
+
+    def translation(self, lang):
+        """ Retrieve the views of the index in a given language, computing them if needed
+
+        :param lang: Language to express labels in
+        :type lang: str
+        :rtype: dict
+        """
+        if lang not in self.__views__:
+            return self.translate(lang)
+        return self.__views__[lang]
+
+    def __contains__(self, objectId):
+        return objectId in self.__entries__
+
+    def collection(self, objectId):
+        """ Retrieve a collection of the inventory
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :return: Collection
+        :raises UnknownCollection: When the collection is not part of the inventory
+        """
+        try:
+            return self.__collections__[objectId]
+        except KeyError:
+            raise UnknownCollection("%s is not part of this object" % objectId)
+
+    def semantic(self, objectId):
+        """ Retrieve the SEO friendly slug of a collection, made of its own label and the ones of its parents
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :rtype: str
+        """
+        return self.__entries__[objectId]["semantic"]
+
+    def view(self, objectId, lang=None):
+        """ Retrieve the dictionary view of a collection
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param lang: Language to express labels in
+        :type lang: str
+        :return: Dictionary with id, label, is_resource, model, type, size (Number of members), texts (Number of \
+        texts in the subtree), languages (Languages of these texts), semantic and lang (for resources) keys
+        :rtype: dict
+        """
+        return self.translation(lang)["views"][objectId]
+
+    def members(self, objectId, lang=None, labelled=True):
+        """ Retrieve the views of the members of a collection, sorted by label
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param lang: Language to express labels in
+        :type lang: str
+        :param labelled: Only retrieve members which have a label
+        :type labelled: bool
+        :rtype: [dict]
+        """
+        return self.translation(lang)["members" if labelled else "children"][objectId]
+
+    def resources(self, objectId=None):
+        """ Retrieve the identifiers of the readable texts of a collection and of its descendants
+
+        :param objectId: Collection identifier (Default: the whole inventory)
+        :type objectId: str
+        :return: Identifiers of texts, in depth-first order
+        :rtype: [str]
+        """
+        if objectId is None:
+            objectId = self.inventory.id
+        resources, stack = [], [objectId]
+        while stack:
+            entry = self.__entries__[stack.pop()]
+            if entry["is_resource"]:
+                resources.append(entry["id"])
+            stack.extend(reversed(entry["members"]))
+        return resources
+
+    def ancestors(self, objectId):
+        """ Retrieve the identifiers of the ancestors of a collection, from the closest to the furthest
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :rtype: [str]
+        """
+        return list(self.__entries__[objectId]["parents"])
+
+    def parents(self, objectId, lang=None):
+        """ Retrieve the views of the labelled parents of a collection, from the closest to the furthest
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param lang: Language to express labels in
+        :type lang: str
+        :rtype: [dict]
+        """
+        return self.translation(lang)["parents"][objectId]
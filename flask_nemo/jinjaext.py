@@ -1,4 +1,7 @@
-from jinja2 import nodes
+import os
+import os.path as op
+
+from jinja2 import nodes, BaseLoader, TemplateNotFound
 from jinja2.ext import Extension
 
 
@@ -8,6 +11,7 @@ class FakeCacheExtension(Extension):
 
     """
     tags = set(['cache'])
+    method = "_do_nothing"
 
     def parse(self, parser):
         lineno = next(parser.stream).lineno
@@ -35,8 +39,83 @@ class FakeCacheExtension(Extension):
             args.append(nodes.Const([]))
 
         body = parser.parse_statements(['name:endcache'], drop_needle=True)
-        return nodes.CallBlock(self.call_method('_do_nothing', args),
+        return nodes.CallBlock(self.call_method(self.method, args),
                                [], [], body).set_lineno(lineno)
 
     def _do_nothing(self, timeout, fragment_name, vary_on, caller):
         return caller()
+
+
+class FragmentCacheExtension(FakeCacheExtension):
+    """ Cache extension storing rendered fragments in the in-process cache set as `nemo_fragment_cache` on the \
+    Jinja environment, so that `{% cache timeout, key %}` blocks work without Flask-Caching.
+
+    The syntax is the one of Flask-Caching : `{% cache timeout, fragment_name, vary_on... %}...{% endcache %}`. \
+    A timeout of 0 stores the fragment with the default time-to-live of the cache.
+    """
+    method = "_cache_fragment"
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(nemo_fragment_cache=None)
+
+    @staticmethod
+    def make_key(fragment_name, vary_on):
+        """ Build the cache key of a fragment
+
+        :param fragment_name: Name of the fragment
+        :param vary_on: Additional values the fragment depends on
+        :return: Cache key
+        :rtype: str
+        """
+        return "fragment|" + "|".join([str(fragment_name)] + [str(value) for value in vary_on])
+
+    def _cache_fragment(self, timeout, fragment_name, vary_on, caller):
+        cache = self.environment.nemo_fragment_cache
+        if cache is None:
+            return caller()
+        key = self.make_key(fragment_name, vary_on)
+        value = cache.get(key)
+        if value is None:
+            value = caller()
+            cache.set(key, value, timeout=timeout or None)
+        return value
+
+
+class FrozenTemplateLoader(BaseLoader):
+    """ Template loader resolving once, at startup, every template name of each namespace to its file.
+
+    Lookups are then dictionary accesses : no template directory is listed nor stat-ed when a template is \
+    requested and templates are always considered up to date. Templates added or modified after the creation \
+    of the loader are not taken into account until the application is restarted.
+
+    :param namespaces: Dictionary of namespaces and list of directories, from the most to the least important
+    :type namespaces: {str: [str]}
+    :param delimiter: Delimiter between namespace and template name
+    :type delimiter: str
+    :param encoding: Encoding of the template files
+    :type encoding: str
+    """
+    def __init__(self, namespaces, delimiter="::", encoding="utf-8"):
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.__mapping__ = dict()
+        for namespace, directories in namespaces.items():
+            for directory in directories:
+                for root, _, files in os.walk(directory, followlinks=True):
+                    for filename in files:
+                        path = op.join(root, filename)
+                        name = namespace + delimiter + op.relpath(path, directory).replace(op.sep, "/")
+                        # Most important directories come first : they are not overridden
+                        self.__mapping__.setdefault(name, path)
+
+    def get_source(self, environment, template):
+        if template not in self.__mapping__:
+            raise TemplateNotFound(template)
+        filename = self.__mapping__[template]
+        with open(filename, encoding=self.encoding) as f:
+            source = f.read()
+        return source, filename, lambda: True
+
+    def list_templates(self):
+        return sorted(self.__mapping__.keys())
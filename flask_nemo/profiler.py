@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+    Profiler
+    ====
+
+    Opt-in profiling of single requests, broken down by stage of Nemo (resolver, chunker, transform, plugin render \
+    and Jinja), written as collapsed stacks for flamegraph tools
+"""
+
+import os
+import os.path as op
+import sys
+import hmac
+import threading
+from collections import Counter, OrderedDict
+from time import perf_counter, strftime
+
+from flask import request, make_response
+
+
+class RequestProfiler(object):
+    """ Sampling profiler of single requests. A request is profiled when it carries the token of the profiler, \
+    either in a header or in a query parameter. Profiled requests bypass the response cache.
+
+    While the request is handled, the stack of its thread is sampled every interval. Each sample is attributed to \
+    the innermost stage found in its stack, which is written as the root frame of the collapsed stacks \
+    (:code:`stage;frame;frame count`, one line per distinct stack) so that flamegraph.pl or speedscope group \
+    samples by stage. The duration of each stage is sent back in a Server-Timing header and the path of the file \
+    in the header of the profiler.
+
+    .. note:: When Nemo has no profiler, views are not wrapped at all : requests pay nothing.
+
+    :param path: Directory in which profiles are written
+    :type path: str
+    :param token: Secret the request must send to be profiled
+    :type token: str
+    :param header: Header carrying the token
+    :type header: str
+    :param parameter: Query parameter carrying the token
+    :type parameter: str
+    :param interval: Time between two samples, in seconds
+    :type interval: float
+
+    :Example:
+
+    .. code-block:: python
+
+        nemo = Nemo(resolver=resolver, profiler=RequestProfiler("/tmp/profiles", token="s3cr3t"))
+        # curl -H "X-Nemo-Profile: s3cr3t" http://localhost:5000/text/urn:cts:latinLit:phi1294.phi002/passage/1.1
+        # flamegraph.pl /tmp/profiles/*.folded > profile.svg
+    """
+    STAGES = ("resolver", "chunker", "transform", "plugin", "jinja")
+    MODULES = OrderedDict([
+        ("MyCapytain.resolvers", "resolver"),
+        ("MyCapytain.retrievers", "resolver"),
+        ("flask_nemo.retrievers", "resolver"),
+        ("flask_nemo.chunker", "chunker"),
+        ("flask_nemo.transform", "transform"),
+        ("jinja2", "jinja"),
+        ("flask.templating", "jinja")
+    ])
+    #: Modules whose frames are attributed to a stage only when no other stage is found in the stack, such as \
+    #: text objects read by Nemo after the resolver returned them or exported by transformations
+    FALLBACK_MODULES = OrderedDict([
+        ("MyCapytain.resources", "resolver")
+    ])
+
+    def __init__(self, path, token, header="X-Nemo-Profile", parameter="nemo-profile", interval=0.001):
+        if not token:
+            raise ValueError("RequestProfiler requires a token")
+        self.path = path
+        self.token = token
+        self.header = header
+        self.parameter = parameter
+        self.interval = interval
+        self.__codes__ = dict()
+        self.__modules__ = OrderedDict(type(self).MODULES)
+        self.__lock__ = threading.Lock()
+        self.__count__ = 0
+
+    def attach(self, nemo):
+        """ Register the functions of a Nemo instance and of its plugins marking each stage
+
+        :param nemo: Nemo instance
+        :type nemo: flask_nemo.Nemo
+        """
+        codes = {
+            type(nemo).chunk.__code__: "chunker",
+            type(nemo).transform.__code__: "transform",
+            type(nemo).export_passage.__code__: "transform"
+        }
+        for chunker in nemo.chunker.values():
+            if hasattr(chunker, "__code__"):
+                codes[chunker.__code__] = "chunker"
+        for transform in nemo._transform.values():
+            if hasattr(transform, "__code__"):
+                codes[transform.__code__] = "transform"
+        for plugin in nemo.plugins.values():
+            if hasattr(type(plugin), "render") and hasattr(type(plugin).render, "__code__"):
+                codes[type(plugin).render.__code__] = "plugin"
+        self.__codes__ = codes
+        module = type(nemo.resolver).__module__
+        if module not in self.__modules__:
+            self.__modules__[module] = "resolver"
+
+    def requested(self):
+        """ Check whether the current request asks to be profiled with the right token
+
+        :rtype: bool
+        """
+        token = request.headers.get(self.header) or request.args.get(self.parameter)
+        return token is not None and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def view(self, view, profiled):
+        """ Wrap a view so that requests carrying the token are profiled
+
+        :param view: View function serving requests
+        :type view: function
+        :param profiled: View function run for profiled requests
+        :type profiled: function
+        :rtype: function
+        """
+        def profiling(**kwargs):
+            if not self.requested():
+                return view(**kwargs)
+            return self.profile(profiled, kwargs)
+        return profiling
+
+    def stage(self, frame):
+        """ Retrieve the stage a frame belongs to
+
+        :param frame: Frame
+        :return: Stage or None, and whether the stage is a fallback one
+        :rtype: (str, bool)
+        """
+        stage = self.__codes__.get(frame.f_code)
+        if stage is not None:
+            return stage, False
+        module = frame.f_globals.get("__name__")
+        if module is None:
+            # Code of compiled templates
+            return "jinja", False
+        for prefix, stage in self.__modules__.items():
+            if module.startswith(prefix):
+                return stage, False
+        for prefix, stage in type(self).FALLBACK_MODULES.items():
+            if module.startswith(prefix):
+                return stage, True
+        return None, False
+
+    def sample(self, ident, root, stop, samples):
+        """ Sample the stack of a thread until stopped
+
+        :param ident: Identifier of the thread
+        :param root: Code of the outermost frame to record
+        :param stop: Event stopping the sampling
+        :type stop: threading.Event
+        :param samples: Counter of stacks, as tuples of (stage, frames)
+        :type samples: collections.Counter
+        """
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(ident)
+            stack, stage, fallback = [], None, None
+            while frame is not None:
+                if stage is None:
+                    current, weak = self.stage(frame)
+                    if not weak:
+                        stage = current
+                    elif fallback is None:
+                        fallback = current
+                stack.append(frame.f_code)
+                if frame.f_code is root:
+                    break
+                frame = frame.f_back
+            samples[(stage or fallback or "other", tuple(reversed(stack)))] += 1
+
+    def profile(self, view, kwargs):
+        """ Profile a view
+
+        :param view: View function
+        :type view: function
+        :param kwargs: Parameters of the view
+        :type kwargs: dict
+        :return: Response of the view, with Server-Timing and profile headers
+        :rtype: flask.Response
+        """
+        samples, stop = Counter(), threading.Event()
+        sampler = threading.Thread(
+            target=self.sample,
+            args=(threading.get_ident(), sys._getframe().f_code, stop, samples),
+            daemon=True
+        )
+        start = perf_counter()
+        sampler.start()
+        try:
+            response = make_response(view(**kwargs))
+        finally:
+            stop.set()
+            sampler.join()
+        duration = perf_counter() - start
+
+        stages = self.stages(samples, duration)
+        response.headers["Server-Timing"] = ", ".join(
+            "{};dur={:.1f}".format(stage, milliseconds) for stage, milliseconds in stages.items()
+        )
+        response.headers[self.header] = op.basename(self.write(request.endpoint, samples))
+        return response
+
+    def stages(self, samples, duration):
+        """ Estimate the duration of each stage from samples
+
+        :param samples: Counter of stacks
+        :type samples: collections.Counter
+        :param duration: Duration of the request, in seconds
+        :type duration: float
+        :return: Duration per stage in milliseconds, the total being under the key total
+        :rtype: OrderedDict
+        """
+        counts = Counter()
+        for (stage, _), count in samples.items():
+            counts[stage] += count
+        total = sum(counts.values())
+        stages = OrderedDict()
+        for stage in type(self).STAGES + ("other", ):
+            if counts[stage]:
+                stages[stage] = duration * 1000 * counts[stage] / total
+        stages["total"] = duration * 1000
+        return stages
+
+    @staticmethod
+    def label(code):
+        """ Name of a frame in collapsed stacks
+
+        :param code: Code of the frame
+        :rtype: str
+        """
+        return "{} ({}:{})".format(
+            getattr(code, "co_qualname", code.co_name), op.basename(code.co_filename), code.co_firstlineno
+        ).replace(";", ":").replace(" ", "_")
+
+    def write(self, endpoint, samples):
+        """ Write samples as collapsed stacks
+
+        :param endpoint: Endpoint of the profiled request
+        :type endpoint: str
+        :param samples: Counter of stacks
+        :type samples: collections.Counter
+        :return: Path of the file
+        :rtype: str
+        """
+        with self.__lock__:
+            self.__count__ += 1
+            count = self.__count__
+        os.makedirs(self.path, exist_ok=True)
+        path = op.join(self.path, "{}-{}-{}-{}.folded".format(
+            strftime("%Y%m%d%H%M%S"), os.getpid(), count, (endpoint or "view").replace(".", "-")
+        ))
+        with open(path, "w") as f:
+            for (stage, stack), count in samples.most_common():
+                f.write("{};{} {}\n".format(stage, ";".join(self.label(code) for code in stack), count))
+        return path
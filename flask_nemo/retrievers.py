@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+    Retrievers
+    ====
+
+    CTS API retrievers keeping a local copy of the responses of the API
+"""
+
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+from requests import Request
+from requests.exceptions import HTTPError
+from requests_cache import CachedSession
+from MyCapytain.retrievers.cts5 import HttpCtsRetriever
+
+from flask_nemo.errors import CircuitOpenError
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker of an upstream API. The circuit opens when the ratio of failed requests over the last \
+    window of time reaches the threshold : requests are then rejected without being sent until the cooldown is \
+    over. A single trial request is then let through (half-open state) : its success closes the circuit, its \
+    failure opens it again.
+
+    :param threshold: Ratio of failed requests opening the circuit
+    :type threshold: float
+    :param window: Duration over which requests are counted, in seconds
+    :type window: float
+    :param minimum: Minimum number of requests in the window before the circuit can open
+    :type minimum: int
+    :param cooldown: Time during which an open circuit rejects requests, in seconds
+    :type cooldown: float
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, threshold=0.5, window=30, minimum=10, cooldown=30):
+        self.threshold = threshold
+        self.window = window
+        self.minimum = minimum
+        self.cooldown = cooldown
+        self.__outcomes__ = deque()
+        self.__opened__ = None
+        self.__trial__ = False
+        self.__lock__ = threading.Lock()
+        self.__stats__ = dict(opened=0, rejected=0)
+
+    @property
+    def state(self):
+        """ State of the circuit : closed, open or half-open
+
+        :rtype: str
+        """
+        with self.__lock__:
+            return self._state()
+
+    def _state(self):
+        if self.__opened__ is None:
+            return type(self).CLOSED
+        if monotonic() - self.__opened__ < self.cooldown:
+            return type(self).OPEN
+        return type(self).HALF_OPEN
+
+    def allow(self):
+        """ Check whether a request can be sent upstream. In the half-open state, only one trial request is allowed
+
+        :rtype: bool
+        """
+        with self.__lock__:
+            state = self._state()
+            if state == type(self).CLOSED or (state == type(self).HALF_OPEN and not self.__trial__):
+                self.__trial__ = state == type(self).HALF_OPEN
+                return True
+            self.__stats__["rejected"] += 1
+            return False
+
+    def release(self):
+        """ Give back the trial of a half-open circuit when the allowed request was not sent upstream, for example \
+        because it was answered by a cache
+        """
+        with self.__lock__:
+            self.__trial__ = False
+
+    def record(self, success):
+        """ Record the outcome of a request sent upstream
+
+        :param success: Whether the API answered
+        :type success: bool
+        """
+        with self.__lock__:
+            now = monotonic()
+            if self.__opened__ is not None:
+                if self._state() == type(self).HALF_OPEN:
+                    self.__trial__ = False
+                    if success:
+                        self.__opened__ = None
+                        self.__outcomes__.clear()
+                    else:
+                        self.__opened__ = now
+                return
+            self.__outcomes__.append((now, success))
+            while self.__outcomes__ and self.__outcomes__[0][0] < now - self.window:
+                self.__outcomes__.popleft()
+            failures = sum(1 for _, outcome in self.__outcomes__ if not outcome)
+            if len(self.__outcomes__) >= self.minimum and failures / len(self.__outcomes__) >= self.threshold:
+                self.__opened__ = now
+                self.__stats__["opened"] += 1
+
+    def statistics(self):
+        """ Retrieve the state of the circuit, the number of times it opened and the number of rejected requests
+
+        :rtype: dict
+        """
+        with self.__lock__:
+            statistics = dict(self.__stats__)
+            statistics["state"] = self._state()
+            return statistics
+
+
+class CachedHttpCtsRetriever(HttpCtsRetriever):
+    """ CTS API retriever storing responses in a local HTTP cache (requests_cache), so that GetCapabilities, \
+    GetValidReff or GetPassage requests are sent upstream once per time-to-live.
+
+    With stale_while_revalidate, responses expired for less than this time are served from the cache while a \
+    single background request per response refreshes them. With a circuit breaker, requests are not sent upstream \
+    while the API fails : expired responses are served when stale_if_error is set, other requests fail fast with \
+    a :class:`flask_nemo.errors.CircuitOpenError`.
+
+    :param endpoint: URL of the API
+    :type endpoint: str
+    :param inventory: Inventory to use
+    :type inventory: str
+    :param cache_name: Path of the SQLite database or of the directory holding the cache
+    :type cache_name: str
+    :param backend: Storage of the cache : sqlite, filesystem or any requests_cache backend (eg. memory)
+    :type backend: str
+    :param expire_after: Time-to-live of responses in seconds, -1 for no expiration
+    :type expire_after: int
+    :param stale_if_error: Serve expired responses when the API fails
+    :type stale_if_error: bool
+    :param session: Session to use instead of a new requests_cache.CachedSession
+    :type session: requests_cache.CachedSession
+    :param stale_while_revalidate: Time after expiration during which responses are served while being refreshed \
+    in the background, in seconds. True serves expired responses whatever their age (Default: 0, expired responses \
+    are refreshed before being served)
+    :type stale_while_revalidate: int|bool
+    :param breaker: Circuit breaker of the API. True creates a default CircuitBreaker (Default: None)
+    :type breaker: bool|CircuitBreaker
+    :param timeout: Maximum time waited for the API, in seconds (Default: None, no timeout)
+    :type timeout: float
+
+    :Example:
+
+    .. code-block:: python
+
+        nemo = Nemo(
+            resolver=HttpCtsResolver(
+                CachedHttpCtsRetriever("https://cts.perseids.org/api/cts/", cache_name="/var/cache/nemo/cts")
+            )
+        )
+    """
+    def __init__(self, endpoint, inventory=None, cache_name="nemo-cts-cache", backend="sqlite",
+                 expire_after=86400, stale_if_error=True, session=None, stale_while_revalidate=0, breaker=None,
+                 timeout=None):
+        super(CachedHttpCtsRetriever, self).__init__(endpoint, inventory=inventory)
+        if session is None:
+            session = CachedSession(
+                cache_name,
+                backend=backend,
+                expire_after=expire_after,
+                stale_if_error=stale_if_error,
+                allowable_methods=("GET", )
+            )
+        self.session = session
+        self.stale_while_revalidate = stale_while_revalidate
+        if breaker is True:
+            breaker = CircuitBreaker()
+        self.breaker = breaker or None
+        self.timeout = timeout
+        self.__lock__ = threading.Lock()
+        self.__revalidating__ = set()
+        self.__stats__ = dict(requests=0, hits=0, misses=0, stale=0, errors=0)
+
+    def call(self, parameters):
+        """ Call the endpoint given the parameters, through the local cache
+
+        :param parameters: Dictionary of parameters
+        :type parameters: dict
+        :rtype: text
+        :raises CircuitOpenError: When the circuit breaker is open and the response is not cached
+        """
+        parameters = {
+            key: str(parameters[key]) for key in parameters if parameters[key] is not None
+        }
+        if self.inventory is not None and "inv" not in parameters:
+            parameters["inv"] = self.inventory
+        if not self.stale_while_revalidate and self.breaker is None:
+            return self.fetch(parameters)
+
+        key, cached = self.cached(parameters)
+        if cached is not None and not cached.is_expired:
+            self._count("hits")
+            return self.text(cached)
+        if cached is not None and self.revalidable(cached):
+            self._count("stale")
+            self.revalidate(key, parameters)
+            return self.text(cached)
+        if self.breaker is not None and not self.breaker.allow():
+            if cached is not None and self.session.settings.stale_if_error:
+                self._count("stale")
+                return self.text(cached)
+            self._count("errors")
+            raise CircuitOpenError("Circuit to {} is open".format(self.endpoint))
+        return self.fetch(parameters)
+
+    def fetch(self, parameters, **kwargs):
+        """ Send a request through the local cache, serving an expired response if the API fails and \
+        stale_if_error is set
+
+        :param parameters: Dictionary of parameters
+        :type parameters: dict
+        :param kwargs: Options of the request (eg. force_refresh)
+        :rtype: text
+        """
+        try:
+            request = self.session.get(self.endpoint, params=parameters, timeout=self.timeout, **kwargs)
+            request.raise_for_status()
+        except Exception as E:
+            self._count("errors")
+            # Errors answered by the API (eg. an unknown URN) do not count as failures of the API
+            self._record(isinstance(E, HTTPError) and E.response is not None and E.response.status_code < 500)
+            raise
+        if not getattr(request, "from_cache", False):
+            self._count("misses")
+            self._record(True)
+        elif getattr(request, "is_expired", False):
+            self._count("stale")
+            self._record(False)
+        else:
+            self._count("hits")
+            if self.breaker is not None:
+                self.breaker.release()
+        return self.text(request)
+
+    @staticmethod
+    def text(response):
+        """ Decode the body of a response
+
+        :param response: Response
+        :rtype: str
+        """
+        if response.encoding is None:
+            response.encoding = "utf-8"
+        return response.text
+
+    def cached(self, parameters):
+        """ Read the response of a request from the local cache, without sending it
+
+        :param parameters: Dictionary of parameters
+        :type parameters: dict
+        :return: Key of the request and cached response (None if not cached)
+        :rtype: (str, requests_cache.CachedResponse)
+        """
+        key = self.session.cache.create_key(
+            self.session.prepare_request(Request("GET", self.endpoint, params=parameters))
+        )
+        return key, self.session.cache.get_response(key)
+
+    def revalidable(self, cached):
+        """ Check whether an expired response can be served while it is refreshed
+
+        :param cached: Expired response
+        :type cached: requests_cache.CachedResponse
+        :rtype: bool
+        """
+        if self.stale_while_revalidate is True:
+            return True
+        if not self.stale_while_revalidate:
+            return False
+        return datetime.now(timezone.utc) < cached.expires + timedelta(seconds=self.stale_while_revalidate)
+
+    def revalidate(self, key, parameters):
+        """ Refresh a cached response in a background thread, unless it is already being refreshed or the \
+        circuit breaker is open
+
+        :param key: Key of the request
+        :type key: str
+        :param parameters: Dictionary of parameters
+        :type parameters: dict
+        :return: Thread refreshing the response, if any
+        :rtype: threading.Thread
+        """
+        with self.__lock__:
+            if key in self.__revalidating__:
+                return None
+            self.__revalidating__.add(key)
+        if self.breaker is not None and not self.breaker.allow():
+            with self.__lock__:
+                self.__revalidating__.discard(key)
+            return None
+
+        def refresh():
+            try:
+                self.fetch(parameters, force_refresh=True)
+            except Exception:
+                pass
+            finally:
+                with self.__lock__:
+                    self.__revalidating__.discard(key)
+        thread = threading.Thread(target=refresh, daemon=True)
+        thread.start()
+        return thread
+
+    def _record(self, success):
+        if self.breaker is not None:
+            self.breaker.record(success)
+
+    def _count(self, counter):
+        with self.__lock__:
+            self.__stats__["requests"] += 1
+            self.__stats__[counter] += 1
+
+    def statistics(self):
+        """ Retrieve counters of the retriever
+
+        :return: Dictionary with requests, hits, misses, stale (Expired responses served because the API failed) \
+        and errors keys
+        :rtype: dict
+        """
+        with self.__lock__:
+            return dict(self.__stats__)
+
+    def clear(self):
+        """ Remove every response from the local cache
+        """
+        self.session.cache.clear()
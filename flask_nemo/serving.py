@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+    Serving
+    ====
+
+    Multi-process and multi-thread HTTP server for production deployments from the command line. The application \
+    is prepared once in a parent process, which then forks its workers : the parsed corpus and the inventory are \
+    shared copy-on-write between workers.
+"""
+
+import os
+import gc
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """ WSGI server handling requests in a bounded pool of threads. Connections waiting for a thread are bounded \
+    as well : when max_queue connections are already waiting, the server stops accepting new ones for up to \
+    queue_timeout seconds, leaving them in the backlog of the socket, then answers them with a 503.
+
+    :param host: Host to bind to
+    :type host: str
+    :param port: Port to bind to
+    :type port: int
+    :param app: WSGI application
+    :param threads: Number of threads handling requests
+    :type threads: int
+    :param fd: File descriptor of an already bound socket
+    :type fd: int
+    :param max_queue: Maximum number of accepted connections waiting for a thread (Default: 4 per thread)
+    :type max_queue: int
+    :param queue_timeout: Time to wait for room in the queue before refusing a connection, in seconds
+    :type queue_timeout: float
+    """
+    REFUSED = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+
+    def __init__(self, host, port, app, threads=1, fd=None, max_queue=None, queue_timeout=1.0):
+        super(PooledWSGIServer, self).__init__(host, port, app, fd=fd)
+        self.threads = threads
+        self.multithread = threads > 1
+        self.max_queue = threads * 4 if max_queue is None else max_queue
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(threads + self.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self.refuse(request)
+            return
+        try:
+            self.executor.submit(self.process_request_thread, request, client_address)
+        except RuntimeError:
+            # The executor is shut down
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def refuse(self, request):
+        """ Answer a connection with a 503 and close it
+
+        :param request: Accepted connection
+        :type request: socket.socket
+        """
+        try:
+            request.sendall(type(self).REFUSED)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super(PooledWSGIServer, self).server_close()
+        self.executor.shutdown(wait=False)
+
+
+class PreforkServer(object):
+    """ Server binding its socket and preparing the application in a parent process before forking workers, \
+    each of them handling requests in a pool of threads. Dead workers are replaced, and SIGTERM or SIGINT stop \
+    every worker.
+
+    .. warning:: Connections opened before the fork (databases, HTTP sessions) are shared by every worker. \
+    Nemo stores open their connections lazily and per thread, so preloading the inventory is safe.
+
+    :param app: WSGI application
+    :param host: Host to bind to
+    :type host: str
+    :param port: Port to bind to
+    :type port: int
+    :param workers: Number of worker processes. With a single worker, requests are handled in the current process
+    :type workers: int
+    :param threads: Number of threads per worker
+    :type threads: int
+    :param preload: Function called in the parent process before forking
+    :type preload: function
+    :param post_fork: Function called in each worker before it serves requests, such as the start of background \
+    threads, which do not survive a fork
+    :type post_fork: function
+    """
+    def __init__(self, app, host="127.0.0.1", port=8000, workers=1, threads=1, preload=None, post_fork=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.preload = preload
+        self.post_fork = post_fork
+        self.socket = None
+        self.server = None
+        self.children = set()
+        self.running = False
+
+    def bind(self):
+        """ Bind the listening socket shared by every worker
+
+        :return: Bound socket
+        :rtype: socket.socket
+        """
+        self.socket = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(128)
+        self.port = self.socket.getsockname()[1]
+        return self.socket
+
+    def prepare(self):
+        """ Bind the socket and run the preload function. Objects created so far are moved out of the reach of \
+        the garbage collector, so that collections in workers do not copy their memory pages
+        """
+        if self.socket is None:
+            self.bind()
+        if self.preload is not None:
+            self.preload()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+    def make_server(self):
+        """ Create the server of a worker
+
+        :rtype: PooledWSGIServer
+        """
+        return PooledWSGIServer(self.host, self.port, self.app, threads=self.threads, fd=self.socket.fileno())
+
+    def spawn(self):
+        """ Fork a worker
+
+        :return: Process identifier of the worker
+        :rtype: int
+        """
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                if self.post_fork is not None:
+                    self.post_fork()
+                self.make_server().serve_forever()
+            finally:
+                os._exit(0)
+        self.children.add(pid)
+        return pid
+
+    def stop(self, *args):
+        """ Stop the workers, or the server when there is a single worker.
+
+        .. note:: With a single worker, stop() should be called from another thread than the serving one
+        """
+        self.running = False
+        if self.server is not None:
+            self.server.shutdown()
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.discard(pid)
+
+    def serve_forever(self):
+        """ Prepare the application and serve requests until stopped
+        """
+        self.prepare()
+        self.running = True
+        if self.workers <= 1 or not hasattr(os, "fork"):
+            if self.post_fork is not None:
+                self.post_fork()
+            self.server = self.make_server()
+            try:
+                self.server.serve_forever()
+            finally:
+                self.server.server_close()
+            return
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.children.discard(pid)
+            if self.running:
+                self.spawn()
+        self.socket.close()
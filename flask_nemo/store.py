@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+    Persistent stores
+    ====
+
+    On-disk storage of data which is expensive to compute and fully determined by the source of a text, so that it
+    survives a restart of the application
+"""
+
+import os
+import os.path as op
+import json
+import gzip
+import sqlite3
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
+
+from flask_nemo.common import callable_fingerprint
+from flask_nemo.filters import f_hierarchical_passages
+
+
+_CHECKSUMS = dict()
+
+
+def file_checksum(path):
+    """ Compute the checksum of a file, reusing the previous checksum as long as the modification time and size \
+    of the file do not change
+
+    :param path: Path of the file
+    :type path: str
+    :return: Hexadecimal SHA1 of the file or None if it does not exist
+    :rtype: str
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if path in _CHECKSUMS and _CHECKSUMS[path][0] == signature:
+        return _CHECKSUMS[path][1]
+    digest = sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            digest.update(block)
+    _CHECKSUMS[path] = (signature, digest.hexdigest())
+    return _CHECKSUMS[path][1]
+
+
+def source_checksum(text):
+    """ Compute the checksum of the source file of a text, when the resolver exposes it (Local resolvers set a \
+    `path` attribute on text metadata)
+
+    :param text: Text metadata object
+    :type text: MyCapytain.resources.prototypes.cts.inventory.CtsTextMetadata
+    :return: Hexadecimal SHA1 of the source file or None if the source is not available
+    :rtype: str
+    """
+    path = getattr(text, "path", None)
+    if not path:
+        return None
+    return file_checksum(path)
+
+
+class ReferenceStore(object):
+    """ Persistent store of reference tables : deepest level references, chunker output, hierarchy of chunked \
+    references and citation metadata of each text are written to a compact gzipped JSON file so that a restarted \
+    application does not recompute them.
+
+    Tables are loaded lazily, the first time a text is requested, and are validated against the checksum of \
+    the text source and its citation scheme. Texts which do not expose their source (such as texts retrieved \
+    through a CTS API) are validated on their citation scheme only.
+
+    :param path: Directory in which tables are stored
+    :type path: str
+
+    :Example:
+
+    .. code-block:: python
+
+        nemo = Nemo(
+            resolver=CtsCapitainsLocalResolver(["/opt/corpora/latinLit"]),
+            reference_store=ReferenceStore("/var/cache/nemo/references")
+        )
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__tables__ = dict()
+        self.__lock__ = threading.RLock()
+
+    def filename(self, objectId):
+        """ Get the path of the file holding the tables of a text
+
+        :param objectId: Text identifier
+        :type objectId: str
+        :return: Path of the file
+        :rtype: str
+        """
+        key = sha1(str(objectId).encode()).hexdigest()
+        return op.join(self.path, key[:2], key + ".json.gz")
+
+    def table(self, text):
+        """ Retrieve the tables of a text, loading them from disk if needed
+
+        :param text: Text metadata object
+        :type text: MyCapytain.resources.prototypes.cts.inventory.CtsTextMetadata
+        :return: Dictionary with checksum, citation, reffs, chunks and hierarchies keys
+        :rtype: dict
+        """
+        objectId = str(text.id)
+        with self.__lock__:
+            if objectId in self.__tables__:
+                return self.__tables__[objectId]
+
+            checksum, citation = source_checksum(text), [citation.name for citation in text.citation]
+            table = self.read(objectId)
+            if table is None or table["checksum"] != checksum or table["citation"] != citation:
+                table = {
+                    "objectId": objectId,
+                    "checksum": checksum,
+                    "citation": citation,
+                    "reffs": OrderedDict(),
+                    "chunks": OrderedDict(),
+                    "hierarchies": OrderedDict()
+                }
+            self.__tables__[objectId] = table
+            return table
+
+    def read(self, objectId):
+        """ Read the tables of a text from disk
+
+        :param objectId: Text identifier
+        :type objectId: str
+        :return: Tables or None if they do not exist or are unreadable
+        :rtype: dict
+        """
+        try:
+            with gzip.open(self.filename(objectId), "rt", encoding="utf-8") as f:
+                return json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, table):
+        """ Write atomically the tables of a text to disk
+
+        :param table: Tables of a text
+        :type table: dict
+        """
+        filename = self.filename(table["objectId"])
+        os.makedirs(op.dirname(filename), exist_ok=True)
+        with NamedTemporaryFile(dir=op.dirname(filename), delete=False) as f:
+            with gzip.GzipFile(fileobj=f, mode="wb") as compressed:
+                compressed.write(json.dumps(table, separators=(",", ":")).encode("utf-8"))
+        os.replace(f.name, filename)
+
+    def reffs(self, text, level, getreffs):
+        """ Retrieve the references of a text at a given level
+
+        :param text: Text metadata object
+        :param level: Citation level
+        :type level: int
+        :param getreffs: Callback retrieving references for a level when they are not stored
+        :type getreffs: function(level)
+        :return: List of references
+        :rtype: [str]
+        """
+        table = self.table(text)
+        level = str(level)
+        if level not in table["reffs"]:
+            references = [str(reff) for reff in getreffs(level=int(level))]
+            with self.__lock__:
+                table["reffs"][level] = references
+                self.write(table)
+        return table["reffs"][level]
+
+    def chunks(self, text, chunker, getreffs, fingerprint=None):
+        """ Retrieve the output of a chunker for a text. Only the output of the latest chunker is kept : the \
+        output of chunkers with another fingerprint is dropped when a new one is written.
+
+        :param text: Text metadata object
+        :param chunker: Chunker function
+        :type chunker: function(text, getreffs)
+        :param getreffs: Callback retrieving references for a level when they are not stored
+        :type getreffs: function(level)
+        :param fingerprint: Fingerprint of the chunker (Default: fingerprint of its code)
+        :type fingerprint: str
+        :return: List of chunked references with their human readable version
+        :rtype: [(str, str)]
+        """
+        table = self.table(text)
+        key = fingerprint or callable_fingerprint(chunker)
+        if key not in table["chunks"]:
+            chunks = chunker(text, lambda level: self.reffs(text, level, getreffs))
+            with self.__lock__:
+                table["chunks"] = OrderedDict([(key, [list(chunk) for chunk in chunks])])
+                self.prune(table, "hierarchies", key)
+                self.write(table)
+        return [tuple(chunk) for chunk in table["chunks"][key]]
+
+    def hierarchy(self, text, chunker, getreffs, fingerprint=None):
+        """ Retrieve the hierarchy of the chunked references of a text, as built by \
+        flask_nemo.filters.f_hierarchical_passages
+
+        :param text: Text metadata object
+        :param chunker: Chunker function
+        :type chunker: function(text, getreffs)
+        :param getreffs: Callback retrieving references for a level when they are not stored
+        :type getreffs: function(level)
+        :param fingerprint: Fingerprint of the chunker (Default: fingerprint of its code)
+        :type fingerprint: str
+        :return: Nested dictionary where keys are levels and final values passage references
+        :rtype: OrderedDict
+        """
+        table = self.table(text)
+        key = fingerprint or callable_fingerprint(chunker)
+        if key not in table.setdefault("hierarchies", OrderedDict()):
+            hierarchy = f_hierarchical_passages(self.chunks(text, chunker, getreffs, fingerprint=key), text.citation)
+            with self.__lock__:
+                table["hierarchies"][key] = hierarchy
+                self.prune(table, "hierarchies", key)
+                self.write(table)
+        return table["hierarchies"][key]
+
+    @staticmethod
+    def prune(table, name, key):
+        """ Drop the entries of a table which were computed by another chunker
+
+        :param table: Tables of a text
+        :type table: dict
+        :param name: Name of the table
+        :type name: str
+        :param key: Fingerprint of the chunker to keep
+        :type key: str
+        """
+        table[name] = OrderedDict(
+            (fingerprint, value) for fingerprint, value in table.get(name, {}).items() if fingerprint == key
+        )
+
+    def invalidate(self, objectId):
+        """ Remove the tables of a text from memory and disk
+
+        :param objectId: Text identifier
+        :type objectId: str
+        """
+        with self.__lock__:
+            self.__tables__.pop(str(objectId), None)
+            try:
+                os.remove(self.filename(objectId))
+            except OSError:
+                pass
+
+
+class StoredPassage(object):
+    """ Passage read from a PassageStore. It exposes the metadata methods Nemo uses on passages retrieved \
+    from a resolver.
+
+    :param html: Transformed passage
+    :type html: str
+    :param metadata: Title, creator and description of the passage per lang
+    :type metadata: {str: {str: str}}
+    :param siblings: Previous and next references of the passage
+    :type siblings: (str, str)
+    """
+    def __init__(self, html, metadata, siblings):
+        self.html = html
+        self.metadata = metadata
+        self.siblingsId = tuple(siblings)
+
+    def _get_metadata(self, key, lang):
+        values = self.metadata.get(key, {})
+        if lang in values:
+            return values[lang]
+        return values.get("")
+
+    def get_title(self, lang=None):
+        return self._get_metadata("title", lang)
+
+    def get_creator(self, lang=None):
+        return self._get_metadata("creator", lang)
+
+    def get_description(self, lang=None):
+        return self._get_metadata("description", lang)
+
+    @property
+    def prevId(self):
+        return self.siblingsId[0]
+
+    @property
+    def nextId(self):
+        return self.siblingsId[1]
+
+
+class PassageStore(object):
+    """ Persistent store of transformed passages, keyed by text identifier, reference and fingerprint of the \
+    transformation and of the chunker (see :meth:`flask_nemo.Nemo.passage_fingerprint`). Passages are stored in a \
+    SQLite database in Write-Ahead Logging mode, so that it can be shared by every worker of a node.
+
+    Each passage is stored with the checksum of the source of its text : a passage is discarded when the source \
+    changes. Fingerprints of XSL transformations include the checksum of the stylesheet.
+
+    :param path: Path of the SQLite database
+    :type path: str
+    :param timeout: Time to wait for a lock on the database, in seconds
+    :type timeout: float
+
+    :Example:
+
+    .. code-block:: python
+
+        nemo = Nemo(
+            resolver=CtsCapitainsLocalResolver(["/opt/corpora/latinLit"]),
+            passage_store=PassageStore("/var/cache/nemo/passages.sqlite")
+        )
+    """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS passages (
+        objectId TEXT NOT NULL,
+        subreference TEXT NOT NULL,
+        transform TEXT NOT NULL,
+        checksum TEXT,
+        html TEXT NOT NULL,
+        metadata TEXT NOT NULL,
+        siblings TEXT NOT NULL,
+        PRIMARY KEY (objectId, subreference, transform)
+    )"""
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.__local__ = threading.local()
+        if op.dirname(path):
+            os.makedirs(op.dirname(path), exist_ok=True)
+        with self.connection() as connection:
+            connection.execute(type(self).SCHEMA)
+
+    def connection(self):
+        """ Retrieve the connection of the current thread to the database
+
+        :rtype: sqlite3.Connection
+        """
+        connection = getattr(self.__local__, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local__.connection = connection
+        return connection
+
+    def get(self, text, subreference, transform):
+        """ Retrieve a stored passage
+
+        :param text: Text metadata object
+        :type text: MyCapytain.resources.prototypes.cts.inventory.CtsTextMetadata
+        :param subreference: Reference of the passage
+        :type subreference: str
+        :param transform: Fingerprint of the transformation and of the chunker
+        :type transform: str
+        :return: Stored passage or None if it is not stored or its source changed
+        :rtype: StoredPassage
+        """
+        row = self.connection().execute(
+            "SELECT checksum, html, metadata, siblings FROM passages "
+            "WHERE objectId = ? AND subreference = ? AND transform = ?",
+            (str(text.id), subreference, transform)
+        ).fetchone()
+        if row is None or row[0] != source_checksum(text):
+            return None
+        return StoredPassage(row[1], json.loads(row[2]), json.loads(row[3]))
+
+    def put(self, text, subreference, transform, passage, html, siblings, langs=None):
+        """ Store a transformed passage
+
+        :param text: Text metadata object
+        :type text: MyCapytain.resources.prototypes.cts.inventory.CtsTextMetadata
+        :param subreference: Reference of the passage
+        :type subreference: str
+        :param transform: Fingerprint of the transformation and of the chunker
+        :type transform: str
+        :param passage: Passage retrieved from the resolver
+        :type passage: InteractiveTextualNode
+        :param html: Transformed passage
+        :type html: str
+        :param siblings: Previous and next references of the passage
+        :type siblings: (str, str)
+        :param langs: Languages in which metadata are stored
+        :type langs: [str]
+        :return: Stored passage
+        :rtype: StoredPassage
+        """
+        metadata = {"title": dict(), "creator": dict(), "description": dict()}
+        for lang in [None] + list(langs or []):
+            for key, getter in (
+                    ("title", passage.get_title), ("creator", passage.get_creator),
+                    ("description", passage.get_description)):
+                value = getter(lang)
+                metadata[key][lang or ""] = str(value) if value is not None else None
+        stored = StoredPassage(str(html), metadata, [str(sibling) if sibling else None for sibling in siblings])
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO passages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(text.id), subreference, transform, source_checksum(text),
+                    stored.html, json.dumps(metadata), json.dumps(stored.siblingsId)
+                )
+            )
+        return stored
+
+    def invalidate(self, objectId):
+        """ Remove the passages of a text
+
+        :param objectId: Text identifier
+        :type objectId: str
+        """
+        with self.connection() as connection:
+            connection.execute("DELETE FROM passages WHERE objectId = ?", (str(objectId), ))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+    Transformations
+    ====
+
+    Declaration of the input accepted by transformation functions and execution of XSL transformations outside \
+    of the process serving requests
+"""
+
+import os
+import threading
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from lxml import etree
+
+from flask_nemo.errors import TransformError, TransformTimeout, TransformInputTooLarge
+from flask_nemo.store import file_checksum
+
+
+#: Inputs a transformation can accept : serialized XML, lxml tree or binary file-like object for etree.iterparse
+TRANSFORM_INPUTS = ("string", "etree", "stream")
+
+
+def transform_input(kind):
+    """ Decorator declaring the input a transformation function accepts, so that Nemo exports passages in the \
+    cheapest way for it. Undecorated functions receive an lxml tree.
+
+    :param kind: One of "string" (serialized XML), "etree" (lxml element) or "stream" (binary file-like object \
+    which can be given to etree.iterparse)
+    :type kind: str
+    :return: Decorator
+
+    :Example:
+
+    .. code-block:: python
+
+        @transform_input("string")
+        def as_is(work, xml, objectId, subreference=None):
+            return xml
+
+        nemo = Nemo(transform={"default": as_is})
+    """
+    if kind not in TRANSFORM_INPUTS:
+        raise ValueError("Transform input should be one of {}".format(", ".join(TRANSFORM_INPUTS)))
+
+    def decorator(func):
+        func.transform_input = kind
+        return func
+    return decorator
+
+
+#: Compiled stylesheets of a worker process, by path, with the checksum they were compiled from
+_STYLESHEETS = dict()
+
+
+def _compile(path, checksum):
+    """ Compile a stylesheet in a worker process, unless it is already compiled at the same version
+
+    :param path: Path of the stylesheet
+    :param checksum: Checksum of the stylesheet
+    :return: Compiled stylesheet
+    :rtype: etree.XSLT
+    """
+    if path not in _STYLESHEETS or _STYLESHEETS[path][0] != checksum:
+        with open(path) as f:
+            _STYLESHEETS[path] = (checksum, etree.XSLT(etree.parse(f)))
+    return _STYLESHEETS[path][1]
+
+
+def _prewarm(stylesheets):
+    """ Compile stylesheets when a worker process starts
+
+    :param stylesheets: List of paths and checksums of stylesheets
+    :type stylesheets: [(str, str)]
+    """
+    for path, checksum in stylesheets:
+        _compile(path, checksum)
+
+
+def _ping():
+    """ Task used to start worker processes ahead of the first transformation """
+    return True
+
+
+def _apply(path, checksum, xml):
+    """ Apply a stylesheet in a worker process
+
+    :param path: Path of the stylesheet
+    :param checksum: Checksum of the stylesheet
+    :param xml: Serialized passage
+    :type xml: bytes
+    :return: HTML representation of the transformed passage
+    :rtype: str
+    """
+    return etree.tostring(
+        _compile(path, checksum)(etree.fromstring(xml)),
+        encoding=str, method="html",
+        xml_declaration=None, pretty_print=False, with_tail=True, standalone=None
+    )
+
+
+#: Transform pools of the process, whose executors are dropped in forked children
+_POOLS = weakref.WeakSet()
+
+
+def _after_fork():
+    for pool in list(_POOLS):
+        pool.forked()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class TransformPool(object):
+    """ Pool of worker processes applying XSL stylesheets, so that CPU-heavy transformations do not block the \
+    other threads of the process serving requests.
+
+    Workers are started by each process the first time it transforms a passage, or ahead of it with \
+    :meth:`start`, and compile the stylesheets when they start : a pool created before the workers of a \
+    :class:`flask_nemo.serving.PreforkServer` are forked starts its own workers in each of them. A stylesheet \
+    modified on disk is compiled again the first time it is used.
+
+    When a transformation exceeds its timeout, new transformations are sent to new workers right away, while the \
+    stalled workers finish the other transformations they were given and are then terminated in the background.
+
+    :param stylesheets: Paths of the stylesheets to compile in each worker
+    :type stylesheets: [str]
+    :param workers: Number of worker processes (Default: number of CPUs)
+    :type workers: int
+    :param timeout: Maximum duration of a transformation, in seconds
+    :type timeout: float
+    :param max_input_size: Maximum size of a serialized passage, in bytes (Default: no limit)
+    :type max_input_size: int
+    :param context: Multiprocessing start method
+    :type context: str
+
+    :Example:
+
+    .. code-block:: python
+
+        nemo = Nemo(
+            transform={"default": "/opt/nemo/tei.xsl"},
+            transform_pool=TransformPool(["/opt/nemo/tei.xsl"], workers=4, timeout=10, max_input_size=2**22)
+        )
+    """
+    def __init__(self, stylesheets, workers=None, timeout=30, max_input_size=None, context="spawn"):
+        self.stylesheets = list(stylesheets)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.max_input_size = max_input_size
+        self.context = multiprocessing.get_context(context)
+        self.__executor__ = None
+        self.__pending__ = dict()
+        self.__pid__ = None
+        self.__lock__ = threading.Lock()
+        _POOLS.add(self)
+
+    def __contains__(self, stylesheet):
+        return stylesheet in self.stylesheets
+
+    def forked(self):
+        """ Forget the executor of the parent process in a forked child : its processes and threads belong \
+        to the parent
+        """
+        self.__executor__ = None
+        self.__pending__ = dict()
+        self.__pid__ = None
+        self.__lock__ = threading.Lock()
+
+    def executor(self):
+        """ Retrieve the executor of the current process, creating it when needed
+
+        :rtype: ProcessPoolExecutor
+        """
+        with self.__lock__:
+            if self.__executor__ is None or self.__pid__ != os.getpid():
+                self.__executor__ = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=self.context,
+                    initializer=_prewarm,
+                    initargs=([(path, file_checksum(path)) for path in self.stylesheets], )
+                )
+                self.__pending__ = {self.__executor__: set()}
+                self.__pid__ = os.getpid()
+            return self.__executor__
+
+    def start(self):
+        """ Start the worker processes of the current process and wait for them to compile the stylesheets
+        """
+        for future in [self.submit(_ping)[1] for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, func, *args):
+        """ Run a function in a worker process
+
+        :param func: Function to run
+        :param args: Arguments of the function
+        :return: Executor running the function and its future
+        :rtype: (ProcessPoolExecutor, concurrent.futures.Future)
+        """
+        executor = self.executor()
+        future = executor.submit(func, *args)
+        with self.__lock__:
+            pending = self.__pending__.get(executor)
+        if pending is not None:
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+        return executor, future
+
+    def restart(self, executor, stalled=None):
+        """ Send new transformations to new workers and terminate the workers of an executor in the background, \
+        once the transformations they were given are done or timed out, unless the executor was already replaced
+
+        :param executor: Executor whose workers are stalled
+        :type executor: ProcessPoolExecutor
+        :param stalled: Transformation which timed out, which is not waited for
+        :type stalled: concurrent.futures.Future
+        :return: Thread terminating the workers, if any
+        :rtype: threading.Thread
+        """
+        with self.__lock__:
+            if self.__executor__ is not executor:
+                return None
+            self.__executor__ = None
+            pending = [future for future in self.__pending__.pop(executor, ()) if future is not stalled]
+        thread = threading.Thread(target=self.retire, args=(executor, pending), daemon=True)
+        thread.start()
+        return thread
+
+    def retire(self, executor, pending):
+        """ Terminate the workers of an executor once pending transformations are done or timed out
+
+        :param executor: Executor to terminate
+        :type executor: ProcessPoolExecutor
+        :param pending: Transformations to wait for
+        :type pending: [concurrent.futures.Future]
+        """
+        wait(pending, timeout=self.timeout)
+        # ProcessPoolExecutor does not expose its processes before Python 3.14
+        if hasattr(executor, "terminate_workers"):
+            executor.terminate_workers()
+        else:
+            for process in list((getattr(executor, "_processes", None) or {}).values()):
+                process.terminate()
+            executor.shutdown(wait=False)
+
+    def transform(self, stylesheet, xml):
+        """ Apply a stylesheet to a passage
+
+        :param stylesheet: Path of the stylesheet
+        :type stylesheet: str
+        :param xml: Passage to transform, as a tree or already serialized
+        :type xml: etree._Element|str
+        :return: HTML representation of the transformed passage
+        :rtype: str
+        :raises TransformInputTooLarge: When the serialized passage is bigger than max_input_size
+        :raises TransformTimeout: When the transformation takes longer than timeout
+        :raises TransformError: When the workers crashed or the transformation failed
+        """
+        if isinstance(xml, str):
+            serialized = xml.encode("utf-8")
+        else:
+            serialized = etree.tostring(xml, encoding="utf-8")
+        if self.max_input_size is not None and len(serialized) > self.max_input_size:
+            raise TransformInputTooLarge(
+                "Passage of {} bytes exceeds the maximum of {} bytes".format(len(serialized), self.max_input_size)
+            )
+        executor, future = self.submit(_apply, stylesheet, file_checksum(stylesheet), serialized)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.restart(executor, future)
+            raise TransformTimeout("Transformation took longer than {} seconds".format(self.timeout))
+        except BrokenProcessPool:
+            self.restart(executor, future)
+            raise TransformError("Transform workers stopped during the transformation")
+        except etree.Error as E:
+            raise TransformError(str(E))
+
+    def close(self):
+        """ Stop the worker processes
+        """
+        with self.__lock__:
+            executor, self.__executor__ = self.__executor__, None
+            self.__pending__ = dict()
+        if executor is not None and self.__pid__ == os.getpid():
+            executor.shutdown(wait=True)
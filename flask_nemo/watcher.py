@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+    Watcher
+    ====
+
+    Polling of the files of a local corpus : texts whose file or metadata changed are reloaded and their cached \
+    entries invalidated, without restarting the application nor flushing the caches of other texts
+"""
+
+import os
+import os.path as op
+import threading
+import logging
+
+
+class CorpusWatcher(object):
+    """ Watcher of the files of the texts of a Nemo instance backed by a local resolver. Each text is watched \
+    through its own file and the __cts__.xml file of its work : a change of the latter reloads every text of the work.
+
+    Files are compared by modification time and size at each check, in a background thread started with \
+    :meth:`start`. Changed texts are handed to :meth:`flask_nemo.Nemo.invalidate`.
+
+    .. note:: Each process runs its own watcher : when workers are forked, start the watcher in each of them \
+    (for example with :code:`PreforkServer(app, post_fork=watcher.start)`)
+
+    :param nemo: Nemo instance, registered on its application
+    :type nemo: flask_nemo.Nemo
+    :param interval: Time between two checks, in seconds
+    :type interval: float
+    :param logger: Logger reporting reloaded texts and failures (Default: logger of the application)
+    :type logger: logging.Logger
+
+    :Example:
+
+    .. code-block:: python
+
+        watcher = CorpusWatcher(nemo, interval=5)
+        watcher.start()
+    """
+    def __init__(self, nemo, interval=2.0, logger=None):
+        self.nemo = nemo
+        self.interval = interval
+        self.logger = logger
+        self.__snapshot__ = None
+        self.__stop__ = threading.Event()
+        self.__thread__ = None
+        self.__lock__ = threading.Lock()
+
+    @property
+    def log(self):
+        if self.logger is not None:
+            return self.logger
+        if self.nemo.app is not None:
+            return self.nemo.app.logger
+        return logging.getLogger(__name__)
+
+    def files(self):
+        """ Map the watched files to the texts depending on them
+
+        :return: Identifiers of texts per path
+        :rtype: {str: [str]}
+        """
+        index = self.nemo.inventory_index
+        files = dict()
+        for objectId in index.resources():
+            path = getattr(index.collection(objectId), "path", None)
+            if path:
+                files.setdefault(path, []).append(objectId)
+                files.setdefault(op.join(op.dirname(path), "__cts__.xml"), []).append(objectId)
+        return files
+
+    @staticmethod
+    def signature(path):
+        """ Signature of a file, changed by any write
+
+        :param path: Path of the file
+        :type path: str
+        :return: Modification time and size, None when the file does not exist
+        :rtype: (int, int)
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self):
+        """ Signatures of the watched files
+
+        :return: Signature and texts per path
+        :rtype: {str: ((int, int), [str])}
+        """
+        return {path: (self.signature(path), texts) for path, texts in self.files().items()}
+
+    def check(self):
+        """ Compare the watched files to the previous check and invalidate the texts of changed ones. The first \
+        check only records the files. When invalidating fails, for example on a file being written, the changes \
+        are reported again at the next check.
+
+        :return: Identifiers of the changed texts
+        :rtype: [str]
+        """
+        with self.__lock__:
+            current = self.snapshot()
+            if self.__snapshot__ is None:
+                self.__snapshot__ = current
+                return []
+            changed = []
+            for path, (signature, texts) in current.items():
+                previous = self.__snapshot__.get(path)
+                if previous is not None and previous[0] != signature:
+                    changed.extend([text for text in texts if text not in changed])
+            if changed:
+                try:
+                    with self.nemo.app.app_context():
+                        self.nemo.invalidate(changed)
+                except Exception as E:
+                    self.log.error("Reloading %s failed: %s", ", ".join(changed), E)
+                    return []
+                self.log.info("Reloaded %s", ", ".join(changed))
+            self.__snapshot__ = current
+            return changed
+
+    def run(self):
+        """ Check the files every interval until stopped """
+        while not self.__stop__.wait(self.interval):
+            try:
+                self.check()
+            except Exception as E:
+                self.log.error("Watching the corpus failed: %s", E)
+
+    def start(self):
+        """ Record the files and start checking them in a background thread """
+        if self.__thread__ is not None:
+            return
+        self.__stop__.clear()
+        self.check()
+        self.__thread__ = threading.Thread(target=self.run, daemon=True)
+        self.__thread__.start()
+
+    def stop(self):
+        """ Stop the background thread """
+        self.__stop__.set()
+        if self.__thread__ is not None:
+            self.__thread__.join()
+            self.__thread__ = None
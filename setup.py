@@ -12,14 +12,18 @@ setup(
     author_email='leponteineptique@gmail.com',
     description='Flask Extension to browse a CapiTainS-compliant Repository',
     test_suite="tests",
+    python_requires=">=3.7",
     install_requires=[
         "MyCapytain>=3.0.0",
-        "requests_cache>=0.4.9",
+        "requests_cache>=1.0.0",
         "Flask>=0.12",
         "requests>=2.10.0",
         "python-slugify==1.2.1",
         "Flask-Caching>=1.2.0"
     ],
+    extras_require={
+        "brotli": ["brotli"]
+    },
     tests_require=[
         "mock>=2.0.0",
     ],
@@ -0,0 +1,100 @@
+"""
+    Test asset bundles
+"""
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+import os.path as op
+
+from flask import Flask
+
+from flask_nemo import Nemo
+from flask_nemo.assets import Bundle, minify_css, minify_js
+from tests.test_resources import NautilusDummy
+
+
+class TestBundles(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.files = dict()
+        for filename, content in [
+            ("first.css", "/* Comment */\nbody {\n    color : red;\n}\n"),
+            ("second.css", "p > a,\na:hover {\n    margin: 0 1px;\n}\n"),
+            ("first.js", "var a = 1;\n\n    function b() {\n        return a;\n    }\n"),
+            ("second.js", "b(); // Call")
+        ]:
+            self.files[filename] = op.join(self.directory, filename)
+            with open(self.files[filename], "w") as f:
+                f.write(content)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_minifiers(self):
+        self.assertEqual(minify_css("/* Comment */\nbody {\n    color : red;\n}\n"), "body{color : red}")
+        self.assertEqual(minify_css("p > a,\na:hover {\n    margin: 0 1px;\n}"), "p>a,a:hover{margin: 0 1px}")
+        self.assertEqual(minify_js("var a = 1;\n\n    function b() {\n    }\n"), "var a = 1;\nfunction b() {\n}")
+
+    def test_bundle(self):
+        """ Bundles should concatenate files in order and be named after their content """
+        bundle = Bundle("css", [self.files["first.css"], self.files["second.css"]], minify_css)
+        self.assertEqual(bundle.content, b"body{color : red}\np>a,a:hover{margin: 0 1px}")
+        self.assertRegex(bundle.name, r"^nemo\.[0-9a-f]{12}\.css$")
+        self.assertEqual(bundle.mimetype, "text/css")
+        self.assertNotEqual(Bundle("css", [self.files["first.css"]], minify_css).name, bundle.name)
+
+        js = Bundle("js", [self.files["first.js"], self.files["second.js"]], minify_js)
+        self.assertEqual(js.content, b"var a = 1;\nfunction b() {\nreturn a;\n}\n;\nb(); // Call")
+
+    def test_default_minifiers(self):
+        """ Scripts should be bundled as they are unless a minifier is given """
+        nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy, bundle_assets=True, js=[self.files["first.js"]])
+        with open(self.files["first.js"], "rb") as f:
+            self.assertEqual(nemo.bundles["js"][0].content, f.read())
+        self.assertEqual(Bundle.build(
+            {"css": {}, "js": {"first.js": self.directory}}, {"js": minify_js}
+        )["js"][0].content, b"var a = 1;\nfunction b() {\nreturn a;\n}")
+
+    def test_nemo(self):
+        """ Pages should link to bundles, served with immutable caching headers """
+        app = Flask("Nemo")
+        nemo = Nemo(
+            app=app, resolver=NautilusDummy, base_url="", bundle_assets=True,
+            css=[self.files["first.css"], self.files["second.css"], "https://example.com/external.css"],
+            js=[self.files["first.js"]]
+        )
+        client = app.test_client()
+        page = client.get("/").data.decode()
+        (css, external), (js, ) = nemo.bundles["css"], nemo.bundles["js"]
+        self.assertEqual(external, "https://example.com/external.css")
+        self.assertIn("/assets/nemo.secondary/bundle/" + js.name, page)
+        self.assertLess(
+            page.index("/assets/nemo.secondary/bundle/" + css.name), page.index("https://example.com/external.css"),
+            "External assets should still be linked, after the assets preceding them"
+        )
+        self.assertNotIn("/assets/nemo.secondary/css/first.css", page, "Bundled assets should not be linked")
+
+        response = client.get("/assets/nemo.secondary/bundle/" + css.name)
+        self.assertEqual(response.data, css.content)
+        self.assertEqual(response.mimetype, "text/css")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual(client.get("/assets/nemo.secondary/bundle/nemo.000000000000.css").status_code, 404)
+
+    def test_order(self):
+        """ Bundles should keep the order of local and remote assets """
+        app = Flask("Nemo")
+        nemo = Nemo(
+            app=app, resolver=NautilusDummy, base_url="", bundle_assets=True,
+            css=["https://example.com/first.css", self.files["first.css"], "https://example.com/second.css",
+                 self.files["second.css"]]
+        )
+        first, local_first, second, local_second = nemo.bundles["css"]
+        self.assertEqual(local_first.files, [self.files["first.css"]])
+        self.assertEqual(local_second.files, [self.files["second.css"]])
+        page = app.test_client().get("/").data.decode()
+        positions = [page.index(link if isinstance(link, str) else link.name) for link in nemo.bundles["css"]]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_no_local_assets(self):
+        nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy, bundle_assets=True, css=["https://example.com/a.css"])
+        self.assertEqual(nemo.bundles, {"css": None, "js": None})
@@ -185,6 +185,43 @@ class NemoTestBrowse(TestCase):
             "App should have link to farsiLit through local repository-endpoint object"
         )
 
+    def test_text_page_lazy_references(self):
+        """ Test that the references page renders only the first levels when references_depth is set """
+        app = Flask("Nemo")
+        self.make_nemo(
+            app=app,
+            base_url="",
+            resolver=NautilusDummy,
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)},
+            references_depth=1
+        )
+        client = app.test_client()
+        query_data = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/references").data.decode()
+        self.assertIn(
+            'data-subtree="/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/subtree/1"', query_data,
+            "Books should be loaded lazily"
+        )
+        self.assertNotIn(
+            '<a href="/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1-1.pr.22">', query_data,
+            "Passages should not be rendered"
+        )
+
+        fragment = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/subtree/1").data.decode()
+        self.assertNotIn("<html", fragment, "Subtree should be a fragment")
+        self.assertIn(
+            'data-subtree="/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/subtree/1.pr"', fragment,
+            "Poems should be loaded lazily"
+        )
+        fragment = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/subtree/1.pr").data.decode()
+        self.assertIn(
+            '<a href="/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1-1.pr.22">', fragment,
+            "Passages of the branch should be rendered"
+        )
+        self.assertEqual(
+            client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/subtree/1.foo").status_code, 404,
+            "Unknown branches should not be found"
+        )
+
     def test_passage_page(self):
         """ Test that passage page contains what is relevant : text and next passages"""
         query_data = str(self.client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1-1.pr.22").data)
@@ -0,0 +1,436 @@
+"""
+    Test in-process caches
+"""
+from unittest import TestCase, skipIf
+from mock import patch
+from tempfile import mkdtemp
+from shutil import rmtree
+import os.path as op
+import gzip
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response
+from flask_caching import Cache
+from MyCapytain.errors import UnknownCollection
+from werkzeug.datastructures import Accept
+import jinja2
+
+from flask_nemo import Nemo
+from flask_nemo.cache import LRUCache, ResponseCache, SingleFlight, brotli, fcntl
+from flask_nemo.jinjaext import FragmentCacheExtension
+from tests.test_resources import NautilusDummy
+
+
+class TestLRUCache(TestCase):
+    def test_get_set(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", "value")
+        self.assertEqual(cache.get("a"), "value")
+        self.assertTrue(cache.delete("a"))
+        self.assertFalse(cache.delete("a"))
+        self.assertEqual(cache.statistics()["hits"], 1)
+        self.assertEqual(cache.statistics()["misses"], 1)
+
+    def test_bounded_entries(self):
+        """ Least recently used entries should be evicted first """
+        cache = LRUCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.statistics()["evictions"], 1)
+
+    def test_bounded_size(self):
+        """ Size of stored values should never exceed max_size """
+        cache = LRUCache(max_size=1000)
+        for i in range(10):
+            cache.set(str(i), "x" * 200)
+        self.assertLessEqual(cache.statistics()["size"], 1000)
+        self.assertIn("9", cache)
+        cache.set("big", "x" * 2000)
+        self.assertNotIn("big", cache, "Values bigger than the cache should not be stored")
+
+    def test_timeout(self):
+        cache = LRUCache()
+        with patch("flask_nemo.cache.monotonic", return_value=100):
+            cache.set("a", "1", timeout=10)
+            cache.set("b", "2")
+        with patch("flask_nemo.cache.monotonic", return_value=111):
+            self.assertIsNone(cache.get("a"), "Expired values should not be returned")
+            self.assertEqual(cache.get("b"), "2", "Values without timeout should not expire")
+        self.assertEqual(cache.statistics()["expirations"], 1)
+
+
+class TestFragmentCache(TestCase):
+    def test_extension(self):
+        """ Fragments should be rendered once per key """
+        env = jinja2.Environment(extensions=[FragmentCacheExtension])
+        env.nemo_fragment_cache = LRUCache()
+        template = env.from_string("{% cache 0, 'fragment', key %}{{ value }}{% endcache %}")
+        self.assertEqual(template.render(key="a", value="1"), "1")
+        self.assertEqual(template.render(key="a", value="2"), "1")
+        self.assertEqual(template.render(key="b", value="3"), "3")
+
+    def test_nemo(self):
+        """ Passages should be served from the fragment cache with the configured time-to-live """
+        app = Flask("Nemo")
+        nemo = Nemo(
+            app=app, resolver=NautilusDummy, base_url="", fragment_cache=True, cache_timeouts={"r_passage": 60}
+        )
+        self.assertEqual(nemo.cache_timeout("nemo.r_passage_semantic"), 60)
+        self.assertEqual(nemo.cache_timeout("nemo.r_references"), 0)
+        client = app.test_client()
+        with patch.object(nemo.fragment_cache, "set", wraps=nemo.fragment_cache.set) as cache_set:
+            first = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1").data
+            second = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1").data
+            self.assertEqual(cache_set.call_args[1]["timeout"], 60)
+        self.assertEqual(first, second)
+        self.assertEqual(nemo.cache_statistics()["fragments"]["hits"], 1)
+
+    def test_disabled(self):
+        nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy, fragment_cache=False)
+        self.assertEqual(nemo.cache_statistics(), {})
+        nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy)
+        self.assertIsNone(nemo.fragment_cache, "Fragment cache should be opt-in")
+
+    def test_default_timeout(self):
+        """ Fragments of routes without time-to-live should expire with the default time-to-live of the cache """
+        nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy, base_url="", fragment_cache=True)
+        self.assertEqual(nemo.fragment_cache.default_timeout, Nemo.FRAGMENT_TIMEOUT)
+        env = jinja2.Environment(extensions=[FragmentCacheExtension])
+        env.nemo_fragment_cache = nemo.fragment_cache
+        template = env.from_string("{% cache 0, 'fragment', key %}{{ value }}{% endcache %}")
+        with patch("flask_nemo.cache.monotonic", return_value=100):
+            self.assertEqual(template.render(key="a", value="1"), "1")
+        with patch("flask_nemo.cache.monotonic", return_value=100 + Nemo.FRAGMENT_TIMEOUT + 1):
+            self.assertEqual(template.render(key="a", value="2"), "2")
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(encodings=["gzip"])
+        self.body = ("<p>" + "Arma virumque cano " * 200 + "</p>").encode()
+        self.entry = self.cache.store("key", Response(self.body, mimetype="text/html"))
+
+    def test_variants(self):
+        """ Compressed variants should be computed once, at storage """
+        self.assertEqual(gzip.decompress(self.entry["bodies"]["gzip"]), self.body)
+        self.assertIs(self.cache.get("key"), self.entry)
+        small = self.cache.store("small", Response(b"<p>Arma</p>", mimetype="text/html"))
+        self.assertEqual(list(small["bodies"].keys()), ["identity"], "Small bodies should not be compressed")
+
+    def test_negotiation(self):
+        response = self.cache.respond(self.entry, Accept([("gzip", 1), ("deflate", 1)]))
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(response.mimetype, "text/html")
+        response = self.cache.respond(self.entry, Accept([("gzip", 0)]))
+        self.assertNotIn("Content-Encoding", response.headers, "Refused encodings should not be used")
+        self.assertEqual(response.get_data(), self.body)
+        self.assertEqual(self.cache.respond(self.entry, Accept()).get_data(), self.body)
+        self.assertEqual(self.cache.statistics()["served"], {"gzip": 1, "identity": 2})
+
+    def test_served_concurrently(self):
+        """ Responses served by concurrent threads should all be counted """
+        def serve(_):
+            for _ in range(200):
+                self.cache.respond(self.entry, Accept([("gzip", 1)]))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(serve, range(8)))
+        self.assertEqual(self.cache.statistics()["served"]["gzip"], 1600)
+
+    @skipIf(brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        cache = ResponseCache()
+        entry = cache.store("key", Response(self.body, mimetype="text/html"))
+        response = cache.respond(entry, Accept([("gzip", 1), ("br", 1)]))
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+
+    def test_nemo(self):
+        """ Pages and assets should be served compressed from the response cache """
+        directory = mkdtemp()
+        try:
+            with open(op.join(directory, "style.css"), "w") as f:
+                f.write("p { color: red; }\n" * 200)
+            app = Flask("Nemo")
+            nemo = Nemo(
+                app=app, resolver=NautilusDummy, base_url="", response_cache=True,
+                css=[op.join(directory, "style.css")]
+            )
+            client = app.test_client()
+            url = "/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1"
+            identity = client.get(url)
+            with patch.object(nemo, "get_passage") as get_passage:
+                compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+                get_passage.assert_not_called()
+            self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(compressed.data), identity.data)
+
+            css = client.get("/assets/nemo.secondary/css/style.css", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(css.headers["Content-Encoding"], "gzip")
+            self.assertEqual(css.mimetype, "text/css")
+            self.assertEqual(gzip.decompress(css.data).decode(), "p { color: red; }\n" * 200)
+            self.assertEqual(nemo.cache_statistics()["responses"]["hits"], 1)
+        finally:
+            rmtree(directory)
+
+
+class TestTags(TestCase):
+    """ Entries of Flask-Caching, fragments and pages are tagged with collections and the inventory """
+    TEXT = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+    OTHER = "urn:cts:latinLit:phi1318.phi001.perseus-unk2"
+
+    def setUp(self):
+        self.app = Flask("Nemo")
+        self.nemo = Nemo(
+            app=self.app, resolver=NautilusDummy, base_url="", response_cache=True,
+            cache=Cache(app=self.app, config={"CACHE_TYPE": "simple"})
+        )
+        self.client = self.app.test_client()
+
+    def test_tags(self):
+        """ Entries of a collection should be tagged with its ancestors and its members tag """
+        self.assertEqual(self.nemo.tags(), ["inventory"])
+        self.assertEqual(self.nemo.tags(self.TEXT), [
+            self.TEXT, "urn:cts:latinLit:phi1294.phi002", "urn:cts:latinLit:phi1294", "urn:perseus:latinLit",
+            "default", "members|" + self.TEXT
+        ])
+        self.assertNotIn(self.TEXT, self.nemo.tags("urn:cts:latinLit:phi1294.phi002"), "Members should not be tags")
+        self.assertEqual(self.nemo.tags("urn:cts:latinLit:unknown"), ["urn:cts:latinLit:unknown"])
+
+    def test_invalidate_members(self):
+        """ Invalidating a text should evict the pages listing it, but not the entries of the other texts """
+        work = "/collections/urn:cts:latinLit:phi1294.phi002"
+        other = "/text/{}/passage/8".format(self.OTHER)
+        self.client.get(work)
+        self.client.get(other)
+        self.assertEqual(
+            self.nemo.invalidate([self.TEXT], reload=False),
+            [self.TEXT] + ["members|" + ancestor for ancestor in self.nemo.inventory_index.ancestors(self.TEXT)]
+        )
+        with patch.object(self.nemo, "get_passage") as get_passage, \
+                patch.object(self.nemo, "r_collection", wraps=self.nemo.r_collection) as collection:
+            self.client.get(other)
+            get_passage.assert_not_called()
+            self.client.get(work)
+            self.assertTrue(collection.called, "Page listing the text should be rendered again")
+
+    def test_generations_per_request(self):
+        """ Generations of tags should be read once per request """
+        with patch.object(self.nemo.cache, "get_many", wraps=self.nemo.cache.get_many) as get_many:
+            self.client.get("/text/{}/passage/1.pr.1".format(self.TEXT))
+            tags = [key for call in get_many.call_args_list for key in call[0] if key.startswith("nemo|tag|")]
+        self.assertEqual(len(tags), len(set(tags)), "Generations should not be read twice in a request")
+
+    def test_invalidate_tags(self):
+        """ Invalidating a collection should evict the entries of its descendants only """
+        with self.app.app_context(), patch.object(NautilusDummy, "getReffs", wraps=NautilusDummy.getReffs) as reffs:
+            self.nemo.get_reffs(self.TEXT)
+            self.nemo.get_reffs(self.OTHER)
+            self.nemo.get_reffs(self.TEXT)
+            self.assertEqual(reffs.call_count, 2)
+            self.nemo.invalidate_tags(["urn:cts:latinLit:phi1294"])
+            self.nemo.get_reffs(self.OTHER)
+            self.assertEqual(reffs.call_count, 2, "Entries of other collections should be kept")
+            self.nemo.get_reffs(self.TEXT)
+            self.assertEqual(reffs.call_count, 3, "Entries of descendants should be evicted")
+        self.assertEqual(self.nemo.generation("urn:cts:latinLit:phi1294"), 1)
+
+    def test_invalidate_inventory(self):
+        """ Invalidating the inventory should evict the pages computed for no collection only """
+        passage = "/text/{}/passage/1.pr.1".format(self.TEXT)
+        self.client.get("/collections")
+        self.client.get(passage)
+        self.nemo.invalidate_tags([self.nemo.INVENTORY_TAG])
+        with patch.object(self.nemo, "get_passage") as get_passage, \
+                patch.object(self.nemo, "main_collections", wraps=self.nemo.main_collections) as collections:
+            self.client.get(passage)
+            get_passage.assert_not_called()
+            self.client.get("/collections")
+            self.assertTrue(collections.called, "Collections page should be rendered again")
+
+
+class TestSingleFlight(TestCase):
+    def concurrently(self, func, count=5):
+        barrier = threading.Barrier(count)
+
+        def call(_):
+            barrier.wait()
+            try:
+                return func()
+            except Exception as E:
+                return E
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            return list(executor.map(call, range(count)))
+
+    def test_coalescing(self):
+        """ Concurrent callers of a key should share a single computation """
+        flight, calls = SingleFlight(), []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+        results = self.concurrently(lambda: flight.do("key", compute))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(id(result) for result in results)), 1, "Followers should get the leader's value")
+        self.assertEqual(flight.statistics(), dict(leaders=1, followers=4, timeouts=0, locked=0))
+        flight.do("key", compute)
+        self.assertEqual(len(calls), 2, "Finished computations should not be reused")
+
+    def test_error(self):
+        """ Exceptions of the leader should be raised to its followers """
+        flight = SingleFlight()
+
+        def compute():
+            time.sleep(0.2)
+            raise ValueError("Unknown")
+        results = self.concurrently(lambda: flight.do("key", compute))
+        leader = next(result for result in results if result.__cause__ is None)
+        self.assertEqual(len(set(id(result) for result in results)), 5, "Followers should raise their own copy")
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+            self.assertEqual(result.args, ("Unknown", ))
+            self.assertIn(result.__cause__, (None, leader))
+        frames = [frame.name for frame in traceback.extract_tb(leader.__traceback__)]
+        self.assertEqual(frames.count("do"), 1, "Followers should not extend the traceback of the leader")
+
+    def test_stable_key(self):
+        """ Calls with objects whose representation changes should be coalesced on their identifiers """
+        app = Flask("Nemo")
+        nemo = Nemo(
+            app=app, resolver=NautilusDummy, base_url="", single_flight=True,
+            cache=Cache(app=app, config={"CACHE_TYPE": "simple"})
+        )
+        text = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+        with app.app_context(), patch.object(nemo.single_flight, "do", wraps=nemo.single_flight.do) as do:
+            for reference in ["1.pr.1", "1.pr.1", "1.pr.2"]:
+                nemo.get_siblings(text, reference, NautilusDummy.getTextualNode(text, reference))
+        first, second, third = [call[0][0] for call in do.call_args_list if ".get_siblings|" in call[0][0]]
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        self.assertNotIn("0x", first + third)
+
+    def test_timeout(self):
+        """ Followers should compute the value themselves after the timeout """
+        flight, calls = SingleFlight(timeout=0.05), []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.3)
+            return len(calls)
+        self.concurrently(lambda: flight.do("key", compute), count=3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(flight.statistics()["timeouts"], 2)
+
+    @skipIf(fcntl is None, "Lock files require fcntl")
+    def test_lock_file(self):
+        """ Leaders sharing lock files should wait for each other """
+        directory = mkdtemp()
+        try:
+            shared, calls = dict(), []
+            first, second = SingleFlight(directory), SingleFlight(directory)
+
+            def compute():
+                if "key" not in shared:
+                    calls.append(1)
+                    time.sleep(0.2)
+                    shared["key"] = "value"
+                return shared["key"]
+            barrier = threading.Barrier(2)
+
+            def call(flight):
+                barrier.wait()
+                return flight.do("key", compute)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(call, [first, second]))
+            self.assertEqual(results, ["value", "value"])
+            self.assertEqual(len(calls), 1, "The second leader should find the value computed by the first one")
+            self.assertEqual(first.statistics()["locked"] + second.statistics()["locked"], 1)
+        finally:
+            rmtree(directory)
+
+    def test_nemo(self):
+        """ Concurrent cache misses of a memoized function should call the resolver once """
+        app = Flask("Nemo")
+        nemo = Nemo(
+            app=app, resolver=NautilusDummy, base_url="", single_flight=True,
+            cache=Cache(app=app, config={"CACHE_TYPE": "simple"})
+        )
+        getTextualNode = NautilusDummy.getTextualNode
+
+        def slow(*args, **kwargs):
+            time.sleep(0.2)
+            return getTextualNode(*args, **kwargs)
+
+        def call():
+            with app.app_context():
+                return str(nemo.get_passage("urn:cts:latinLit:phi1294.phi002.perseus-lat2", "1.pr.1").id)
+        with patch.object(NautilusDummy, "getTextualNode", side_effect=slow) as resolver:
+            results = self.concurrently(call)
+        self.assertEqual(resolver.call_count, 1)
+        self.assertEqual(results, ["urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr.1"] * 5)
+        self.assertGreaterEqual(nemo.cache_statistics()["flights"]["followers"], 4)
+
+
+class TestNegativeCache(TestCase):
+    TEXT = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+
+    def setUp(self):
+        self.app = Flask("Nemo")
+        self.nemo = Nemo(app=self.app, resolver=NautilusDummy, base_url="", negative_cache=True)
+
+    def test_unknown_reference(self):
+        """ Unknown references should be requested once to the resolver while they are remembered """
+        with self.app.app_context(), \
+                patch.object(NautilusDummy, "getTextualNode", wraps=NautilusDummy.getTextualNode) as resolver:
+            for _ in range(3):
+                with self.assertRaises(IndexError):
+                    self.nemo.get_passage(self.TEXT, "99.99")
+            self.assertEqual(resolver.call_count, 1)
+            self.nemo.get_passage(self.TEXT, "1.pr.1")
+            self.nemo.get_passage(self.TEXT, "1.pr.1")
+            self.assertEqual(resolver.call_count, 3, "Known references should not be remembered")
+        statistics = self.nemo.cache_statistics()["unknown"]
+        self.assertEqual((statistics["hits"], statistics["sets"]), (2, 1))
+
+    def test_bug_not_remembered(self):
+        """ IndexErrors raised outside of the lookup of a reference should not be remembered """
+        def bug(**kwargs):
+            return [][0]
+        with self.app.app_context(), patch.object(NautilusDummy, "getTextualNode", side_effect=bug) as resolver:
+            for _ in range(2):
+                with self.assertRaises(IndexError):
+                    self.nemo.get_passage(self.TEXT, "1.pr.1")
+            self.assertEqual(resolver.call_count, 2)
+        self.assertEqual(self.nemo.cache_statistics()["unknown"]["sets"], 0)
+
+    def test_unknown_collection(self):
+        """ Unknown collections should raise the same error again """
+        with self.app.app_context():
+            for _ in range(2):
+                with self.assertRaises(UnknownCollection) as context:
+                    self.nemo.get_collection("urn:cts:latinLit:unknown")
+                self.assertIn("urn:cts:latinLit:unknown", str(context.exception))
+        self.assertEqual(self.nemo.cache_statistics()["unknown"]["hits"], 1)
+
+    def test_expiration(self):
+        """ Unknown references should be requested again once expired """
+        nemo = Nemo(
+            app=Flask("Nemo"), resolver=NautilusDummy, base_url="",
+            negative_cache=LRUCache(max_entries=10, default_timeout=1)
+        )
+        with patch.object(NautilusDummy, "getTextualNode", wraps=NautilusDummy.getTextualNode) as resolver:
+            with self.assertRaises(IndexError):
+                nemo.get_passage(self.TEXT, "99.99")
+            with patch("flask_nemo.cache.monotonic", return_value=time.monotonic() + 2):
+                with self.assertRaises(IndexError):
+                    nemo.get_passage(self.TEXT, "99.99")
+            self.assertEqual(resolver.call_count, 2)
@@ -9,7 +9,11 @@ Test file for chunkers and groupers.
 
 from MyCapytain.resources.collections.cts import XmlCtsTextInventoryMetadata
 from tests.test_resources import NemoResource, NautilusDummy
-from flask_nemo.chunker import default_chunker, line_chunker, scheme_chunker, level_chunker, level_grouper
+from flask_nemo.chunker import default_chunker, line_chunker, scheme_chunker, level_chunker, level_grouper, \
+    size_grouper, PassageSizes
+from tempfile import mkstemp
+import os
+import json
 
 
 class TestChunkers(NemoResource):
@@ -159,3 +163,69 @@ class TestChunkers(NemoResource):
             ("2.1.11-2.1.12", "2.1.11-2.1.12"),
             curated_references
         )
+
+    def test_size_grouper(self):
+        """ Test size grouper
+        """
+        text = self.inventory["urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        sizes = {"1.pr.1": 50, "1.pr.2": 50, "1.pr.3": 150, "1.pr.4": 20, "1.1.1": 10, "1.1.2": 10}
+        curated_references = size_grouper(
+            text,
+            lambda level: ["1.pr.1", "1.pr.2", "1.pr.3", "1.pr.4", "1.1.1", "1.1.2"],
+            sizes=lambda text, level: sizes,
+            budget=100
+        )
+        self.assertEqual(
+            curated_references,
+            [
+                ("1.pr.1-1.pr.2", "1.pr.1-1.pr.2"),
+                ("1.pr.3", "1.pr.3"),  # Bigger than the budget
+                ("1.pr.4", "1.pr.4"),  # Groups do not cross parents
+                ("1.1.1-1.1.2", "1.1.1-1.1.2")
+            ]
+        )
+
+    def test_passage_sizes(self):
+        """ Test collection of passage sizes
+        """
+        _, path = mkstemp(suffix=".json")
+        os.remove(path)
+        text = NautilusDummy.getMetadata("urn:cts:latinLit:stoa0329c.stoa001.opp-lat1")
+        sizes = PassageSizes(NautilusDummy, path=path)
+        sizes.collect([text])
+        self.assertEqual(sizes(text, 1)["2"], 1630)
+        self.assertEqual(
+            size_grouper(text, lambda level: NautilusDummy.getReffs(text.id, level=level), sizes=sizes, budget=1000),
+            [("1", "1"), ("2", "2"), ("3-5", "3-5"), ("6", "6"), ("7", "7"), ("8", "8")]
+        )
+        self.assertEqual(PassageSizes(None, path=path)(text, 1), sizes(text, 1), "Sizes should be loaded from disk")
+        self.assertLess(PassageSizes(NautilusDummy, unit="tokens")(text, 1)["2"], 1630)
+        os.remove(path)
+
+    def test_passage_sizes_stale(self):
+        """ Test that sizes saved for another version of a text are collected again
+        """
+        _, path = mkstemp(suffix=".json")
+        os.remove(path)
+        # Texts of the inventory expose their source
+        text = NautilusDummy.getMetadata()["urn:cts:latinLit:stoa0329c.stoa001.opp-lat1"]
+        PassageSizes(NautilusDummy, path=path).collect([text])
+        with open(path) as f:
+            stored = json.load(f)
+        stored["sizes"][str(text.id)]["1"]["2"] = 1
+        with open(path, "w") as f:
+            json.dump(stored, f)
+        self.assertEqual(PassageSizes(None, path=path)(text, 1)["2"], 1, "Sizes of the same source should be loaded")
+
+        stored["checksums"][str(text.id)] = "0" * 40
+        with open(path, "w") as f:
+            json.dump(stored, f)
+        self.assertEqual(PassageSizes(NautilusDummy, path=path)(text, 1)["2"], 1630, "Stale sizes should be dropped")
+
+        del stored["checksums"]
+        with open(path, "w") as f:
+            json.dump(stored, f)
+        self.assertEqual(
+            PassageSizes(NautilusDummy, path=path)(text, 1)["2"], 1630, "Unchecked sizes should be dropped"
+        )
+        os.remove(path)
@@ -6,6 +6,10 @@ from mock import patch
 import flask
 from MyCapytain.resolvers.cts.api import HttpCtsResolver
 from MyCapytain.resolvers.cts.local import CtsCapitainsLocalResolver
+from flask_nemo.retrievers import CachedHttpCtsRetriever
+from tempfile import mkdtemp
+from shutil import rmtree
+import os.path as op
 
 
 class TestCommands(TestCase):
@@ -138,4 +142,83 @@ class TestCommands(TestCase):
             args_called += 1
         self.assertEqual(args_called, len(arguments), "There should be as many tests as printed output checked")
 
-        self.assertIsInstance(nemo.resolver, CtsCapitainsLocalResolver, "We should have a CTS Remote Resolver")
\ No newline at end of file
+        self.assertIsInstance(nemo.resolver, CtsCapitainsLocalResolver, "We should have a CTS Remote Resolver")
+
+    def test_run_http_cache(self):
+        """ Test a run on a remote API with a local cache of responses """
+        directory = mkdtemp()
+        try:
+            nemo, app, stdout, run = self.server([
+                "cts-api", "https://cts.perseids.org/api/cts/",
+                "--cts-cache", op.join(directory, "cts"), "--cts-cache-backend", "filesystem",
+                "--cts-cache-ttl", "60", "--no-stale-if-error", "--cts-cache-stale-while-revalidate", "30",
+                "--cts-breaker", "--cts-timeout", "2.5"
+            ])
+            self.assertIsInstance(nemo.resolver.endpoint, CachedHttpCtsRetriever)
+            self.assertEqual(nemo.resolver.endpoint.endpoint, "https://cts.perseids.org/api/cts/")
+            self.assertFalse(nemo.resolver.endpoint.session.settings.stale_if_error)
+            self.assertIn("cts_cache_ttl=60", stdout.split())
+            self.assertIn("Cache cts: requests=0", stdout)
+            self.assertEqual(nemo.resolver.endpoint.stale_while_revalidate, 30)
+            self.assertEqual(nemo.resolver.endpoint.timeout, 2.5)
+            self.assertEqual(nemo.cache_statistics()["breaker"]["state"], "closed")
+        finally:
+            rmtree(directory)
+
+    def test_run_http_breaker_without_cache(self):
+        """ Options of the local cache of CTS API responses should be rejected without the cache """
+        result = StringIO()
+        with patch("sys.stderr", result):
+            with self.assertRaises(SystemExit):
+                self.server(["cts-api", "https://cts.perseids.org/api/cts/", "--cts-breaker", "--cts-timeout", "2"])
+        self.assertIn("--cts-breaker, --cts-timeout require the cts-api method and --cts-cache", result.getvalue())
+
+    def test_run_local_watch(self):
+        """ Test a run watching the files of the local corpus """
+        with patch("flask_nemo.cmd.CorpusWatcher") as watcher:
+            nemo, app, stdout, run = self.server(["cts-local", "./tests/test_data/nautilus/farsiLit", "--watch", "5"])
+        self.assertIn("watch=5.0", stdout.split())
+        watcher.assert_called_once_with(nemo, interval=5.0)
+        watcher.return_value.check.assert_called_once_with()
+        watcher.return_value.start.assert_called_once_with()
+
+    def test_run_local_negative_cache(self):
+        """ Test a run remembering unknown identifiers """
+        nemo, app, stdout, run = self.server(
+            ["cts-local", "./tests/test_data/nautilus/farsiLit", "--negative-cache", "30"]
+        )
+        self.assertIn("negative_cache=30", stdout.split())
+        self.assertEqual(nemo.negative_cache.default_timeout, 30)
+        self.assertIn("unknown", nemo.cache_statistics())
+
+    def test_warm(self):
+        """ Test the warm-up of the caches of a local repository """
+        directory = mkdtemp()
+        try:
+            urns = op.join(directory, "urns.txt")
+            with open(urns, "w") as f:
+                f.write("# Top texts\nurn:cts:farsiLit:hafez.divan.perseus-eng1\nurn:cts:farsiLit:unknown\n")
+            result = StringIO()
+            with patch("sys.stdout", result):
+                with mock.patch('sys.argv', [sys.argv[0], "warm", "cts-local", "./tests/test_data/nautilus/farsiLit",
+                                             "--urns", urns, "--max-passages", "1", "--parallelism", "2",
+                                             "--passage-store", op.join(directory, "passages.sqlite")]):
+                    nemo, app, report = Server.cmd()
+            stdout = result.getvalue()
+            self.assertIn("parallelism=2", stdout.split())
+            self.assertIn("[2/2] passage urn:cts:farsiLit:hafez.divan.perseus-eng1:1.1.1.1-1.1.1.2", stdout)
+            self.assertIn("Unknown identifier urn:cts:farsiLit:unknown", stdout)
+            self.assertIn("Warmed 1 texts", stdout)
+            self.assertEqual(report["passage"]["count"], 1)
+            self.assertIsNotNone(nemo.passage_store)
+        finally:
+            rmtree(directory)
+
+    def test_warm_without_store(self):
+        """ Warming without persistent store should be rejected, as nothing would outlive the command """
+        result = StringIO()
+        with patch("sys.stderr", result):
+            with mock.patch('sys.argv', [sys.argv[0], "warm", "cts-local", "./tests/test_data/nautilus/farsiLit"]):
+                with self.assertRaises(SystemExit):
+                    Server.cmd()
+        self.assertIn("--reference-store, --passage-store or --cts-cache is required", result.getvalue())
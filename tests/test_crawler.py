@@ -0,0 +1,84 @@
+"""
+    Test the cache warm-up crawler
+"""
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+import os.path as op
+
+from flask import Flask
+from MyCapytain.resolvers.cts.local import CtsCapitainsLocalResolver
+
+from flask_nemo import Nemo
+from flask_nemo.crawler import Crawler
+from flask_nemo.store import PassageStore
+
+
+class TestCrawler(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.store = PassageStore(op.join(self.directory, "passages.sqlite"))
+        self.nemo = Nemo(
+            app=Flask("Nemo"),
+            base_url="",
+            resolver=CtsCapitainsLocalResolver(["./tests/test_data/nautilus/farsiLit"]),
+            passage_store=self.store
+        )
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_texts(self):
+        """ Collections should be expanded to their texts, keeping the order of priority """
+        crawler = Crawler(self.nemo)
+        texts, unknown = crawler.texts()
+        self.assertEqual(len(texts), 3)
+        texts, unknown = crawler.texts([
+            "urn:cts:farsiLit:hafez.divan.perseus-ger1", "urn:cts:farsiLit:unknown", "urn:cts:farsiLit:hafez.divan"
+        ])
+        self.assertEqual(texts, [
+            "urn:cts:farsiLit:hafez.divan.perseus-ger1", "urn:cts:farsiLit:hafez.divan.perseus-far1",
+            "urn:cts:farsiLit:hafez.divan.perseus-eng1"
+        ])
+        self.assertEqual(unknown, ["urn:cts:farsiLit:unknown"])
+
+    def test_run(self):
+        """ References and passages should be warmed, passages of a text before the next texts """
+        tasks = []
+        report = Crawler(
+            self.nemo, parallelism=1, max_passages=2, progress=lambda *args: tasks.append(args)
+        ).run(["urn:cts:farsiLit:hafez.divan.perseus-ger1", "urn:cts:farsiLit:hafez.divan.perseus-eng1"])
+        self.assertEqual(
+            [(kind, objectId[-4:], subreference) for _, _, kind, objectId, subreference, _, _ in tasks],
+            [
+                ("references", "ger1", None),
+                ("passage", "ger1", "1.1.1.1-1.1.1.4"), ("passage", "ger1", "1.1.2.1-1.1.2.4"),
+                ("references", "eng1", None),
+                ("passage", "eng1", "1.1.1.1-1.1.1.2"), ("passage", "eng1", "1.1.2.1-1.1.2.2")
+            ]
+        )
+        self.assertEqual([args[0] for args in tasks], list(range(1, 7)))
+        self.assertEqual(tasks[-1][1], 6)
+        self.assertEqual(report["texts"], 2)
+        self.assertEqual(report["references"]["count"], 2)
+        self.assertEqual(report["passage"]["count"], 4)
+        self.assertEqual(report["errors"], [])
+        self.assertGreater(report["elapsed"], 0)
+
+        text = self.nemo.get_collection("urn:cts:farsiLit:hafez.divan.perseus-ger1")
+        stored = self.store.get(text, "1.1.2.1-1.1.2.4", self.nemo.passage_fingerprint(str(text.id)))
+        self.assertIsNotNone(stored, "Transformed passages should be in the store")
+        self.assertIsNone(self.store.get(text, "1.1.3.1-1.1.3.4", self.nemo.passage_fingerprint(str(text.id))))
+
+    def test_pages(self):
+        """ Pages should be requested and failures reported """
+        report = Crawler(self.nemo, parallelism=2, pages=True, max_passages=1).run(
+            ["urn:cts:farsiLit:hafez.divan.perseus-far1"]
+        )
+        self.assertEqual(report["passage"]["count"], 1)
+        self.assertEqual(report["errors"], [])
+
+        crawler = Crawler(self.nemo, pages=True)
+        duration, result, error = crawler.execute("passage", "urn:cts:farsiLit:hafez.divan.perseus-far1", "9.9")
+        self.assertIsInstance(error, ValueError)
+        self.assertIsNone(result)
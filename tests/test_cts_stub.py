@@ -0,0 +1,75 @@
+"""
+    Test the stub CTS API of the benchmarks
+"""
+from unittest import TestCase
+import time
+
+from flask import Flask
+from MyCapytain.resolvers.cts.api import HttpCtsResolver
+from MyCapytain.retrievers.cts5 import HttpCtsRetriever
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from flask_nemo import Nemo
+from benchmarks.cts_stub import CtsStub, serve
+
+
+class TestCtsStub(TestCase):
+    def test_valid_reff(self):
+        """ References should be answered at the requested level, within the requested passage """
+        client = Client(CtsStub(), Response)
+        response = client.get("/?request=GetValidReff&urn=urn:cts:latinLit:phi1294.phi002.perseus-lat2&level=1")
+        self.assertEqual(response.data.count(b"<CTS:urn>"), 14)
+        response = client.get(
+            "/?request=GetValidReff&urn=urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr&level=1"
+        )
+        self.assertEqual(response.data.count(b"<CTS:urn>"), 22)
+        self.assertIn(b"<CTS:urn>urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr.22</CTS:urn>", response.data)
+        self.assertEqual(client.get("/?request=GetPrevNext").status_code, 200)
+        self.assertEqual(client.get("/?request=Unknown").status_code, 400)
+
+    def test_passage(self):
+        """ Passages should be the requested ones, with their own previous and next passages """
+        stub = CtsStub()
+        client = Client(stub, Response)
+        first = client.get("/?request=GetPassage&urn=urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1").data
+        self.assertIn(b"Hic est quem legis ille", first)
+        second = client.get("/?request=GetPassagePlus&urn=urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2").data
+        self.assertNotIn(b"Hic est quem legis ille", second)
+        self.assertIn(b"Limina post Pacis Palladiumque forum", second)
+        self.assertIn(b"<CTS:requestUrn>urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2</CTS:requestUrn>", second)
+        self.assertIn(b"<CTS:urn>urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.3</CTS:urn>", second)
+        client.get("/?request=GetPassagePlus&urn=urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2")
+        self.assertEqual(len(stub.passages), 2, "Passages should be built once per request and URN")
+        self.assertEqual(
+            client.get("/?request=GetPassage&urn=urn:cts:latinLit:phi1294.phi002.perseus-lat2:99").status_code, 400
+        )
+
+    def test_latency_bandwidth(self):
+        """ Responses should be delayed and streamed at the given bandwidth """
+        stub = CtsStub(latency=0.05, bandwidth=200000)
+        client = Client(stub, Response)
+        start = time.perf_counter()
+        data = client.get("/?request=GetCapabilities").get_data()
+        self.assertGreater(time.perf_counter() - start, 0.05 + len(data) / 200000)
+        response = client.get("/?request=GetCapabilities")
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.get_data()))
+        self.assertEqual(stub.requests["getcapabilities"], 2)
+
+    def test_nemo(self):
+        """ Nemo should browse the stub through an HttpCtsResolver """
+        stub = CtsStub()
+        server = serve(stub)
+        try:
+            app = Flask("Nemo")
+            Nemo(app=app, base_url="", resolver=HttpCtsResolver(
+                HttpCtsRetriever("http://127.0.0.1:{}/".format(server.port))
+            ))
+            client = app.test_client()
+            self.assertEqual(client.get("/collections/urn:cts:latinLit:phi1294").status_code, 200)
+            response = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.1")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Hic est quem legis ille", response.data.decode())
+            self.assertEqual(stub.requests["getpassageplus"], 1)
+        finally:
+            server.shutdown()
@@ -0,0 +1,111 @@
+"""
+    Test the inventory index
+"""
+from unittest import TestCase
+
+from flask import Flask
+from MyCapytain.errors import UnknownCollection
+from MyCapytain.resources.prototypes.cts.inventory import CtsTextInventoryMetadata, CtsTextgroupMetadata
+
+from flask_nemo import Nemo
+from flask_nemo.inventory import InventoryIndex
+from flask_nemo.filters import f_slugify
+from tests.test_resources import NautilusDummy
+
+
+class TestInventoryIndex(TestCase):
+    def setUp(self):
+        self.inventory = NautilusDummy.getMetadata()
+        self.index = InventoryIndex(self.inventory, langs=["eng"])
+        self.nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy)
+
+    def test_collection(self):
+        self.assertIs(
+            self.index.collection("urn:cts:latinLit:phi1294.phi002"),
+            self.inventory["urn:cts:latinLit:phi1294.phi002"]
+        )
+        self.assertIn("urn:cts:latinLit:phi1294", self.index)
+        self.assertNotIn("urn:cts:latinLit:phi9999", self.index)
+        with self.assertRaises(UnknownCollection):
+            self.index.collection("urn:cts:latinLit:phi9999")
+
+    def test_equivalent_to_nemo(self):
+        """ Views of the index should be the ones Nemo computes from collection objects """
+        index = self.nemo.inventory_index
+        for identifier in ["urn:cts:latinLit:phi1294", "urn:cts:latinLit:phi1294.phi002",
+                           "urn:cts:latinLit:phi1294.phi002.perseus-lat2"]:
+            collection = self.nemo.get_inventory()[identifier]
+            self.assertEqual(
+                index.semantic(identifier),
+                f_slugify("--".join([
+                    item.get_label() for item in collection.parents[::-1] + [collection] if item.get_label()
+                ]))
+            )
+            for lang in [None, "eng", "fre"]:
+                view = index.view(identifier, lang)
+                self.assertEqual(view["label"], str(collection.get_label(lang)))
+                self.assertEqual(view["model"], str(collection.model))
+                self.assertEqual(view["size"], collection.size)
+                self.assertEqual(
+                    [member["id"] for member in index.members(identifier, lang)],
+                    [member.id for member in sorted(collection.members, key=lambda x: str(x.get_label(lang)))]
+                )
+                self.assertEqual(
+                    [p["id"] for p in index.parents(identifier, lang)],
+                    [p.id for p in collection.parents if p.get_label()]
+                )
+
+    def test_aggregates(self):
+        """ Sizes, text counts and languages should be aggregated over the subtree of each collection """
+        view = self.index.view("urn:cts:latinLit:phi1294", "eng")
+        self.assertEqual(view["size"], 1)
+        self.assertEqual(view["texts"], 1)
+        self.assertEqual(view["languages"], ["lat"])
+        root = self.index.view(self.inventory.id)
+        self.assertEqual(root["size"], len(self.inventory.members))
+        self.assertEqual(root["texts"], len(self.inventory.readableDescendants))
+        self.assertEqual(
+            root["languages"], sorted(set(str(text.lang) for text in self.inventory.readableDescendants))
+        )
+        self.assertEqual(self.index.view("urn:cts:latinLit:phi1294.phi002.perseus-lat2")["texts"], 1)
+
+    def test_resources(self):
+        """ Texts of a subtree should be listed """
+        self.assertEqual(self.index.resources("urn:cts:latinLit:phi1294"),
+                         ["urn:cts:latinLit:phi1294.phi002.perseus-lat2"])
+        self.assertEqual(self.index.resources("urn:cts:latinLit:phi1294.phi002.perseus-lat2"),
+                         ["urn:cts:latinLit:phi1294.phi002.perseus-lat2"])
+        self.assertIn("urn:cts:latinLit:phi1294.phi002.perseus-lat2", self.index.resources())
+
+    def test_translation_computed_once(self):
+        """ Translations should be computed once per language """
+        self.assertIs(self.index.members("urn:cts:latinLit:phi1294", "eng"),
+                      self.index.members("urn:cts:latinLit:phi1294", "eng"))
+        self.assertIs(self.index.view("urn:cts:latinLit:phi1294", "ger"),
+                      self.index.view("urn:cts:latinLit:phi1294", "ger"))
+
+    def test_unlabelled_members(self):
+        """ Unlabelled collections should be left out of members but listed as main collections """
+        inventory = CtsTextInventoryMetadata()
+        labelled = CtsTextgroupMetadata(urn="urn:cts:latinLit:phi1294", parent=inventory)
+        labelled.set_cts_property("groupname", "Martial", "eng")
+        CtsTextgroupMetadata(urn="urn:cts:latinLit:phi9999", parent=inventory)
+        index = InventoryIndex(inventory)
+        self.assertEqual([member["id"] for member in index.members(inventory.id)], ["urn:cts:latinLit:phi1294"])
+        self.assertEqual(
+            sorted(member["id"] for member in index.members(inventory.id, labelled=False)),
+            ["urn:cts:latinLit:phi1294", "urn:cts:latinLit:phi9999"]
+        )
+        self.nemo._inventory_index = index
+        self.assertEqual(len(self.nemo.main_collections()), 2, "Main collections should not be filtered")
+
+    def test_r_collection(self):
+        """ Collection route should be served from the index """
+        with self.nemo.app.test_request_context():
+            response = self.nemo.r_collection("urn:cts:latinLit:phi1294", lang="eng")
+        self.assertEqual(response["collections"]["current"]["id"], "urn:cts:latinLit:phi1294")
+        self.assertEqual(response["collections"]["current"]["label"], "Martial")
+        self.assertEqual(
+            [member["id"] for member in response["collections"]["members"]],
+            ["urn:cts:latinLit:phi1294.phi002"]
+        )
@@ -0,0 +1,70 @@
+"""
+    Test the per-request profiler
+"""
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+
+from flask import Flask
+
+from flask_nemo import Nemo
+from flask_nemo.profiler import RequestProfiler
+from tests.test_resources import NautilusDummy
+
+
+PASSAGE = "/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1-1.pr.5"
+
+
+class TestRequestProfiler(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.app = Flask("Nemo")
+        self.nemo = Nemo(
+            app=self.app, base_url="", resolver=NautilusDummy, response_cache=True,
+            profiler=RequestProfiler(self.directory, token="secret")
+        )
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_token(self):
+        """ Only requests with the right token should be profiled """
+        with self.assertRaises(ValueError):
+            RequestProfiler(self.directory, token="")
+        response = self.client.get(PASSAGE)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response.headers)
+        response = self.client.get(PASSAGE, headers={"X-Nemo-Profile": "wrong"})
+        self.assertNotIn("Server-Timing", response.headers)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_profile(self):
+        """ Profiled requests should bypass the response cache and write stacks by stage """
+        response = self.client.get(PASSAGE, headers={"X-Nemo-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("urn:cts:latinLit:phi1294.phi002.perseus-lat2", response.data.decode())
+        self.assertIn("total;dur=", response.headers["Server-Timing"])
+        self.assertIn("resolver;dur=", response.headers["Server-Timing"])
+        filename = response.headers["X-Nemo-Profile"]
+        self.assertEqual(os.listdir(self.directory), [filename])
+        with open(os.path.join(self.directory, filename)) as f:
+            lines = f.read().splitlines()
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertIn(stack.split(";")[0], RequestProfiler.STAGES + ("other", ))
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any("r_passage" in line for line in lines), "Stacks should start at the view")
+
+        self.client.get(PASSAGE)
+        response = self.client.get(PASSAGE + "?nemo-profile=secret")
+        self.assertIn("Server-Timing", response.headers, "Cached responses should not be served to profiled requests")
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_off(self):
+        """ Views should not be wrapped without profiler """
+        nemo = Nemo(app=Flask("Nemo"), base_url="", resolver=NautilusDummy)
+        self.assertEqual(nemo.view_maker("r_index").__name__, "route")
+        self.assertEqual(self.nemo.view_maker("r_index").__name__, "profiling")
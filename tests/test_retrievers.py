@@ -0,0 +1,207 @@
+"""
+    Test retrievers
+"""
+from unittest import TestCase
+from datetime import timedelta
+from time import sleep
+
+from io import BytesIO
+from mock import patch
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from requests.exceptions import ConnectionError, HTTPError
+from requests_cache import CachedSession
+
+from flask_nemo.retrievers import CachedHttpCtsRetriever, CircuitBreaker
+from flask_nemo.errors import CircuitOpenError
+
+
+class FakeAdapter(HTTPAdapter):
+    """ Transport adapter answering requests with the content of a file, or failing """
+    def __init__(self, filename):
+        super(FakeAdapter, self).__init__()
+        self.filename = filename
+        self.calls = 0
+        self.fail = False
+        self.status = 200
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("API is down")
+        with open(self.filename, "rb") as f:
+            raw = HTTPResponse(
+                body=BytesIO(f.read()), status=self.status, preload_content=False, request_url=request.url,
+                headers={"Content-Type": "text/xml; charset=utf-8"}
+            )
+        return self.build_response(request, raw)
+
+
+class TestCachedHttpCtsRetriever(TestCase):
+    def make_retriever(self, retriever=None, **kwargs):
+        session = CachedSession("test", backend="memory", allowable_methods=("GET", ), **kwargs)
+        adapter = FakeAdapter("tests/test_data/getpassage.xml")
+        session.mount("http://", adapter)
+        return CachedHttpCtsRetriever(
+            "http://cts.example.com/api/cts", session=session, **(retriever or {})
+        ), adapter
+
+    def wait(self, adapter, calls):
+        for _ in range(100):
+            if adapter.calls >= calls:
+                return
+            sleep(0.01)
+
+    def test_cached(self):
+        """ Identical requests should be sent upstream once """
+        retriever, adapter = self.make_retriever(expire_after=60)
+        first = retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        second = retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        self.assertEqual(first, second)
+        self.assertIn("GetPassage", first)
+        retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2")
+        self.assertEqual(adapter.calls, 2)
+        self.assertEqual(
+            retriever.statistics(),
+            {"requests": 3, "hits": 1, "misses": 2, "stale": 0, "errors": 0}
+        )
+
+    def test_stale_if_error(self):
+        """ Expired responses should be served when the API fails """
+        retriever, adapter = self.make_retriever(expire_after=timedelta(seconds=-1), stale_if_error=True)
+        first = retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        adapter.fail = True
+        self.assertEqual(retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"), first)
+        self.assertEqual(retriever.statistics()["stale"], 1)
+        with self.assertRaises(ConnectionError):
+            retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2")
+        self.assertEqual(retriever.statistics()["errors"], 1)
+
+    def test_stale_while_revalidate(self):
+        """ Expired responses should be served while they are refreshed in the background """
+        retriever, adapter = self.make_retriever(
+            retriever={"stale_while_revalidate": 60}, expire_after=timedelta(seconds=-1)
+        )
+        first = retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        self.assertEqual(adapter.calls, 1)
+        self.assertEqual(retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"), first)
+        self.wait(adapter, 2)
+        self.assertEqual(adapter.calls, 2, "Response should be refreshed in the background")
+        self.assertEqual(retriever.statistics()["stale"], 1)
+
+        key, cached = retriever.cached(
+            {"request": "GetPassage", "urn": "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"}
+        )
+        self.assertIsNotNone(cached)
+        adapter.fail = True
+        thread = retriever.revalidate(key, {"request": "GetPassage"})
+        self.assertIsNone(retriever.revalidate(key, {"request": "GetPassage"}), "Refreshes should not be duplicated")
+        thread.join()
+        thread = retriever.revalidate(key, {"request": "GetPassage"})
+        self.assertIsNotNone(thread, "Failed refreshes should be retried")
+        thread.join()
+
+    def test_stale_while_revalidate_window(self):
+        """ Responses expired for longer than the window should be retrieved before being served """
+        retriever, adapter = self.make_retriever(
+            retriever={"stale_while_revalidate": 1}, expire_after=timedelta(seconds=-10)
+        )
+        retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        self.assertEqual(adapter.calls, 2)
+        self.assertEqual(retriever.statistics()["stale"], 0)
+
+    def test_circuit_breaker(self):
+        """ Requests should not be sent upstream while the API fails """
+        breaker = CircuitBreaker(threshold=0.6, minimum=2, cooldown=60)
+        retriever, adapter = self.make_retriever(
+            retriever={"breaker": breaker}, expire_after=timedelta(seconds=-1), stale_if_error=True
+        )
+        first = retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        adapter.fail = True
+        with self.assertRaises(ConnectionError):
+            retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(
+            retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"), first,
+            "Expired responses should be served when the API fails"
+        )
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN, "Two failures out of three should open the circuit")
+
+        calls = adapter.calls
+        self.assertEqual(retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"), first)
+        with self.assertRaises(CircuitOpenError):
+            retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2")
+        self.assertEqual(adapter.calls, calls, "Open circuit should not send requests")
+        self.assertEqual(retriever.statistics()["stale"], 2)
+        self.assertEqual(retriever.statistics()["errors"], 2)
+        self.assertEqual(breaker.statistics(), {"opened": 1, "rejected": 2, "state": "open"})
+
+    def test_circuit_breaker_client_errors(self):
+        """ Errors answered by the API should not open the circuit """
+        retriever, adapter = self.make_retriever(retriever={"breaker": CircuitBreaker(minimum=1)})
+        adapter.status = 404
+        with self.assertRaises(HTTPError):
+            retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        self.assertEqual(retriever.breaker.state, CircuitBreaker.CLOSED)
+        adapter.status = 500
+        with self.assertRaises(HTTPError):
+            retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        self.assertEqual(retriever.breaker.state, CircuitBreaker.OPEN)
+
+    @patch("flask_nemo.retrievers.monotonic")
+    def test_circuit_breaker_trial_cached(self, monotonic):
+        """ A half-open trial answered by the cache should let the next request through """
+        monotonic.return_value = 0
+        breaker = CircuitBreaker(threshold=0.5, minimum=1, cooldown=30)
+        retriever, adapter = self.make_retriever(retriever={"breaker": breaker}, expire_after=60)
+        retriever.getPassage("urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+        breaker.record(False)
+        monotonic.return_value = 31
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # The trial is allowed, but a concurrent request filled the cache in the meantime
+        self.assertTrue(breaker.allow())
+        retriever.fetch({"request": "GetPassage", "urn": "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"})
+        self.assertEqual(adapter.calls, 1, "Request should be answered by the cache")
+        self.assertTrue(breaker.allow(), "Trial should be given back when the request was not sent upstream")
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestCircuitBreaker(TestCase):
+    @patch("flask_nemo.retrievers.monotonic")
+    def test_half_open(self, monotonic):
+        """ After the cooldown, a single trial request should close or open the circuit again """
+        monotonic.return_value = 0
+        breaker = CircuitBreaker(threshold=0.5, window=10, minimum=2, cooldown=30)
+        breaker.record(False)
+        self.assertTrue(breaker.allow(), "Circuit should not open below the minimum of requests")
+        breaker.record(False)
+        self.assertFalse(breaker.allow())
+
+        monotonic.return_value = 31
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow(), "Only one trial request should be let through")
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN, "Failed trial should open the circuit again")
+
+        monotonic.return_value = 62
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED, "Successful trial should close the circuit")
+        self.assertTrue(breaker.allow())
+
+    @patch("flask_nemo.retrievers.monotonic")
+    def test_window(self, monotonic):
+        """ Failures older than the window should be forgotten """
+        monotonic.return_value = 0
+        breaker = CircuitBreaker(threshold=0.6, window=10, minimum=2, cooldown=30)
+        breaker.record(False)
+        monotonic.return_value = 20
+        breaker.record(True)
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
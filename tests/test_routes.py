@@ -7,6 +7,9 @@ from flask_nemo import Nemo
 from flask import Flask
 from mock import Mock, patch, call
 from jinja2.exceptions import TemplateNotFound
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
 
 
 class NemoTestRoutesBusiness(NemoResource):
@@ -72,4 +75,37 @@ class NemoTestRoutesBusiness(NemoResource):
         self.assertIn("I am A CONTAINER ! Isn't it sweet !", html)
 
         with self.assertRaises(TemplateNotFound):
-            html, path, function = blueprint.jinja_loader.get_source("", "addendum::unknown.html")
\ No newline at end of file
+            html, path, function = blueprint.jinja_loader.get_source("", "addendum::unknown.html")
+
+    def test_production_templates(self):
+        """ Production mode should resolve templates once and never consider them outdated """
+        app = Flask(__name__)
+        nemo = Nemo(
+            app=app, production=True,
+            templates={
+                "main": "tests/test_data/plugin_templates_main/main",
+                "addendum": "tests/test_data/plugin_templates_main/plugin"
+            }
+        )
+        blueprint = nemo.create_blueprint()
+
+        html, path, uptodate = blueprint.jinja_loader.get_source("", "main::container.html")
+        self.assertIn("I am A CONTAINER ! Isn't it sweet !", html, "Instance templates should override main ones")
+        self.assertTrue(uptodate())
+        html, path, uptodate = blueprint.jinja_loader.get_source("", "main::menu.html")
+        self.assertTrue(path.endswith("menu.html"), "Main templates should still be available")
+        self.assertIn("addendum::r_double.html", blueprint.jinja_loader.list_templates())
+        with self.assertRaises(TemplateNotFound):
+            blueprint.jinja_loader.get_source("", "addendum::unknown.html")
+        self.assertFalse(app.jinja_env.auto_reload)
+
+    def test_bytecode_cache(self):
+        """ Compiled templates should be written to the bytecode cache directory """
+        directory = mkdtemp()
+        try:
+            app = Flask(__name__)
+            nemo = Nemo(app=app, bytecode_cache=directory)
+            app.jinja_env.get_template("main::index.html")
+            self.assertGreater(len(os.listdir(directory)), 0)
+        finally:
+            rmtree(directory)
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+    Test production serving
+"""
+from unittest import TestCase
+from threading import Thread, Event
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import os.path as op
+import signal
+import time
+
+from flask import Flask
+from mock import patch
+
+from flask_nemo import Nemo
+from flask_nemo.cmd import Server
+from flask_nemo.serving import PreforkServer, PooledWSGIServer
+from tests.test_resources import NautilusDummy
+
+
+class TestPreforkServer(TestCase):
+    def setUp(self):
+        self.app = Flask("Nemo")
+        self.nemo = Nemo(app=self.app, base_url="", resolver=NautilusDummy)
+
+    def test_single_worker(self):
+        """ A single worker should serve requests in the current process with a pool of threads """
+        server = PreforkServer(self.app, port=0, workers=1, threads=4, preload=self.nemo.preload)
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            while server.server is None:
+                time.sleep(0.01)
+            self.assertTrue(server.server.multithread)
+            url = "http://127.0.0.1:{}/collections/urn:cts:latinLit:phi1294".format(server.port)
+            self.assertIn("Epigrammata", urlopen(url).read().decode())
+            self.assertIsNotNone(self.nemo._inventory_index, "Inventory index should be preloaded")
+        finally:
+            server.stop()
+            thread.join()
+
+    def record(self, path):
+        with open(path, "a") as f:
+            f.write("{}\n".format(os.getpid()))
+
+    def test_workers(self):
+        """ Workers should be forked after preloading and serve from the shared socket """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        preloaded, forked = op.join(directory, "preloaded"), op.join(directory, "forked")
+        server = PreforkServer(
+            self.app, port=0, workers=2, threads=2,
+            preload=lambda: self.record(preloaded), post_fork=lambda: self.record(forked)
+        )
+        server.bind()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        server.socket.close()
+        try:
+            url = "http://127.0.0.1:{}/collections/urn:cts:latinLit:phi1294".format(server.port)
+            for _ in range(4):
+                self.assertIn("Epigrammata", urlopen(url, timeout=10).read().decode())
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0, "Master process should stop its workers and exit")
+        with open(preloaded) as f:
+            self.assertEqual(f.read().split(), [str(pid)], "Preloading should happen once, in the master process")
+        with open(forked) as f:
+            workers = f.read().split()
+        self.assertEqual(len(set(workers)), 2, "Each worker should run the post-fork function")
+        self.assertNotIn(str(pid), workers)
+
+    def test_queue_full(self):
+        """ Connections should be refused once the threads are busy and the queue is full """
+        release = Event()
+
+        def app(environ, start_response):
+            release.wait(10)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"done"]
+        server = PooledWSGIServer("127.0.0.1", 0, app, threads=1, max_queue=0, queue_timeout=0.1)
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        url = "http://127.0.0.1:{}/".format(server.port)
+        busy = Thread(target=lambda: urlopen(url, timeout=10).read())
+        busy.start()
+        try:
+            time.sleep(0.2)
+            with self.assertRaises(HTTPError) as error:
+                urlopen(url, timeout=10)
+            self.assertEqual(error.exception.code, 503)
+        finally:
+            release.set()
+            busy.join()
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.assertEqual(server.slots.acquire(blocking=False), True, "Slots should be released")
+
+    @patch("flask_nemo.cmd.PreforkServer")
+    def test_cmd(self, prefork):
+        with patch("sys.argv", ["capitains-nemo", "cts-local", "./tests/test_data/nautilus/farsiLit",
+                                "--workers", "3", "--threads", "8"]):
+            with patch("sys.stdout"), patch.object(Server, "print_statistics") as print_statistics:
+                nemo, app = Server.cmd()
+        prefork.assert_called_once_with(
+            app, host="127.0.0.1", port=8000, workers=3, threads=8, preload=nemo.preload, post_fork=None
+        )
+        prefork.return_value.serve_forever.assert_called_once_with()
+        print_statistics.assert_not_called()
+
+        with patch("sys.argv", ["capitains-nemo", "cts-local", "./tests/test_data/nautilus/farsiLit",
+                                "--threads", "8"]):
+            with patch("sys.stdout"), patch.object(Server, "print_statistics") as print_statistics:
+                nemo, app = Server.cmd()
+        print_statistics.assert_called_once_with(nemo)
@@ -0,0 +1,287 @@
+"""
+    Test persistent stores
+"""
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree, copyfile
+import os.path as op
+
+from flask import Flask
+from MyCapytain.common.reference import Citation
+
+from flask_nemo import Nemo
+from flask_nemo.store import ReferenceStore, PassageStore, source_checksum
+from flask_nemo.chunker import level_grouper, size_grouper, PassageSizes
+from flask_nemo.common import callable_fingerprint
+from tests.test_resources import NautilusDummy
+from mock import patch
+
+
+class FakeText(object):
+    """ Minimal text metadata object """
+    def __init__(self, id, path=None):
+        self.id = id
+        self.path = path
+        self.citation = Citation(name="book", child=Citation(name="line"))
+
+
+class FakePassage(object):
+    """ Minimal passage object """
+    def get_title(self, lang=None):
+        return {"fre": "Epigrammes"}.get(lang, "Epigrammata")
+
+    def get_creator(self, lang=None):
+        return "Martial"
+
+    def get_description(self, lang=None):
+        return None
+
+
+class TestReferenceStore(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def getreffs(self, level):
+        self.calls.append(level)
+        return ["1.1", "1.2", "1.3", "2.1"]
+
+    def test_persisted_across_instances(self):
+        """ Tables computed by a store should be read by another store using the same directory """
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        chunker = lambda x, y: level_grouper(x, y, groupby=2)
+        chunks = ReferenceStore(self.directory).chunks(text, chunker, self.getreffs)
+        self.assertEqual(chunks, [("1.1-1.2", "1.1-1.2"), ("1.3", "1.3"), ("2.1", "2.1")])
+        self.assertEqual(self.calls, [2])
+
+        store = ReferenceStore(self.directory)
+        self.assertEqual(store.chunks(text, chunker, self.getreffs), chunks, "Chunks should be read from disk")
+        self.assertEqual(self.calls, [2], "References should not be requested again")
+        self.assertEqual(store.reffs(text, 2, self.getreffs), ["1.1", "1.2", "1.3", "2.1"])
+
+        other_chunks = store.chunks(text, lambda x, y: level_grouper(x, y, groupby=3), self.getreffs)
+        self.assertEqual(other_chunks, [("1.1-1.3", "1.1-1.3"), ("2.1", "2.1")])
+        self.assertEqual(self.calls, [2], "Stored references should be reused by other chunkers")
+
+    def test_stale_chunks_dropped(self):
+        """ Output of previous chunkers should be dropped when another chunker writes to the tables """
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        store = ReferenceStore(self.directory)
+        store.hierarchy(text, lambda x, y: level_grouper(x, y, groupby=2), self.getreffs)
+        store.hierarchy(text, lambda x, y: level_grouper(x, y, groupby=3), self.getreffs)
+        table = ReferenceStore(self.directory).read(text.id)
+        self.assertEqual(len(table["chunks"]), 1)
+        self.assertEqual(len(table["hierarchies"]), 1)
+        self.assertEqual(list(table["chunks"].values())[0], [["1.1-1.3", "1.1-1.3"], ["2.1", "2.1"]])
+
+    def test_fingerprint_stable(self):
+        """ Fingerprints should not depend on the memory address of the objects a chunker closes over """
+        def make_chunker(sizes):
+            return lambda text, getreffs: size_grouper(text, getreffs, sizes=sizes, budget=5000)
+        self.assertEqual(
+            callable_fingerprint(make_chunker(PassageSizes(NautilusDummy))),
+            callable_fingerprint(make_chunker(PassageSizes(NautilusDummy)))
+        )
+        self.assertNotEqual(
+            callable_fingerprint(make_chunker(PassageSizes(NautilusDummy))),
+            callable_fingerprint(make_chunker(PassageSizes(NautilusDummy, unit="tokens")))
+        )
+
+    def test_fingerprint_globals(self):
+        """ Fingerprints should change with the constants a chunker reads from its module """
+        source = "def chunker(text, getreffs):\n    return level_grouper(text, getreffs, groupby=GROUPBY)\n"
+        fingerprints = []
+        for groupby in (2, 2, 3):
+            module = {"level_grouper": level_grouper, "GROUPBY": groupby}
+            exec(source, module)
+            fingerprints.append(callable_fingerprint(module["chunker"]))
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def test_source_checksum_validation(self):
+        """ Tables should be discarded when the source of a text changes """
+        source = op.join(self.directory, "text.xml")
+        copyfile("tests/test_data/getpassage.xml", source)
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2", path=source)
+        ReferenceStore(self.directory).chunks(text, level_grouper, self.getreffs)
+        ReferenceStore(self.directory).chunks(text, level_grouper, self.getreffs)
+        self.assertEqual(len(self.calls), 1, "Tables should be valid as long as the source is the same")
+
+        with open(source, "a") as f:
+            f.write("<!-- Modified -->")
+        ReferenceStore(self.directory).chunks(text, level_grouper, self.getreffs)
+        self.assertEqual(len(self.calls), 2, "Tables should be recomputed when the source changed")
+
+    def test_hierarchy(self):
+        """ Hierarchies should be stored alongside chunks """
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        chunker = lambda x, y: level_grouper(x, y, groupby=2)
+        hierarchy = ReferenceStore(self.directory).hierarchy(text, chunker, self.getreffs)
+        self.assertEqual(
+            hierarchy,
+            {"%book|1%": {"1.1-1.2": "1.1-1.2", "1.3": "1.3"}, "%book|2%": {"2.1": "2.1"}}
+        )
+        self.assertEqual(ReferenceStore(self.directory).hierarchy(text, chunker, self.getreffs), hierarchy)
+        self.assertEqual(
+            list(ReferenceStore(self.directory).hierarchy(text, chunker, self.getreffs)["%book|1%"].keys()),
+            ["1.1-1.2", "1.3"],
+            "Order of references should be kept"
+        )
+        self.assertEqual(self.calls, [2])
+
+    def test_invalidate(self):
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        store = ReferenceStore(self.directory)
+        store.chunks(text, level_grouper, self.getreffs)
+        store.invalidate(text.id)
+        self.assertFalse(op.isfile(store.filename(text.id)))
+        store.chunks(text, level_grouper, self.getreffs)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_source_checksum(self):
+        self.assertIsNone(source_checksum(FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")))
+        self.assertEqual(
+            len(source_checksum(NautilusDummy.getMetadata()["urn:cts:latinLit:phi1294.phi002.perseus-lat2"])), 40
+        )
+
+    def test_nemo_get_reffs(self):
+        """ Nemo should read chunked references from its store """
+        nemo = Nemo(
+            app=Flask("Nemo"),
+            resolver=NautilusDummy,
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=20)},
+            reference_store=ReferenceStore(self.directory)
+        )
+        reffs = nemo.get_reffs("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        self.assertEqual(reffs[0], ("1.pr.1-1.pr.20", "1.pr.1-1.pr.20"))
+
+        nemo = Nemo(
+            app=Flask("Nemo"),
+            resolver=NautilusDummy,
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=20)},
+            reference_store=ReferenceStore(self.directory)
+        )
+        nemo.resolver = None  # Any call to the resolver would fail
+        nemo._inventory = NautilusDummy.getMetadata()
+        self.assertEqual(nemo.get_reffs("urn:cts:latinLit:phi1294.phi002.perseus-lat2"), reffs)
+        self.assertEqual(
+            nemo.get_hierarchy("urn:cts:latinLit:phi1294.phi002.perseus-lat2")["%book|1%"]["%poem|pr%"],
+            {"1.pr.1-1.pr.20": "1.pr.1-1.pr.20", "1.pr.21-1.pr.22": "1.pr.21-1.pr.22"}
+        )
+
+    def test_nemo_hierarchy_in_process(self):
+        """ Without cache nor store, hierarchies should be built once per text until the text is invalidated """
+        nemo = Nemo(app=Flask("Nemo"), resolver=NautilusDummy)
+        text = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+        with patch.object(nemo, "get_reffs", wraps=nemo.get_reffs) as get_reffs:
+            hierarchy = nemo.get_hierarchy(text)
+            self.assertIs(nemo.get_hierarchy(text), hierarchy)
+            self.assertEqual(get_reffs.call_count, 1)
+            nemo.invalidate([text], reload=False)
+            self.assertEqual(nemo.get_hierarchy(text), hierarchy)
+            self.assertEqual(get_reffs.call_count, 2)
+
+    def test_nemo_chunk_overridden(self):
+        """ Chunks should be computed through Nemo.chunk, which subclasses can override """
+        class ReversedNemo(Nemo):
+            def chunk(self, text, reffs):
+                return list(reversed(super(ReversedNemo, self).chunk(text, reffs)))
+
+        reffs = Nemo(
+            app=Flask("Nemo"), resolver=NautilusDummy, reference_store=ReferenceStore(self.directory)
+        ).get_reffs("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        nemo = ReversedNemo(app=Flask("Nemo"), resolver=NautilusDummy, reference_store=ReferenceStore(self.directory))
+        self.assertNotEqual(
+            nemo.chunker_fingerprint("urn:cts:latinLit:phi1294.phi002.perseus-lat2"),
+            Nemo(resolver=NautilusDummy).chunker_fingerprint("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        )
+        self.assertEqual(nemo.get_reffs("urn:cts:latinLit:phi1294.phi002.perseus-lat2"), list(reversed(reffs)))
+
+
+class TestPassageStore(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = op.join(self.directory, "passages", "store.sqlite")
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_put_get(self):
+        """ Passages should be shared across instances and keep their metadata """
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        PassageStore(self.path).put(text, "1.1", "none", FakePassage(), "<p>Text</p>", ("1.0", "1.2"), ["fre"])
+        stored = PassageStore(self.path).get(text, "1.1", "none")
+        self.assertEqual(stored.html, "<p>Text</p>")
+        self.assertEqual(stored.siblingsId, ("1.0", "1.2"))
+        self.assertEqual(stored.get_title("fre"), "Epigrammes")
+        self.assertEqual(stored.get_title("eng"), "Epigrammata", "Unknown langs should fall back to the default")
+        self.assertEqual(stored.get_creator(), "Martial")
+        self.assertIsNone(stored.get_description())
+        self.assertIsNone(PassageStore(self.path).get(text, "1.1", "xsl:other"))
+        self.assertIsNone(PassageStore(self.path).get(text, "1.2", "none"))
+
+    def test_source_change(self):
+        """ Passages should be discarded when the source of their text changes """
+        source = op.join(self.directory, "text.xml")
+        copyfile("tests/test_data/getpassage.xml", source)
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2", path=source)
+        store = PassageStore(self.path)
+        store.put(text, "1.1", "none", FakePassage(), "<p>Text</p>", (None, None))
+        self.assertIsNotNone(store.get(text, "1.1", "none"))
+        with open(source, "a") as f:
+            f.write("<!-- Modified and longer -->")
+        self.assertIsNone(store.get(text, "1.1", "none"))
+
+    def test_invalidate(self):
+        text = FakeText("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        store = PassageStore(self.path)
+        store.put(text, "1.1", "none", FakePassage(), "<p>Text</p>", (None, None))
+        store.invalidate(text.id)
+        self.assertIsNone(store.get(text, "1.1", "none"))
+
+    def test_nemo(self):
+        """ Nemo should render stored passages without the resolver and follow stylesheet changes """
+        stylesheet = op.join(self.directory, "transform.xsl")
+        copyfile("tests/test_data/xsl_test.xml", stylesheet)
+        app = Flask("Nemo")
+        nemo = Nemo(
+            app=app, base_url="", resolver=NautilusDummy, transform={"default": stylesheet},
+            passage_store=PassageStore(self.path)
+        )
+        client = app.test_client()
+        url = "/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1"
+        first = client.get(url).data.decode()
+        with patch.object(nemo, "get_passage") as get_passage:
+            self.assertEqual(client.get(url).data.decode(), first)
+            get_passage.assert_not_called()
+
+        fingerprint = nemo.transform_fingerprint("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        with open(stylesheet, "a") as f:
+            f.write("<!-- Modified stylesheet -->")
+        self.assertNotEqual(nemo.transform_fingerprint("urn:cts:latinLit:phi1294.phi002.perseus-lat2"), fingerprint)
+        with patch.object(nemo, "get_passage", wraps=nemo.get_passage) as get_passage:
+            client.get(url)
+            get_passage.assert_called_once()
+
+    def test_nemo_chunker(self):
+        """ Stored passages should not be reused by another chunker, as their siblings depend on it """
+        app = Flask("Nemo")
+        nemo = Nemo(app=app, base_url="", resolver=NautilusDummy, passage_store=PassageStore(self.path))
+        url = "/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1"
+        app.test_client().get(url)
+
+        app = Flask("Nemo")
+        other = Nemo(
+            app=app, base_url="", resolver=NautilusDummy, passage_store=PassageStore(self.path),
+            chunker={"default": lambda text, getreffs: level_grouper(text, getreffs, groupby=5)}
+        )
+        self.assertNotEqual(
+            other.passage_fingerprint("urn:cts:latinLit:phi1294.phi002.perseus-lat2"),
+            nemo.passage_fingerprint("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        )
+        with patch.object(other, "get_passage", wraps=other.get_passage) as get_passage:
+            app.test_client().get(url)
+            get_passage.assert_called_once()
@@ -0,0 +1,174 @@
+"""
+    Test transformations in worker processes
+"""
+from unittest import TestCase, skipUnless
+from tempfile import mkdtemp
+from shutil import rmtree, copyfile
+import os
+import os.path as op
+import time
+
+from flask import Flask
+from lxml import etree
+
+from flask_nemo import Nemo
+from flask_nemo.errors import TransformTimeout, TransformInputTooLarge
+from flask_nemo.transform import TransformPool, transform_input
+from MyCapytain.common.constants import Mimetypes
+from mock import Mock
+from tests.test_resources import NautilusDummy
+
+
+class TestTransformPool(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = mkdtemp()
+        cls.stylesheet = op.join(cls.directory, "transform.xsl")
+        copyfile("tests/test_data/xsl_test.xml", cls.stylesheet)
+        cls.pool = TransformPool([cls.stylesheet], workers=1, timeout=10)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        rmtree(cls.directory)
+
+    def make_nemo(self, **kwargs):
+        app = Flask("Nemo")
+        nemo = Nemo(app=app, base_url="", resolver=NautilusDummy, transform={"default": self.stylesheet}, **kwargs)
+        return nemo, app.test_client()
+
+    def test_same_output(self):
+        """ Pages transformed in workers should be the ones transformed in the serving thread """
+        url = "/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1"
+        _, client = self.make_nemo(transform_pool=self.pool)
+        _, reference = self.make_nemo()
+        self.assertEqual(client.get(url).data, reference.get(url).data)
+
+    def test_max_input_size(self):
+        pool = TransformPool([self.stylesheet], workers=1, max_input_size=10)
+        try:
+            with self.assertRaises(TransformInputTooLarge):
+                pool.transform(self.stylesheet, etree.fromstring("<TEI><text>Arma virumque cano</text></TEI>"))
+            _, client = self.make_nemo(transform_pool=pool)
+            response = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1")
+            self.assertEqual(response.status_code, 503)
+        finally:
+            pool.close()
+
+    def test_timeout(self):
+        """ Workers should be replaced after a timeout """
+        pool = TransformPool([self.stylesheet], workers=1, timeout=0.000001)
+        try:
+            with self.assertRaises(TransformTimeout):
+                pool.transform(self.stylesheet, etree.fromstring("<TEI><text>Arma virumque cano</text></TEI>"))
+            pool.timeout = 10
+            self.assertIn("Arma", pool.transform(
+                self.stylesheet, etree.fromstring('<TEI xmlns="http://www.tei-c.org/ns/1.0"><body>Arma</body></TEI>')
+            ))
+        finally:
+            pool.close()
+
+    def test_restart_keeps_pending(self):
+        """ Transformations given to stalled workers should complete while new ones go to new workers """
+        pool = TransformPool([self.stylesheet], workers=2, timeout=10)
+        try:
+            executor, pending = pool.submit(time.sleep, 0.5)
+            start = time.monotonic()
+            thread = pool.restart(executor)
+            self.assertLess(time.monotonic() - start, 0.4, "Restart should not block the request thread")
+            self.assertIsNot(pool.executor(), executor, "New transformations should go to new workers")
+            self.assertIsNone(pool.restart(executor), "Replaced executors should not be restarted twice")
+            self.assertIsNone(pending.result(timeout=5), "Pending transformations should not be failed")
+            thread.join()
+            self.assertIn("Arma", pool.transform(
+                self.stylesheet, etree.fromstring('<TEI xmlns="http://www.tei-c.org/ns/1.0"><body>Arma</body></TEI>')
+            ))
+        finally:
+            pool.close()
+
+    @skipUnless(hasattr(os, "fork"), "Requires os.fork")
+    def test_fork(self):
+        """ Forked processes should start their own workers instead of using the ones of their parent """
+        pool = TransformPool([self.stylesheet], workers=1, timeout=10)
+        try:
+            pool.start()
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    html = pool.transform(
+                        self.stylesheet,
+                        etree.fromstring('<TEI xmlns="http://www.tei-c.org/ns/1.0"><body>Arma</body></TEI>')
+                    )
+                    os.write(write, html.encode("utf-8"))
+                finally:
+                    os._exit(0)
+            os.close(write)
+            with os.fdopen(read, "rb") as f:
+                self.assertIn(b"Arma", f.read())
+            os.waitpid(pid, 0)
+        finally:
+            pool.close()
+
+    def test_contains(self):
+        nemo, _ = self.make_nemo(transform_pool=self.pool)
+        self.assertIn(self.stylesheet, nemo.transform_pool)
+        self.assertNotIn("other.xsl", nemo.transform_pool)
+
+
+class TestTransformInput(TestCase):
+    def make_nemo(self, transform):
+        app = Flask("Nemo")
+        nemo = Nemo(app=app, base_url="", resolver=NautilusDummy, transform=transform)
+        return nemo, app.test_client()
+
+    def test_declaration(self):
+        @transform_input("stream")
+        def streaming(work, xml, objectId, subreference=None):
+            return ""
+
+        self.assertEqual(streaming.transform_input, "stream")
+        with self.assertRaises(ValueError):
+            transform_input("dictionary")
+
+        nemo, _ = self.make_nemo({
+            "default": lambda work, xml, objectId, subreference=None: "",
+            "urn:cts:latinLit:phi1294.phi002.perseus-lat2": streaming,
+            "urn:cts:latinLit:phi1294.phi002.perseus-lat3": "tests/test_data/xsl_test.xml",
+            "urn:cts:latinLit:phi1294.phi002.perseus-lat4": None
+        })
+        self.assertEqual(nemo.transform_input("urn:cts:latinLit:phi1294.phi001.perseus-lat2"), "etree")
+        self.assertEqual(nemo.transform_input("urn:cts:latinLit:phi1294.phi002.perseus-lat2"), "stream")
+        self.assertEqual(nemo.transform_input("urn:cts:latinLit:phi1294.phi002.perseus-lat3"), "etree")
+        self.assertEqual(nemo.transform_input("urn:cts:latinLit:phi1294.phi002.perseus-lat4"), "string")
+
+    def test_no_transform(self):
+        """ Passages should be exported as strings when there is no transformation """
+        nemo, client = self.make_nemo(None)
+        passage = Mock(**{"export.return_value": "<TEI/>"})
+        self.assertEqual(nemo.export_passage(passage, "urn:cts:latinLit:phi1294.phi002.perseus-lat2"), "<TEI/>")
+        passage.export.assert_called_once_with(Mimetypes.XML.TEI)
+
+        response = client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1").data.decode()
+        self.assertIn("Spero me secutum in libellis meis", response)
+
+    def test_inputs(self):
+        """ Functions should receive the input they declared """
+        received = dict()
+
+        @transform_input("string")
+        def string(work, xml, objectId, subreference=None):
+            received["string"] = xml
+            return ""
+
+        @transform_input("stream")
+        def stream(work, xml, objectId, subreference=None):
+            received["stream"] = [element.tag for _, element in etree.iterparse(xml)]
+            return ""
+
+        for function in (string, stream):
+            _, client = self.make_nemo({"default": function})
+            client.get("/text/urn:cts:latinLit:phi1294.phi002.perseus-lat2/passage/1.pr.1")
+        self.assertIsInstance(received["string"], str)
+        self.assertIn("Spero me secutum", received["string"])
+        self.assertIn("{http://www.tei-c.org/ns/1.0}TEI", received["stream"])
@@ -0,0 +1,132 @@
+"""
+    Test the selective invalidation of texts whose files changed
+"""
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree, copytree, copyfile
+import os
+import os.path as op
+
+from flask import Flask
+from flask_caching import Cache
+from MyCapytain.resolvers.cts.local import CtsCapitainsLocalResolver
+
+from flask_nemo import Nemo
+from flask_nemo.watcher import CorpusWatcher
+
+
+TEXT = "urn:cts:farsiLit:hafez.divan.perseus-eng1"
+OTHER = "urn:cts:farsiLit:hafez.divan.perseus-ger1"
+
+
+class TestCorpusWatcher(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.corpus = op.join(self.directory, "farsiLit")
+        copytree("./tests/test_data/nautilus/farsiLit", self.corpus)
+        self.work = op.join(self.corpus, "data", "hafez", "divan")
+        self.app = Flask("Nemo")
+        self.nemo = Nemo(
+            app=self.app,
+            base_url="",
+            cache=Cache(app=self.app, config={"CACHE_TYPE": "simple"}),
+            resolver=CtsCapitainsLocalResolver([self.corpus]),
+            response_cache=True
+        )
+        self.client = self.app.test_client()
+        self.watcher = CorpusWatcher(self.nemo)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def edit(self, filename, before, after):
+        path = op.join(self.work, filename)
+        with open(path) as f:
+            content = f.read()
+        with open(path, "w") as f:
+            f.write(content.replace(before, after))
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_text_changed(self):
+        """ Passages of a changed text should be served fresh while other texts keep their cached entries """
+        url = "/text/{}/passage/1.1.1.1".format(TEXT)
+        self.assertEqual(self.watcher.check(), [], "First check should only record the files")
+        self.assertIn("Ho ! Saki", self.client.get(url).data.decode())
+        calls = []
+        getReffs = self.nemo.resolver.getReffs
+        self.nemo.resolver.getReffs = lambda textId, **kwargs: calls.append(textId) or getReffs(textId, **kwargs)
+        with self.app.app_context():
+            other = self.nemo.get_reffs(OTHER)
+            self.assertEqual(self.nemo.get_reffs(OTHER), other)
+            self.assertEqual(len(calls), 1, "References should be memoized")
+
+        self.edit("hafez.divan.perseus-eng1.xml", "Ho ! Saki", "Hey ! Saki")
+        self.assertEqual(self.watcher.check(), [TEXT])
+        self.assertIn("Hey ! Saki", self.client.get(url).data.decode(), "Response cache should be invalidated")
+        with self.app.app_context():
+            self.assertEqual(self.nemo.get_reffs(OTHER), other)
+            self.assertEqual(
+                calls, [OTHER, TEXT], "Only the references of the changed text should be retrieved again"
+            )
+            self.assertEqual(self.nemo.generation(TEXT), 1)
+            self.assertEqual(self.nemo.generation("urn:cts:farsiLit:hafez.divan"), 0)
+            self.assertEqual(self.nemo.generation(OTHER), 0)
+        self.assertEqual(self.watcher.check(), [], "Unchanged files should not be reported twice")
+
+    def test_metadata_changed(self):
+        """ Changing the metadata of a work should reload the labels of its texts """
+        self.watcher.check()
+        self.assertIn("(English)", self.client.get("/collections/urn:cts:farsiLit:hafez.divan").data.decode())
+        self.edit("__cts__.xml", "(English)", "(Anglais)")
+        self.assertEqual(
+            sorted(self.watcher.check()),
+            sorted(["urn:cts:farsiLit:hafez.divan.perseus-far1", TEXT, OTHER])
+        )
+        page = self.client.get("/collections/urn:cts:farsiLit:hafez.divan").data.decode()
+        self.assertIn("(Anglais)", page)
+        self.assertNotIn("(English)", page)
+        self.assertEqual(str(self.nemo.get_collection(TEXT).get_label("eng")), "Divān (Anglais)")
+        work = self.nemo.get_collection(TEXT).parent
+        self.assertIs(work.parent.children[work.id], work, "The reloaded work should replace the former one")
+
+    def test_reload_unsupported(self):
+        """ Resolvers without the parsing methods of the local resolver should not be reloaded """
+        parse_work = CtsCapitainsLocalResolver._parse_work
+        del CtsCapitainsLocalResolver._parse_work
+        try:
+            self.assertFalse(self.nemo.reload([TEXT]))
+        finally:
+            CtsCapitainsLocalResolver._parse_work = parse_work
+
+    def test_text_added(self):
+        """ Texts added to the metadata of a work should be known to the resolver and to Nemo """
+        added = "urn:cts:farsiLit:hafez.divan.perseus-ger2"
+        self.watcher.check()
+        copyfile(op.join(self.work, "hafez.divan.perseus-ger1.xml"), op.join(self.work, "hafez.divan.perseus-ger2.xml"))
+        with open(op.join(self.work, "__cts__.xml")) as f:
+            metadata = f.read()
+        start = metadata.index('<ti:translation  xml:lang="ger"')
+        end = metadata.index("</ti:translation>", start) + len("</ti:translation>")
+        self.edit(
+            "__cts__.xml", "</ti:work>", metadata[start:end].replace("perseus-ger1", "perseus-ger2") + "</ti:work>"
+        )
+        self.watcher.check()
+        self.assertIn(added, [str(text.id) for text in self.nemo.resolver.texts])
+        self.assertEqual(str(self.nemo.get_collection(added).id), added)
+        self.assertIn("Reich mir", self.client.get("/text/{}/passage/1.1.1.1".format(added)).data.decode())
+
+    def test_invalidate_without_cache(self):
+        """ Generations of tags should be kept in the instance when there is no cache """
+        nemo = Nemo(
+            app=Flask("Nemo"), base_url="", resolver=CtsCapitainsLocalResolver([self.corpus])
+        )
+        self.assertEqual(
+            nemo.invalidate(["urn:cts:farsiLit:hafez.divan.perseus-far1", "urn:cts:farsiLit:unknown"], reload=False),
+            ["urn:cts:farsiLit:hafez.divan.perseus-far1"] + [
+                "members|" + ancestor
+                for ancestor in nemo.inventory_index.ancestors("urn:cts:farsiLit:hafez.divan.perseus-far1")
+            ]
+        )
+        self.assertEqual(nemo.generation("urn:cts:farsiLit:hafez.divan.perseus-far1"), 1)
+        self.assertEqual(nemo.generation(TEXT), 0)